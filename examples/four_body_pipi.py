@@ -113,7 +113,8 @@ def amplitude(momenta):
     for name in argnames:
         print(name)
 
-    # an issue with jax, where the internal caching structure needs to be prewarmed, so that in the compilation step the correct types are inferred
+    # the parameter independent angular part is evaluated once here, so that it does not end up in the traced function
+    full.precompute()
     print(unpolarized(*([1.0] * len(argnames))))
 
     # we can now jit the function, to make it faster after the compile
@@ -97,7 +97,8 @@ def shortFourBodyAmplitudeBW():
     # so unpolarized(*[1, 2, 3, 4, 5, 6]) is the same as unpolarized(mass_resonance_1=1, width_resonance_1=2, mass_resonance_2=3, width_resonance_2=4, mass_resonance_3=5, width_resonance_3=6), omitting the couplings
     print(argnames)
 
-    # an issue with jax, where the internal caching structure needs to be prewarmed, so that in the compilation step the correct types are inferred
+    # the parameter independent angular part is evaluated once here, so that it does not end up in the traced function
+    full.precompute()
     print(unpolarized(*([1.0] * len(argnames))))
     
     # we can now jit the function, to make it faster after the compile
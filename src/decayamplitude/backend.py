@@ -1,3 +1,73 @@
-from jax import config
-config.update("jax_enable_x64", True)
-import jax.numpy as numpy
\ No newline at end of file
+from jax import config as jax_config, ensure_compile_time_eval
+jax_config.update("jax_enable_x64", True)
+
+from typing import Callable
+
+from decayamplitude.config import config
+
+
+class _Backend:
+    """
+    Forwards every attribute to the array module selected by `config.backend`, so that the whole package can be switched at runtime.
+    All modules import this object as np. An attribute is resolved once and then read from the instance dict,
+    which is cleared, when the backend is changed.
+    """
+
+    def __getattr__(self, name: str):
+        # only called for attributes, which were not resolved for the current backend yet
+        value = getattr(config.backend, name)
+        self.__dict__[name] = value
+        return value
+
+    def reset(self) -> None:
+        """
+        Forgets all resolved attributes, so they are looked up in the new backend.
+        """
+        self.__dict__.clear()
+
+    def __repr__(self) -> str:
+        return f"<decayamplitude backend {config.backend.__name__}>"
+
+
+numpy = _Backend()
+config.on_backend_change(numpy.reset)
+
+
+class backend_cached_property:
+    """
+    Like `functools.cached_property`, but the value is computed again, if it was computed for another backend.
+    Used for the arrays, which objects cache for their own momenta, so that no jax arrays are kept after switching to numpy and vice versa.
+    A value, which is assigned explicitly, is kept for all backends.
+    """
+
+    def __init__(self, func: Callable) -> None:
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner, name: str) -> None:
+        self.attrname = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        backend, value = instance.__dict__.get(self.attrname, (None, None))
+        if backend is config.backend or backend is _ANY_BACKEND:
+            return value
+        value = self.func(instance)
+        instance.__dict__[self.attrname] = (config.backend, value)
+        return value
+
+    def __set__(self, instance, value) -> None:
+        instance.__dict__[self.attrname] = (_ANY_BACKEND, value)
+
+
+# marks values of a `backend_cached_property`, which were assigned and not computed
+_ANY_BACKEND = object()
+
+
+def require_jax(what: str) -> None:
+    """
+    Raises a ValueError, if the numpy backend is selected for something, which needs jit or gradients.
+    """
+    if config.backend is not config.backend_map["jax"]:
+        raise ValueError(f"{what} needs the jax backend, set config.backend = 'jax'")
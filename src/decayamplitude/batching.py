@@ -0,0 +1,81 @@
+from typing import Iterable, Iterator, Optional, Union
+import numpy as onp
+
+
+def n_events(momenta: dict) -> int:
+    """
+    Number of events in a dict of four-momenta with shape (N, 4).
+    """
+    return len(next(iter(momenta.values())))
+
+
+def _like(momenta: dict, values: dict) -> dict:
+    # samples, which are not plain dicts of four-momenta (e.g. DalitzVariables), keep their type and static data
+    return momenta.like(values) if hasattr(momenta, "like") else values
+
+
+def pad_batch(momenta: dict, weights: Optional[onp.ndarray], batch_size: int) -> tuple[dict, onp.ndarray]:
+    """
+    Pad a batch of events to exactly batch_size events, so that every batch has the same shape and the compiled kernel can be reused.
+    The padding repeats the first event of the batch, so that all kinematic quantities stay finite. The padded events get the weight 0.
+
+    Parameters:
+    momenta: dict
+        The four-momenta of the final state particles with shape (n, 4) and n <= batch_size
+    weights: array
+        Per event weights. If None, all events get the weight 1
+    batch_size: int
+        The size of the padded batch
+
+    Returns:
+    tuple[dict, array]
+        The padded momenta and weights
+    """
+    n = n_events(momenta)
+    if weights is None:
+        weights = onp.ones(n)
+    weights = onp.asarray(weights, dtype=onp.float64)
+    if n > batch_size:
+        raise ValueError(f"The batch contains {n} events, but the batch size is {batch_size}")
+    if n == batch_size:
+        return momenta, weights
+    padding = batch_size - n
+    padded_momenta = _like(momenta, {
+        key: onp.concatenate([value, onp.repeat(onp.asarray(value)[:1], padding, axis=0)], axis=0)
+        for key, value in momenta.items()
+    })
+    return padded_momenta, onp.concatenate([weights, onp.zeros(padding)])
+
+
+def split_batches(momenta: dict, batch_size: int, weights: Optional[onp.ndarray] = None) -> Iterator[tuple[dict, onp.ndarray]]:
+    """
+    Split an event sample into batches of batch_size events. The last batch is padded with events of weight 0.
+    """
+    n = n_events(momenta)
+    for start in range(0, n, batch_size):
+        batch = _like(momenta, {key: value[start:start + batch_size] for key, value in momenta.items()})
+        batch_weights = None if weights is None else weights[start:start + batch_size]
+        yield pad_batch(batch, batch_weights, batch_size)
+
+
+def iterate_batches(batches: Union[dict, Iterable], batch_size: Optional[int] = None) -> Iterator[tuple[dict, onp.ndarray]]:
+    """
+    Normalizes the different ways to pass an event sample into an iterator over padded (momenta, weights) batches.
+
+    Parameters:
+    batches: dict | Iterable
+        Either a single dict of four-momenta, which is split into batches of batch_size events,
+        or an iterable, which yields dicts of four-momenta or (momenta, weights) tuples
+    batch_size: int
+        The size of all batches. If not given, the size of the first batch is used.
+    """
+    if isinstance(batches, dict):
+        if batch_size is None:
+            batch_size = n_events(batches)
+        yield from split_batches(batches, batch_size)
+        return
+    for batch in batches:
+        momenta, weights = batch if isinstance(batch, tuple) else (batch, None)
+        if batch_size is None:
+            batch_size = n_events(momenta)
+        yield pad_batch(momenta, weights, batch_size)
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import os
+import warnings
+from math import lgamma, exp
+from typing import Optional
+
+import numpy as onp
+
+from decayamplitude.config import config
+
+# increase, whenever the layout of the cache file or the convention of the coefficients changes
+CG_CACHE_VERSION = 1
+
+
+def log_factorial(n: int) -> float:
+    return lgamma(n + 1)
+
+
+def racah(j1: int, m1: int, j2: int, m2: int, J: int, M: int) -> float:
+    """
+    Clebsch-Gordan coefficient <j1 m1 j2 m2 | J M> from the Racah formula, evaluated in log-factorials.
+    All arguments are given in units of 1/2 (e.g. 1 for spin 1/2, 2 for spin 1 etc.).
+    Unphysical combinations (M != m1 + m2, violated triangle relation, projections larger than the spins) give 0.
+    """
+    if M != m1 + m2 or abs(m1) > j1 or abs(m2) > j2 or abs(M) > J:
+        return 0.
+    if J > j1 + j2 or J < abs(j1 - j2) or (j1 + j2 + J) % 2 != 0:
+        return 0.
+    if (j1 + m1) % 2 != 0 or (j2 + m2) % 2 != 0 or (J + M) % 2 != 0:
+        raise ValueError(f"CG({j1/2},{m1/2},{j2/2},{m2/2},{J/2},{M/2}) is not defined, spins and projections have to be both integer or both half integer")
+    # from here on everything is in units of 1
+    j1_plus_j2_minus_J = (j1 + j2 - J) // 2
+    j1_minus_m1, j1_plus_m1 = (j1 - m1) // 2, (j1 + m1) // 2
+    j2_minus_m2, j2_plus_m2 = (j2 - m2) // 2, (j2 + m2) // 2
+    J_minus_j2_plus_m1 = (J - j2 + m1) // 2
+    J_minus_j1_minus_m2 = (J - j1 - m2) // 2
+
+    log_prefactor = 0.5 * (
+        onp.log(J + 1)
+        + log_factorial((J + j1 - j2) // 2)
+        + log_factorial((J - j1 + j2) // 2)
+        + log_factorial(j1_plus_j2_minus_J)
+        - log_factorial((j1 + j2 + J) // 2 + 1)
+        + log_factorial((J + M) // 2)
+        + log_factorial((J - M) // 2)
+        + log_factorial(j1_minus_m1)
+        + log_factorial(j1_plus_m1)
+        + log_factorial(j2_minus_m2)
+        + log_factorial(j2_plus_m2)
+    )
+    k_min = max(0, -J_minus_j2_plus_m1, -J_minus_j1_minus_m2)
+    k_max = min(j1_plus_j2_minus_J, j1_minus_m1, j2_plus_m2)
+    return sum(
+        (-1) ** k * exp(
+            log_prefactor
+            - log_factorial(k)
+            - log_factorial(j1_plus_j2_minus_J - k)
+            - log_factorial(j1_minus_m1 - k)
+            - log_factorial(j2_plus_m2 - k)
+            - log_factorial(J_minus_j2_plus_m1 + k)
+            - log_factorial(J_minus_j1_minus_m2 + k)
+        )
+        for k in range(k_min, k_max + 1)
+    )
+
+
+class ClebschGordanTable:
+    """
+    Dense tables of Clebsch-Gordan coefficients.
+    For every allowed coupling (j1, j2, J) an array of shape (j1 + 1, j2 + 1) holds <j1 m1 j2 m2 | J m1 + m2>,
+    where m1 and m2 are ordered from -j to j in steps of 2 as in Angular.projections.
+    """
+
+    def __init__(self, blocks: Optional[dict[tuple[int, int, int], onp.ndarray]] = None, jmax: int = -1) -> None:
+        self.blocks = {} if blocks is None else blocks
+        self.jmax = jmax
+        # blocks, which were computed since the table was loaded or saved
+        self.unsaved: set[tuple[int, int, int]] = set()
+
+    @staticmethod
+    def compute_block(j1: int, j2: int, J: int) -> onp.ndarray:
+        block = onp.zeros((j1 + 1, j2 + 1))
+        for i1, m1 in enumerate(range(-j1, j1 + 1, 2)):
+            for i2, m2 in enumerate(range(-j2, j2 + 1, 2)):
+                block[i1, i2] = racah(j1, m1, j2, m2, J, m1 + m2)
+        return block
+
+    def fill(self, jmax: int) -> "ClebschGordanTable":
+        """
+        Fill all blocks with j1, j2, J <= jmax (in units of 1/2).
+        """
+        for j1 in range(jmax + 1):
+            for j2 in range(jmax + 1):
+                for J in range(abs(j1 - j2), min(j1 + j2, jmax) + 1, 2):
+                    if (j1, j2, J) not in self.blocks:
+                        self.blocks[(j1, j2, J)] = self.compute_block(j1, j2, J)
+                        self.unsaved.add((j1, j2, J))
+        self.jmax = max(self.jmax, jmax)
+        return self
+
+    def block(self, j1: int, j2: int, J: int) -> tuple[onp.ndarray, bool]:
+        """
+        Returns the block for (j1, j2, J) and whether it had to be computed.
+        Computed blocks are only kept in memory, they are written with the next `save`.
+        """
+        key = (j1, j2, J)
+        if key in self.blocks:
+            return self.blocks[key], False
+        self.blocks[key] = self.compute_block(*key)
+        self.unsaved.add(key)
+        return self.blocks[key], True
+
+    def __call__(self, j1: int, m1: int, j2: int, m2: int, J: int, M: int) -> float:
+        if M != m1 + m2 or abs(m1) > j1 or abs(m2) > j2 or abs(M) > J:
+            return 0.
+        if J > j1 + j2 or J < abs(j1 - j2) or (j1 + j2 + J) % 2 != 0:
+            return 0.
+        if (j1 + m1) % 2 != 0 or (j2 + m2) % 2 != 0:
+            raise ValueError(f"CG({j1/2},{m1/2},{j2/2},{m2/2},{J/2},{M/2}) is not defined, spins and projections have to be both integer or both half integer")
+        block, _ = self.block(j1, j2, J)
+        return float(block[(m1 + j1) // 2, (m2 + j2) // 2])
+
+    def save(self, path: str):
+        """
+        Write the table into a single versioned npz file. The file is replaced atomically, so that concurrent workers never see a partial file.
+        Blocks, which another process wrote into the file in the meantime, are merged into the table first, so they are not lost.
+        """
+        existing = type(self).load(path)
+        if existing is not None:
+            for key, block in existing.blocks.items():
+                self.blocks.setdefault(key, block)
+            self.jmax = max(self.jmax, existing.jmax)
+        keys = sorted(self.blocks)
+        sizes = [self.blocks[key].size for key in keys]
+        offsets = onp.concatenate([[0], onp.cumsum(sizes)]).astype(onp.int64)
+        values = onp.concatenate([self.blocks[key].ravel() for key in keys]) if keys else onp.zeros(0)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp.npz"
+        onp.savez(
+            temporary,
+            version=CG_CACHE_VERSION,
+            jmax=self.jmax,
+            keys=onp.array(keys, dtype=onp.int64).reshape(-1, 3),
+            offsets=offsets,
+            values=values,
+        )
+        os.replace(temporary, path)
+        self.unsaved.clear()
+
+    @classmethod
+    def load(cls, path: str) -> Optional["ClebschGordanTable"]:
+        """
+        Load a table written by `save`. Returns None if the file does not exist or was written by a different version.
+        """
+        if not os.path.exists(path):
+            return None
+        with onp.load(path) as data:
+            if int(data["version"]) != CG_CACHE_VERSION:
+                return None
+            keys, offsets, values = data["keys"], data["offsets"], data["values"]
+            blocks = {
+                (j1, j2, J): values[offsets[i]:offsets[i + 1]].reshape(j1 + 1, j2 + 1)
+                for i, (j1, j2, J) in enumerate(keys.tolist())
+            }
+            return cls(blocks, jmax=int(data["jmax"]))
+
+
+def cache_path() -> Optional[str]:
+    if config.cache_dir is None:
+        return None
+    return os.path.join(config.cache_dir, f"clebsch_gordan_v{CG_CACHE_VERSION}.npz")
+
+
+def save_table(table: Optional[ClebschGordanTable] = None):
+    """
+    Writes a table (by default the process wide one) into the cache file, if it holds blocks, which are not in the file yet.
+    Called after a batch of coefficients was looked up (see `decayamplitude.resonance.ls_table`), so the file is only written, when new blocks were computed.
+    """
+    table = _table if table is None else table
+    path = cache_path()
+    if path is None or table is None or not table.unsaved:
+        return
+    try:
+        table.save(path)
+    except OSError as e:
+        warnings.warn(f"Could not write the Clebsch-Gordan cache to {path}: {e}")
+
+
+_table: Optional[ClebschGordanTable] = None
+
+
+def get_table() -> ClebschGordanTable:
+    """
+    Returns the process wide Clebsch-Gordan table.
+    On first use the table is read from the cache file. Blocks, which are not in the file, are computed on demand, when a coefficient of them is needed.
+    """
+    global _table
+    if _table is None:
+        path = cache_path()
+        table = ClebschGordanTable.load(path) if path is not None else None
+        _table = ClebschGordanTable() if table is None else table
+    return _table
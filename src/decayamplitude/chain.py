@@ -8,12 +8,13 @@ from decayangle.decay_topology import Topology, Node
 from decayangle.decay_topology import Topology, HelicityAngles, WignerAngles
 from decayamplitude.particle import Particle
 from decayamplitude.resonance import Resonance
-from decayamplitude.rotation import QN, wigner_capital_d, Angular, convert_angular
+from decayamplitude.rotation import QN, wigner_capital_d, wigner_capital_d_matrix, Angular, convert_angular
 from decayamplitude.resonance import ResonanceDict
-from decayamplitude.backend import numpy as np
+from decayamplitude.backend import numpy as np, ensure_compile_time_eval, backend_cached_property
+import numpy as onp
 
-from decayamplitude.utils import _create_function, sanitize
-from decayamplitude.kinematics_helpers import mass_from_node
+from decayamplitude.utils import _create_function, sanitize, ParameterLayout
+from decayamplitude.kinematics import KinematicsStore
 
 class DecayChainNode:
     """
@@ -168,6 +169,8 @@ class DecayChainNode:
     def amplitude(self, h0:Union[Angular, int], lambdas:dict, helicity_angles:dict[tuple,HelicityAngles], arguments:dict, momenta:dict):
         """
         The amplitude of a single node given the helicity of the decaying particle
+        This is the reference implementation, which follows the decay tree helicity by helicity. The amplitudes of the chains are evaluated
+        from the precomputed tensors (see `precompute` and `tensor`), tests compare both.
         The helicities of the daughters will be generated from here, recursively
         the arguments are the couplings of the resonances and are a global dict, which will be passed through the recursion
         This means, that all arguments for lineshapes will be provided positional
@@ -201,8 +204,9 @@ class DecayChainNode:
             else:
                 d2_helicities = d2.quantum_numbers.projections(return_int=True)
 
-            d1_mass = mass_from_node(d1.node, momenta)
-            d2_mass = mass_from_node(d2.node, momenta)
+            kinematics = KinematicsStore.of(momenta)
+            d1_mass = kinematics.mass(d1.node)
+            d2_mass = kinematics.mass(d2.node)
 
             for h1 in d1_helicities:
                 for h2 in d2_helicities:
@@ -211,6 +215,201 @@ class DecayChainNode:
                             A_self = self.resonance.amplitude(h0, h1, h2, arguments, d1_mass, d2_mass) * np.conj(wigner_capital_d(*self.__helicity_angles(helicity_angles[self.decay_tuple]), self.quantum_numbers.angular.value2, h0, h1 - h2))
                             yield A_1 * A_2 * A_self * (self.quantum_numbers.angular.value2 + 1)**0.5
 
+    def precompute(self, helicity_angles:dict[tuple,HelicityAngles], kinematics:KinematicsStore) -> dict:
+        """
+        Evaluates all parts of the amplitude of this node and its daughters, which do not depend on any fit parameter.
+        This is done once per event sample. Evaluating the amplitude later on only requires the couplings and lineshapes to be multiplied in.
+
+        parameters:
+        helicity_angles: dict
+            The helicity angles of the topology as produced by `Topology.helicity_angles`
+        kinematics: KinematicsStore
+            The kinematics of the event sample, which provides the invariant masses
+
+        returns:
+        dict
+            A dict keyed by `data_key` of all internal nodes below and including this one. Each entry holds
+            "angular": the tensor conj(D^j_{h0, h1 - h2}) * sqrt(j + 1) * (-1)^((j2 - h2)/2) with shape (j + 1, j1 + 1, j2 + 1, *event_shape)
+            "masses": the invariant masses of the two daughters
+            "mass": the invariant mass of the node itself
+            The dict only contains arrays and string keys, so it can be passed as an argument to jitted functions.
+        """
+        if self.final_state:
+            return {}
+        d1, d2 = self.daughters
+        j = self.quantum_numbers.angular.value2
+        j1, j2 = d1.quantum_numbers.angular.value2, d2.quantum_numbers.angular.value2
+        h1 = onp.array(d1.quantum_numbers.projections(return_int=True))[:, None]
+        h2 = onp.array(d2.quantum_numbers.projections(return_int=True))[None, :]
+        # D^j_{h0, h1 - h2} only exists for |h1 - h2| <= j. The other entries are set to zero
+        allowed = onp.abs(h1 - h2) <= j
+        index = onp.where(allowed, (h1 - h2 + j) // 2, 0)
+        # particle 2 convention from Jacob-Wick
+        static_factor = allowed * (-1.) ** ((j2 - h2) // 2) * (j + 1)**0.5
+
+        wigner_matrix = np.conj(wigner_capital_d_matrix(*self.__helicity_angles(helicity_angles[self.decay_tuple]), j))
+        angular = wigner_matrix[:, index]
+        precomputed = {
+            self.data_key: {
+                "angular": angular * np.reshape(static_factor, static_factor.shape + (1,) * (np.ndim(angular) - 3)),
+                "masses": tuple(
+                    np.nan_to_num(kinematics.mass(d.node), nan=0.0, posinf=0.0, neginf=0.0)
+                    for d in self.daughters
+                ),
+                "mass": kinematics.mass(self.node),
+            }
+        }
+        for d in self.daughters:
+            precomputed.update(d.precompute(helicity_angles, kinematics))
+        return precomputed
+
+    @property
+    def data_key(self) -> str:
+        """
+        Returns:
+        str
+            The key of this node in the precomputed data. Node values mix integers and tuples, which can not be sorted as pytree keys, so the string representation is used.
+        """
+        return str(self.node.value)
+
+    @property
+    def final_state_daughters(self) -> list["DecayChainNode"]:
+        """
+        Returns:
+        list[DecayChainNode]
+            The final state nodes below this node, in the order in which they appear as axes of `tensor`
+        """
+        if self.final_state:
+            return [self]
+        return [f for daughter in self.daughters for f in daughter.final_state_daughters]
+
+    @property
+    def leaves(self) -> list:
+        """
+        Returns:
+        list
+            The values of the final state nodes below this node, in the order in which they appear as axes of `tensor`
+        """
+        return [f.node.value for f in self.final_state_daughters]
+
+    @property
+    def leaf_shape(self) -> tuple[int]:
+        """
+        Returns:
+        tuple[int]
+            The number of helicities of each final state particle below this node
+        """
+        return tuple(f.quantum_numbers.angular.value2 + 1 for f in self.final_state_daughters)
+
+    @cached_property
+    def structure(self) -> tuple:
+        """
+        Returns:
+        tuple
+            A hashable description of everything below and including this node, which does not depend on the couplings.
+            Two nodes with the same structure produce the same tensor, if their resonances have the same couplings.
+            The topology is part of the structure, since the helicity angles of a node depend on the boosts from the root to the node.
+        """
+        if self.final_state:
+            return (self.node.value, self.quantum_numbers.angular.value2)
+        resonance = self.resonance
+        return (
+            self.topology.tuple,
+            self.node.value,
+            self.convention,
+            resonance.quantum_numbers.angular.value2,
+            resonance.quantum_numbers.parity,
+            resonance.scheme,
+            resonance.lineshape,
+            tuple(resonance.parameter_names),
+            tuple(daughter.structure for daughter in self.daughters),
+        )
+
+    @cached_property
+    def subtree_resonances(self) -> list[Resonance]:
+        """
+        Returns:
+        list[Resonance]
+            The resonances of this node and all nodes below it
+        """
+        if self.final_state:
+            return []
+        return [self.resonance] + [r for daughter in self.daughters for r in daughter.subtree_resonances]
+
+    def coupling_key(self, arguments:dict) -> tuple:
+        """
+        Identifies the couplings of all resonances below and including this node in the arguments.
+        Copies of the same resonance in different chains have different ids, so the coupling values are compared by identity.
+        `_create_function` hands out the same object for couplings with the same name.
+        """
+        return tuple(
+            tuple((key, id(value)) for key, value in arguments[resonance.id]["couplings"].items())
+            for resonance in self.subtree_resonances
+        )
+
+    def tensor(self, arguments:dict, precomputed:dict, cache:Optional[dict]=None):
+        """
+        Bottom-up evaluation of the amplitude of this node for all helicities at once.
+        Every daughter is evaluated exactly once and the daughter tensors are contracted with the helicity couplings and the precomputed angular tensor of this node.
+
+        parameters:
+        arguments: dict
+            The couplings of the resonances and the resonance parameters
+        precomputed: dict
+            The output of `precompute`
+        cache: dict
+            Optional cache for lineshape values and sub decay tensors, which can be shared between chains evaluated with the same arguments and event sample. 
+            See `Resonance.lineshape_values` and `structure`.
+
+        returns:
+        array
+            Array of shape (j + 1, *leaf_shape, *event_shape).
+            The first axis is the helicity of this node, followed by one axis per final state particle below this node in the order of `leaves`.
+        """
+        if self.final_state:
+            # the helicity of a final state particle is the final state helicity itself
+            return onp.eye(self.quantum_numbers.angular.value2 + 1)
+
+        if cache is None:
+            cache = {}
+        # identical sub decays in different chains are only evaluated once
+        key = ("subtree", self.structure, self.coupling_key(arguments))
+        if key not in cache:
+            cache[key] = self.__tensor(arguments, precomputed, cache)
+        return cache[key]
+
+    def __tensor(self, arguments:dict, precomputed:dict, cache:dict):
+        d1, d2 = self.daughters
+        node_data = precomputed[self.data_key]
+        couplings = self.resonance.helicity_couplings(
+            arguments, d1.quantum_numbers.angular.value2, d2.quantum_numbers.angular.value2, *node_data["masses"], cache=cache, decay=self.decay_tuple, mass=node_data["mass"]
+        )
+        # vertex[h0, h1, h2, ...], the couplings may carry fewer event axes than the angular part (e.g. for constant lineshapes)
+        vertex = np.einsum("abc...,bc...->abc...", node_data["angular"], couplings)
+
+        # final state daughters are identities, so they do not need to be contracted
+        if d1.final_state and d2.final_state:
+            return vertex
+        if d1.final_state:
+            result = np.einsum("abc...,cq...->abq...", vertex, d2.flat_tensor(arguments, precomputed, cache))
+        elif d2.final_state:
+            result = np.einsum("abc...,bp...->apc...", vertex, d1.flat_tensor(arguments, precomputed, cache))
+        else:
+            result = np.einsum(
+                "abc...,bp...,cq...->apq...",
+                vertex,
+                d1.flat_tensor(arguments, precomputed, cache),
+                d2.flat_tensor(arguments, precomputed, cache),
+            )
+        return np.reshape(result, (self.quantum_numbers.angular.value2 + 1,) + d1.leaf_shape + d2.leaf_shape + np.shape(result)[3:])
+
+    def flat_tensor(self, arguments:dict, precomputed:dict, cache:Optional[dict]=None):
+        """
+        Same as `tensor`, but all final state helicity axes are merged into a single axis.
+        """
+        t = self.tensor(arguments, precomputed, cache)
+        return np.reshape(t, np.shape(t)[:1] + (-1,) + np.shape(t)[1 + len(self.leaf_shape):])
+
 class DecayChain:
     """
     Class to represent a decay chain. This is a topology in connection with a set of resonances. One resonance for each internal node in the topology.
@@ -253,26 +452,88 @@ class DecayChain:
     def final_state_nodes(self) -> list[DecayChainNode]:
         return [node for node in self.nodes if node.final_state]
 
-    @cached_property
+    @property
+    def kinematics(self) -> KinematicsStore:
+        """
+        The kinematics of the momenta of the chain. It is shared with all other chains built on the same momenta dict.
+        """
+        return KinematicsStore.of(self.momenta)
+
+    @backend_cached_property
     def helicity_angles(self):
-        return self.topology.helicity_angles(momenta=self.momenta, convention=self.convention)
+        return self.kinematics.helicity_angles(self.topology, self.convention)
 
-    @property
+    @cached_property
     def root(self):
         return DecayChainNode(self.topology.root, self.resonances, self.final_state_qn, self.topology, self.convention)
 
+    def precompute(self, momenta:Optional[dict]=None) -> dict:
+        """
+        Evaluates all parameter independent parts of the chain (Wigner D functions of the helicity angles, Clebsch-Gordan products, 
+        normalization factors, Jacob-Wick phases and the invariant masses) for a given event sample.
+
+        Parameters:
+        momenta: dict
+            The momenta of the final state particles. If not given, the momenta of the chain are used and the result is cached.
+
+        Returns:
+        dict
+            The precomputed tensors. Under "nodes" the tensors of every internal node are stored, keyed by the node values. See `DecayChainNode.precompute`.
+        """
+        if momenta is None:
+            return self.precomputed
+        with ensure_compile_time_eval():
+            kinematics = KinematicsStore.of(momenta)
+            helicity_angles = kinematics.helicity_angles(self.topology, self.convention)
+            return {"nodes": self.root.precompute(helicity_angles, kinematics)}
+
+    @backend_cached_property
+    def precomputed(self) -> dict:
+        """
+        The precomputed tensors for the momenta of the chain. These are evaluated once and reused by every call of the chain function.
+        """
+        with ensure_compile_time_eval():
+            return {"nodes": self.root.precompute(self.helicity_angles, self.kinematics)}
+
+    @property
+    def helicity_tensor(self) -> Callable:
+        """
+        Returns a function f(arguments, precomputed=None, cache=None), which evaluates the amplitude of the chain for all helicities at once.
+        The decay tree is walked only once, bottom up. See `DecayChainNode.tensor`.
+        A cache dict can be passed to share lineshape values with other chains evaluated for the same arguments. A new one is used for every call otherwise.
+        The result has the shape (j0 + 1, *[j_f + 1 for f in final_state_keys], *event_shape), 
+        where the first axis is the helicity of the mother and the others are the helicities of the final state particles in the order of `final_state_keys`.
+        """
+        root = self.root
+        # the axes of the root tensor follow the order of the leaves, but we want them in the order of the sorted final state keys
+        permutation = (0,) + tuple(1 + root.leaves.index(key) for key in self.final_state_keys)
+        prefactor = 1/(root.quantum_numbers.angular.value2 + 1)**0.5
+
+        def f(arguments:dict, precomputed:Optional[dict]=None, cache:Optional[dict]=None):
+            if precomputed is None:
+                precomputed = self.precomputed
+            tensor = root.tensor(arguments, precomputed["nodes"], {} if cache is None else cache)
+            return prefactor * np.transpose(tensor, permutation + tuple(range(len(permutation), np.ndim(tensor))))
+
+        return f
+
+    def helicity_index(self, h0:int, lambdas:dict) -> tuple[int]:
+        """
+        Translates the helicity of the mother and the final state helicities into an index of the helicity tensor.
+        """
+        j0 = self.root.quantum_numbers.angular.value2
+        return ((h0 + j0) // 2,) + tuple(
+            (lambdas[key] + self.final_state_qn[key].angular.value2) // 2
+            for key in self.final_state_keys
+        )
+
     @property
     def chain_function(self):
+        tensor = self.helicity_tensor
 
+        @convert_angular
         def f(h0, lambdas:dict, arguments:dict):
-            amplitudes = [
-                 amplitude
-                for amplitude in self.root.amplitude(h0, lambdas, self.helicity_angles, arguments, self.momenta)
-            ]
-            prefactor = 1/(self.root.resonance.quantum_numbers.angular.value2 + 1)**0.5
-            return prefactor * sum(
-               amplitudes
-            )
+            return tensor(arguments)[self.helicity_index(h0, lambdas)]
 
         return f
     
@@ -282,16 +543,33 @@ class DecayChain:
         Returns a function, which will not produce the chain function for a single set of helicities, but will rather return a matrix with all possible helicities. 
         The matrix will be an actual matrix and not a dict, since we want to use it later to perform matrix operations.
         """
+        tensor = self.helicity_tensor
 
-        f = self.chain_function
+        @convert_angular
         def matrix(h0, arguments:dict):
-            return {
-                tuple([lambdas[key] for key in self.final_state_keys]): f(h0, lambdas, arguments)
-                for lambdas in self.helicities
-            }
+            return self.tensor_to_matrix(tensor(arguments), h0)
         
         return matrix
+
+    def tensor_to_matrix(self, tensor, h0:int) -> dict:
+        """
+        Translates a helicity tensor as produced by `helicity_tensor` into the dict representation of `matrix` for a given helicity of the mother.
+        """
+        j0 = self.root.quantum_numbers.angular.value2
+        values = tensor[(h0 + j0) // 2]
+        values = np.reshape(values, (-1,) + np.shape(values)[len(self.final_state_keys):])
+        return {
+            helicities: values[i]
+            for i, helicities in enumerate(self.helicity_tuples)
+        }
     
+    @property
+    def structure(self) -> tuple:
+        """
+        A hashable description of the chain, which does not depend on the couplings or the momenta. See `DecayChainNode.structure`.
+        """
+        return (type(self).__name__, self.root.structure)
+
     def generate_couplings(self):
         """
         Returns all LS couplings for the decay chain
@@ -313,18 +591,47 @@ class DecayChain:
             # raise ValueError(f"Parameter names are not unique: {', '.join([name for name, count in c.items() if count > 1])}")
         return list(set(resonance_parameter_names))
 
-    def unpolarized_amplitude(self, ls_couplings: dict, complex_couplings=True) -> tuple[Callable, list[str]]:
+    def unpolarized_amplitude(self, ls_couplings: dict, complex_couplings=True, event_data=False, flat=False) -> tuple[Callable, Union[list[str], ParameterLayout]]:
         """
         Returns a function that calculates the unpolarized amplitude of the decay chain.
+        If event_data is True, the function takes the output of `precompute` for any event sample as its first argument `data`, 
+        instead of using the momenta of the chain. The returned argument names do not contain `data`.
+        If flat is True, the function takes one parameter array and a `ParameterLayout` is returned instead of the argument names. See `ChainCombiner.unpolarized_amplitude`.
         """
+        tensor = self.helicity_tensor
+        helicity_axes = tuple(range(1 + len(self.final_state_keys)))
         def f(arguments:dict):
-            return sum(
-                    abs(v)**2 
-                    for h0 in self.root_resonance.quantum_numbers.angular.projections()
-                    for v in self.matrix(h0, arguments).values()
-                )
+            return np.sum(abs(tensor(arguments, arguments["data"] if event_data else None))**2, axis=helicity_axes)
+
+        return _create_function(self.resonance_params, ls_couplings, f, complex_couplings=complex_couplings, event_data=event_data, flat=flat)
+
+def alignment_matrices(wigner_rotation: dict[Union[tuple, int], WignerAngles], final_state_qn: dict[int, QN | Particle]) -> dict:
+    """
+    Builds the alignment matrices R[new, old] = conj(D^j_{old, new}(rotation)) for every final state particle.
+    The matrices have the shape (j + 1, j + 1, *event_shape). Spin 0 particles are not rotated and are left out.
+    """
+    matrices = {}
+    for key, rotation in wigner_rotation.items():
+        j = final_state_qn[key].angular.value2
+        if j == 0:
+            continue
+        matrices[key] = np.conj(np.swapaxes(wigner_capital_d_matrix(*rotation, j), 0, 1))
+    return matrices
+
+def align_helicity_tensor(tensor, alignment: dict, final_state_keys: list):
+    """
+    Applies the alignment matrices to a helicity tensor as produced by `DecayChain.helicity_tensor`.
+    Each matrix only acts on the axis of its own particle, so the full (Kronecker product) rotation is never built.
+    """
+    letters = "bcdefghijklmnopqrstuvw"
+    axes = "a" + letters[:len(final_state_keys)]
+    for i, key in enumerate(final_state_keys):
+        if key not in alignment:
+            continue
+        new_axes = axes[:i + 1] + "z" + axes[i + 2:]
+        tensor = np.einsum(f"z{axes[i + 1]}...,{axes}...->{new_axes}...", alignment[key], tensor)
+    return tensor
 
-        return _create_function(self.resonance_params, ls_couplings, f, complex_couplings=complex_couplings)
 
 class AlignedChain(DecayChain):
     """
@@ -358,15 +665,27 @@ class AlignedChain(DecayChain):
             if isinstance(reference, DecayChain):
                 if reference.convention != convention:
                     raise ValueError(f"Reference and chain must have the same convention. Found reference: {reference.convention} and self: {convention}!")
-            self.wigner_rotation = self.reference.relative_wigner_angles(self.topology, momenta, convention=self.convention)
         else:
             self.wigner_rotation = wigner_rotation
-        # we want the tuple versions of the helicities, since we use them as tuples
-        self.wigner_dict = {
+
+    @backend_cached_property
+    def wigner_rotation(self) -> dict[tuple, WignerAngles]:
+        """
+        The Wigner angles, which rotate the final state helicity frames of the reference into the ones of the chain, for the momenta of the chain.
+        """
+        return self.kinematics.relative_wigner_angles(self.reference, self.topology, self.convention)
+
+    @backend_cached_property
+    def wigner_dict(self) -> dict:
+        """
+        The alignment factors for single helicity combinations as dict key -> (lambda_new, lambda_old) -> value.
+        The aligned tensors do not use this, but rather `alignment_matrices`.
+        """
+        return {
             key: {
-                (h_, h): np.conj(wigner_capital_d(*self.wigner_rotation[key], final_state_qn[key].angular.value2, h, h_))
-                for h in final_state_qn[key].angular.projections(return_int=True)
-                for h_ in final_state_qn[key].angular.projections(return_int=True)
+                (h_, h): np.conj(wigner_capital_d(*self.wigner_rotation[key], self.final_state_qn[key].angular.value2, h, h_))
+                for h in self.final_state_qn[key].angular.projections(return_int=True)
+                for h_ in self.final_state_qn[key].angular.projections(return_int=True)
             }
             for key in self.final_state_keys
         }
@@ -374,27 +693,52 @@ class AlignedChain(DecayChain):
     def to_tuple(self, lambdas:dict):
         return tuple([lambdas[key] for key in self.final_state_keys])
 
+    def precompute(self, momenta:Optional[dict]=None) -> dict:
+        """
+        Precomputes the parameter independent tensors of the chain (see `DecayChain.precompute`) and the alignment matrices for every final state particle under "alignment".
+        """
+        if momenta is None:
+            return self.precomputed
+        precomputed = super().precompute(momenta)
+        with ensure_compile_time_eval():
+            wigner_rotation = KinematicsStore.of(momenta).relative_wigner_angles(self.reference, self.topology, self.convention)
+            precomputed["alignment"] = alignment_matrices(wigner_rotation, self.final_state_qn)
+        return precomputed
+
+    @backend_cached_property
+    def alignment(self) -> dict:
+        """
+        The alignment matrices for the momenta of the chain. See `alignment_matrices`.
+        """
+        with ensure_compile_time_eval():
+            return alignment_matrices(self.wigner_rotation, self.final_state_qn)
+
+    @property
+    def precomputed(self) -> dict:
+        return {**super().precomputed, "alignment": self.alignment}
+
+    @property
+    def aligned_tensor(self) -> Callable:
+        """
+        Returns a function f(arguments, precomputed=None, cache=None), which evaluates the helicity tensor of the chain in the final state helicity frame of the reference.
+        """
+        tensor = self.helicity_tensor
+        def f(arguments:dict, precomputed:Optional[dict]=None, cache:Optional[dict]=None):
+            if precomputed is None:
+                precomputed = self.precomputed
+            return align_helicity_tensor(tensor(arguments, precomputed, cache), precomputed["alignment"], self.final_state_keys)
+        return f
+
     @property
     def aligned_matrix(self):
         """
-        Returns a function, which will return the amplitude for a given set of helicities. 
-        The function will use the matrix to perform the calculation.
+        Returns a function, which will return the aligned amplitudes for all final state helicities as a dict for a given helicity of the mother.
         """
-        m = self.matrix
+        tensor = self.aligned_tensor
+
+        @convert_angular
         def f(h0, arguments:dict):
-            matrix = m(h0, arguments)
-            aligned_matrix = {
-                self.to_tuple(lambdas): sum(
-                    matrix[self.to_tuple(lambdas_)]
-                    * np.prod(np.array([
-                            self.wigner_dict[key][(lambdas[key], lambdas_[key])] for key in self.final_state_keys
-                        ]), 
-                        axis=0)
-                    for lambdas_ in self.helicities
-                )
-                for lambdas in self.helicities
-            }
-            return aligned_matrix
+            return self.tensor_to_matrix(tensor(arguments), h0)
         
         return f
     
@@ -500,13 +844,31 @@ class MultiChain(DecayChain):
             raise ValueError("Either resonances or chains must be provided")
 
     @property
-    def chain_function(self) -> Callable:
-        def f(h0, lambdas:dict, arguments:dict):
+    def helicity_tensor(self) -> Callable:
+        """
+        Returns a function f(arguments, precomputed=None, cache=None), which evaluates the sum of the helicity tensors of all chains.
+        The precomputed tensors have to be given with one entry per chain under "chains", as produced by `precompute`.
+        All chains share one lineshape cache, so resonances appearing in several chains are only evaluated once.
+        """
+        tensors = [chain.helicity_tensor for chain in self.chains]
+        def f(arguments:dict, precomputed:Optional[dict]=None, cache:Optional[dict]=None):
+            chain_precomputed = [None] * len(tensors) if precomputed is None else precomputed["chains"]
+            cache = {} if cache is None else cache
             return sum(
-                chain.chain_function(h0, lambdas, arguments)
-                for chain in self.chains
+                tensor(arguments, p, cache)
+                for tensor, p in zip(tensors, chain_precomputed)
             )
         return f
+
+    def precompute(self, momenta:Optional[dict]=None) -> dict:
+        """
+        Precomputes the parameter independent tensors of all chains. See `DecayChain.precompute`.
+        """
+        return {"chains": [chain.precompute(momenta) for chain in self.chains]}
+
+    @property
+    def precomputed(self) -> dict:
+        return {"chains": [chain.precomputed for chain in self.chains]}
     
     @property
     def resonance_list(self) -> list[Resonance]:
@@ -524,26 +886,9 @@ class MultiChain(DecayChain):
         return self.chains[0].topology
 
     @property
-    def matrix(self):
-        def dict_sum(*dtcs):
-            if len(dtcs) == 1:
-                return dtcs[0]
-            if len(dtcs) == 0:
-                raise ValueError("No dicts to sum")
-            if any(set(dtcs[0].keys()) != set(dtc.keys()) for dtc in dtcs):
-                raise ValueError("Keys of the dicts do not match")
-            return {
-                key: sum(dtc[key] for dtc in dtcs)
-                for key in dtcs[0].keys()
-            }
+    def final_state_qn(self) -> dict[int, QN | Particle]:
+        return self.chains[0].final_state_qn
 
-        def matrix(h0, arguments:dict):
-            return dict_sum(
-                *[chain.matrix(h0, arguments)
-                for chain in self.chains]
-            )
-        return matrix
-    
     @property
     def root(self):
         return self.chains[0].root
@@ -560,6 +905,10 @@ class MultiChain(DecayChain):
     def helicity_tuples(self):
         return self.chains[0].helicity_tuples
     
+    @property
+    def structure(self) -> tuple:
+        return (type(self).__name__,) + tuple(chain.structure for chain in self.chains)
+
     def generate_couplings(self):
         """
         Returns all LS couplings for the decay chain
@@ -596,49 +945,81 @@ class AlignedMultiChain(MultiChain):
     def __init__(self, topology:Topology, momenta: dict, final_state_qn: dict[int, QN | Particle], reference:Union[Topology, DecayChain], resonances: Optional[dict[tuple, tuple[Resonance]] | ResonanceDict] = None, chains: Optional[list[DecayChain]] = None, wigner_rotation: dict[tuple, WignerAngles]= None, convention:Literal["helicity", "minus_phi"]="helicity") -> None:
         super().__init__(topology, momenta, final_state_qn, resonances=resonances, chains=chains, convention=convention)
         self.reference: Topology = reference if isinstance(reference, Topology) else reference.topology
-        if wigner_rotation is None:
-            self.wigner_rotation = self.reference.relative_wigner_angles(self.topology, momenta, convention=self.convention)
-        else:
+        self.momenta = momenta
+        if wigner_rotation is not None:
             self.wigner_rotation = wigner_rotation
 
-        self.wigner_dict = {
+    @backend_cached_property
+    def wigner_rotation(self) -> dict[tuple, WignerAngles]:
+        """
+        The Wigner angles, which rotate the final state helicity frames of the reference into the ones of the chains, for the momenta of the chains.
+        """
+        return self.kinematics.relative_wigner_angles(self.reference, self.topology, self.convention)
+
+    @backend_cached_property
+    def wigner_dict(self) -> dict:
+        """
+        The alignment factors for single helicity combinations as dict key -> (lambda_new, lambda_old) -> value.
+        The aligned tensors do not use this, but rather `alignment_matrices`.
+        """
+        return {
             key: {
-                (h_, h): np.conj(wigner_capital_d(*self.wigner_rotation[key], final_state_qn[key].angular.value2, h, h_))
-                for h in final_state_qn[key].angular.projections(return_int=True)
-                for h_ in final_state_qn[key].angular.projections(return_int=True)
+                (h_, h): np.conj(wigner_capital_d(*self.wigner_rotation[key], self.final_state_qn[key].angular.value2, h, h_))
+                for h in self.final_state_qn[key].angular.projections(return_int=True)
+                for h_ in self.final_state_qn[key].angular.projections(return_int=True)
             }
             for key in self.final_state_keys
         }
 
     def to_tuple(self, lambdas:dict):
         return tuple([lambdas[key] for key in self.final_state_keys])
-        
 
-    @property
-    def aligned_matrix(self):
+    def precompute(self, momenta:Optional[dict]=None) -> dict:
         """
-        Returns a function, which will return the amplitude for a given set of helicities. 
-        The function will use the matrix to perform the calculation.
+        Precomputes the parameter independent tensors of all chains (see `MultiChain.precompute`) and the alignment matrices for every final state particle under "alignment".
+        The alignment is shared by all chains, since they have the same topology.
         """
-        m = self.matrix
-        def f(h0,  arguments:dict):
-            matrix = m(h0, arguments)
-            aligned_matrix = {
-                self.to_tuple(lambdas): sum(
-                    matrix[self.to_tuple(lambdas_)]
-                    * np.prod(np.array([
-                            self.wigner_dict[key][(lambdas[key], lambdas_[key])] for key in self.final_state_keys
-                        ]), 
-                        axis=0)
-                    for lambdas_ in self.helicities
-                )
-                for lambdas in self.helicities
-            }
-            return aligned_matrix
-        
-        return f
+        if momenta is None:
+            return self.precomputed
+        precomputed = super().precompute(momenta)
+        with ensure_compile_time_eval():
+            wigner_rotation = KinematicsStore.of(momenta).relative_wigner_angles(self.reference, self.topology, self.convention)
+            precomputed["alignment"] = alignment_matrices(wigner_rotation, self.final_state_qn)
+        return precomputed
 
+    @backend_cached_property
+    def alignment(self) -> dict:
+        """
+        The alignment matrices for the momenta of the chain. See `alignment_matrices`.
+        """
+        with ensure_compile_time_eval():
+            return alignment_matrices(self.wigner_rotation, self.final_state_qn)
 
+    @property
+    def precomputed(self) -> dict:
+        return {**super().precomputed, "alignment": self.alignment}
 
+    @property
+    def aligned_tensor(self) -> Callable:
+        """
+        Returns a function f(arguments, precomputed=None, cache=None), which evaluates the helicity tensor of the chain in the final state helicity frame of the reference.
+        """
+        tensor = self.helicity_tensor
+        def f(arguments:dict, precomputed:Optional[dict]=None, cache:Optional[dict]=None):
+            if precomputed is None:
+                precomputed = self.precomputed
+            return align_helicity_tensor(tensor(arguments, precomputed, cache), precomputed["alignment"], self.final_state_keys)
+        return f
 
+    @property
+    def aligned_matrix(self):
+        """
+        Returns a function, which will return the aligned amplitudes for all final state helicities as a dict for a given helicity of the mother.
+        """
+        tensor = self.aligned_tensor
 
+        @convert_angular
+        def f(h0, arguments:dict):
+            return self.tensor_to_matrix(tensor(arguments), h0)
+        
+        return f
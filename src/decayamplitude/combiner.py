@@ -1,8 +1,59 @@
-from decayamplitude.chain import DecayChain, AlignedChain, MultiChain, AlignedMultiChain
+from decayamplitude.chain import DecayChain, AlignedChain, MultiChain, AlignedMultiChain, align_helicity_tensor
 from decayangle.decay_topology import Topology
-from typing import Union, Callable
+from typing import Union, Callable, Optional
+from collections import namedtuple
+from functools import reduce as fold
+from itertools import product
+from operator import mul
+from concurrent.futures import ThreadPoolExecutor
 from decayamplitude.resonance import LSTuple, Resonance
-from decayamplitude.utils import _create_function
+from decayamplitude.utils import _create_function, ParameterLayout
+from decayamplitude.backend import numpy as np, require_jax, ensure_compile_time_eval
+from decayamplitude.kinematics import KinematicsStore, topology_key
+from decayamplitude.compiled_kinematics import CompiledKinematics
+from decayamplitude.batching import iterate_batches
+from jax import jit, jacrev
+from jax.core import Tracer
+import numpy as onp
+
+# A single term of the amplitude, which is linear in one product of couplings.
+# chain is the index in ChainCombiner.top_chains, inner the index of the chain inside a MultiChain (0 otherwise)
+# and couplings a tuple of (resonance id, coupling key) with one entry per resonance of the chain.
+Component = namedtuple("Component", ["chain", "inner", "couplings"])
+
+
+def _contains_tracer(tree) -> bool:
+    """
+    Whether any leaf of nested dicts, lists and tuples is a jax tracer, i.e. whether we are inside of a transformation like `jit` or `grad`.
+    """
+    if isinstance(tree, Tracer):
+        return True
+    if isinstance(tree, dict):
+        return any(_contains_tracer(value) for value in tree.values())
+    if isinstance(tree, (list, tuple)):
+        return any(_contains_tracer(value) for value in tree)
+    return False
+
+
+def chain_cost(chain: DecayChain) -> int:
+    """
+    A rough estimate of the cost of evaluating the helicity tensor of a chain.
+    Every internal node contributes the number of its helicity combinations times the number of its couplings.
+    """
+    couplings = chain.generate_couplings()
+    cost = 0
+    for node in chain.nodes:
+        if node.final_state:
+            continue
+        helicities = fold(mul, [n.quantum_numbers.angular.value2 + 1 for n in [node] + node.daughters])
+        cost += helicities * len(couplings[node.resonance.id]["couplings"])
+    return cost
+
+
+def _momenta(chain: Union[DecayChain, MultiChain]) -> dict:
+    # a MultiChain does not keep the momenta itself
+    return chain.chains[0].momenta if isinstance(chain, MultiChain) else chain.momenta
+
 
 class ChainCombiner:
     """
@@ -11,9 +62,22 @@ class ChainCombiner:
     All other chains will be transformed into the reference basis.
     """
 
-    def __init__(self, chains: list[Union[DecayChain, MultiChain]]) -> None:
+    def __init__(self, chains: list[Union[DecayChain, MultiChain]], threads: Optional[int] = None) -> None:
+        """
+        Parameters:
+        chains: list[DecayChain | MultiChain]
+            The chains to combine. The first one is the reference
+        threads: int
+            If given, eager (not traced) evaluations of `combined_tensor` run the chains concurrently in a pool of this many threads.
+            Inside of `jit` the chains are always summed sequentially.
+        """
         self.chains = chains
+        self.threads = threads
         self.reference = chains[0]
+        # built on the first call of precompute_kinematics with compiled=True
+        self.__compiled_kinematics = None
+        # chains built on other momenta compute their alignment on their own
+        self.batch_alignment(_momenta(self.reference), [chain for chain in chains[1:] if _momenta(chain) is _momenta(self.reference)])
         self.aligned_chains = [
             AlignedMultiChain.from_multichain(
                 chain,
@@ -28,7 +92,242 @@ class ChainCombiner:
                 )
             for chain in chains[1:]
         ]
+        # the order, in which parallel_tensor submits its tasks: one task per (top chain, inner chain), heavy ones first
+        tasks = [
+            ((i, j), inner)
+            for i, chain in enumerate(self.top_chains)
+            for j, inner in enumerate(chain.chains if isinstance(chain, MultiChain) else [chain])
+        ]
+        self.__task_order = [index for index, _ in sorted(tasks, key=lambda task: -chain_cost(task[1]))]
+
+
+    def precompute(self, momenta: Optional[dict] = None, compiled_kinematics: bool = False) -> list:
+        """
+        Evaluates the parameter independent tensors of all chains once for an event sample.
+        If no momenta are given, the momenta of the chains are used and the results are cached inside the chains.
+        Calling this before `jit` makes sure, that the expensive angular part is not evaluated during tracing.
+        With compiled_kinematics=True the kinematics are computed by one jitted program (see `precompute_kinematics`).
+        """
+        if momenta is not None or compiled_kinematics:
+            self.precompute_kinematics(momenta, compiled=compiled_kinematics)
+        return [chain.precompute(momenta) for chain in self.top_chains]
+
+    def precompute_kinematics(self, momenta: Optional[dict] = None, compiled: bool = False) -> KinematicsStore:
+        """
+        Computes the helicity angles and the alignment of all topologies of the model in one stage and returns the kinematics store of the momenta.
+        The store boosts into the union of all frames, which the topologies need, and every frame is only reached once,
+        so the cost grows with the number of distinct frames instead of the number of topologies. The chains then find all angles in the store.
+
+        With compiled=True all angles, invariant masses and Wigner angles are computed by one jitted program (see `CompiledKinematics`).
+        The program is compiled once per model and sample size, so the padded batches of `streaming_function` share it.
+        """
+        momenta = _momenta(self.reference) if momenta is None else momenta
+        if compiled:
+            if self.__compiled_kinematics is None:
+                self.__compiled_kinematics = CompiledKinematics(
+                    [(chain.topology, chain.convention) for chain in self.chains],
+                    [(self.reference.topology, chain.topology, self.reference.convention) for chain in self.chains[1:]],
+                )
+            self.__compiled_kinematics(momenta)
+        store = KinematicsStore.of(momenta)
+        with ensure_compile_time_eval():
+            for topology, convention in {(topology_key(chain.topology), chain.convention): (chain.topology, chain.convention) for chain in self.chains}.values():
+                store.helicity_angles(topology, convention)
+        self.batch_alignment(momenta)
+        return store
+
+    def batch_alignment(self, momenta: dict, chains: Optional[list[Union[DecayChain, MultiChain]]] = None) -> None:
+        """
+        Computes the relative Wigner angles of the chains (default: all but the reference) with respect to the reference in one batch
+        and stores them in the kinematics store of the momenta, where the aligned chains look them up. Chains with the same topology share one computation.
+        """
+        chains = self.chains[1:] if chains is None else chains
+        with ensure_compile_time_eval():
+            KinematicsStore.of(momenta).relative_wigner_angles_batch(
+                self.reference.topology,
+                [chain.topology for chain in chains],
+                self.reference.convention,
+            )
+
+    @property
+    def top_chains(self) -> list[Union[DecayChain, MultiChain]]:
+        """
+        The reference chain followed by the aligned chains, in the order of `precompute`.
+        """
+        return [self.reference] + self.aligned_chains
+
+    @property
+    def structure(self) -> tuple:
+        """
+        A hashable description of the model: the topologies, quantum numbers, lineshapes and parameter names of all chains in the order of `top_chains`.
+        Together with the coupling names and the shapes of the event data it determines the traced amplitude. See `compile_cache.structural_hash`.
+        """
+        return tuple(chain.structure for chain in self.top_chains)
+
+    def components(self, ls_couplings: dict) -> list[Component]:
+        """
+        Splits the amplitude into components, which are each linear in a single product of couplings.
+        Every single chain contributes one component for every combination of one coupling key per resonance.
+        The amplitude is then sum_k C_k A_k with C_k the product of the couplings of component k, so the intensity is a Hermitian form in the C_k.
+        """
+        components = []
+        for i, chain in enumerate(self.top_chains):
+            inner_chains = chain.chains if isinstance(chain, MultiChain) else [chain]
+            for j, inner in enumerate(inner_chains):
+                resonances = inner.resonance_list
+                for keys in product(*[list(ls_couplings[resonance.id]["couplings"]) for resonance in resonances]):
+                    components.append(Component(i, j, tuple((resonance.id, key) for resonance, key in zip(resonances, keys))))
+        return components
+
+    def component_tensors(self, components: list[Component], arguments: dict, precomputed: Optional[list]=None):
+        """
+        Evaluates the aligned helicity tensors of all components with unit couplings.
+        Only the resonance parameters are taken from the arguments.
+
+        Returns:
+        array
+            Array of shape (K, *helicity_shape, *event_shape) with the components along the first axis
+        """
+        top_chains = self.top_chains
+        if precomputed is None:
+            precomputed = [chain.precomputed for chain in top_chains]
+        tensors = []
+        for component in components:
+            chain, chain_precomputed = top_chains[component.chain], precomputed[component.chain]
+            if isinstance(chain, MultiChain):
+                inner, inner_precomputed = chain.chains[component.inner], chain_precomputed["chains"][component.inner]
+            else:
+                inner, inner_precomputed = chain, chain_precomputed
+            unit_arguments = dict(arguments)
+            for resonance_id, key in component.couplings:
+                unit_arguments[resonance_id] = {"couplings": {key: 1.}}
+            tensor = inner.helicity_tensor(unit_arguments, inner_precomputed)
+            if "alignment" in chain_precomputed:
+                tensor = align_helicity_tensor(tensor, chain_precomputed["alignment"], chain.final_state_keys)
+            tensors.append(tensor)
+        return np.stack(tensors)
+
+    @staticmethod
+    def component_couplings(components: list[Component], arguments: dict):
+        """
+        The coupling products C_k of all components for the couplings in the arguments.
+        The couplings may carry leading batch axes, which are kept in front of the component axis.
+        """
+        return np.stack([
+            fold(mul, [arguments[resonance_id]["couplings"][key] for resonance_id, key in component.couplings], 1.)
+            for component in components
+        ], axis=-1)
+
+    def interference_integral(self, ls_couplings: dict, mc: dict, mc_weights=None, batch_size: Optional[int]=None):
+        """
+        Returns an `InterferenceIntegral` of the model over a phase space sample. See `decayamplitude.interference`.
+        """
+        from decayamplitude.interference import InterferenceIntegral
+        return InterferenceIntegral(self, ls_couplings, mc, mc_weights=mc_weights, batch_size=batch_size)
+
+    def normalization_function(self, ls_couplings: dict, mc: dict, mc_weights=None, complex_couplings=True, batch_size: Optional[int]=None) -> tuple[Callable, list[str]]:
+        """
+        Returns a function with the signature of `unpolarized_amplitude`, which computes the weighted mean of the unpolarized amplitude over a phase space sample as c^dagger M c.
+        The interference matrix M is cached on the values of the resonance parameters, so calls, which only change couplings, do not touch the sample.
+        The function has to be called with concrete values, i.e. outside of jit.
+        """
+        integral = self.interference_integral(ls_couplings, mc, mc_weights=mc_weights, batch_size=batch_size)
+        return _create_function(self.resonance_params, ls_couplings, integral, complex_couplings=complex_couplings)
+
+    def component_groups(self, components: list[Component], group_by: str="chain") -> tuple[list, onp.ndarray]:
+        """
+        Groups the components for fit fractions.
+
+        Parameters:
+        components: list[Component]
+            The components as produced by `components`
+        group_by: str
+            "chain" gives one group for every single chain, labeled by the names of its resonances.
+            "resonance" gives one group for every named resonance below the root, containing all chains, in which it appears.
+
+        Returns:
+        tuple[list, array]
+            The group labels and an indicator matrix of shape (G, K)
+        """
+        top_chains = self.top_chains
+        def inner_chain(component):
+            chain = top_chains[component.chain]
+            return chain.chains[component.inner] if isinstance(chain, MultiChain) else chain
+
+        if group_by == "chain":
+            keys = [(component.chain, component.inner) for component in components]
+            labels = list(dict.fromkeys(keys))
+            indicator = onp.array([[key == label for key in keys] for label in labels], dtype=onp.float64)
+            names = [tuple(resonance.name for resonance in inner_chain(components[keys.index(label)]).resonance_list) for label in labels]
+            return names, indicator
+        if group_by == "resonance":
+            contained = [
+                {resonance.name for resonance in inner_chain(component).resonance_list if resonance is not inner_chain(component).root_resonance}
+                for component in components
+            ]
+            labels = list(dict.fromkeys(name for names in contained for name in sorted(names)))
+            indicator = onp.array([[label in names for names in contained] for label in labels], dtype=onp.float64)
+            return labels, indicator
+        raise ValueError(f"group_by must be either 'chain' or 'resonance' but is {group_by}")
+
+    def fit_fractions(self, params: dict, mc: Union[dict, "InterferenceIntegral"], ls_couplings: Optional[dict]=None, group_by: str="chain", mc_weights=None, complex_couplings=True, batch_size: Optional[int]=None) -> dict:
+        """
+        Computes fit fractions and interference terms from a single pass over a phase space sample.
+        The interference matrix of all components is evaluated once (see `InterferenceIntegral`), everything else only needs the couplings.
+
+        Parameters:
+        params: dict
+            The parameters by name as for the function returned by `unpolarized_amplitude`.
+            All values may carry a leading batch axis to evaluate many parameter vectors at once, e.g. for the propagation of uncertainties.
+            If only the couplings vary, one matrix serves all vectors. Batched resonance parameters need one matrix per vector,
+            which are computed in one pass over the sample vectorized over the batch (see `InterferenceIntegral.matrices`), so the memory grows with the batch.
+        mc: dict | InterferenceIntegral
+            The four-momenta of the phase space sample or an already evaluated `InterferenceIntegral`
+        ls_couplings: dict
+            The couplings, which the parameter names refer to. Defaults to all couplings of the model
+        group_by: str
+            How the components are grouped. See `component_groups`.
+
+        Returns:
+        dict
+            "labels": the group labels
+            "fractions": the fit fractions with shape (..., G)
+            "interference": a (..., G, G) matrix with the fit fractions on the diagonal and the interference terms 2 Re(F_gh) / F on the off diagonal
+            "total": the weighted mean of the unpolarized amplitude over the sample
+        """
+        from decayamplitude.interference import InterferenceIntegral
+        if ls_couplings is None:
+            ls_couplings = self.generate_couplings()
+        integral = mc if isinstance(mc, InterferenceIntegral) else self.interference_integral(ls_couplings, mc, mc_weights=mc_weights, batch_size=batch_size)
+        to_arguments, _ = _create_function(self.resonance_params, ls_couplings, lambda arguments: arguments, complex_couplings=complex_couplings)
+        arguments = to_arguments(**params)
+
+        batch_shape = np.shape(integral.couplings(arguments))[:-1]
+        resonance_parameters = [np.broadcast_to(arguments[name], batch_shape) for name in integral.parameter_names]
+        if all(np.ndim(params[name]) == 0 for name in integral.parameter_names):
+            matrix = integral.matrix(arguments)
+        else:
+            # the resonance parameters differ between the parameter vectors, so every vector needs its own matrix
+            # all of them are computed in one pass over the sample
+            matrix = integral.matrices({
+                name: np.ravel(p) for name, p in zip(integral.parameter_names, resonance_parameters)
+            }).reshape(batch_shape + 2 * (len(integral.components),))
 
+        labels, indicator = self.component_groups(integral.components, group_by)
+        c = integral.couplings(arguments)
+        weighted = c[..., None, :] * indicator
+        groups = np.einsum("...gk,...kl,...hl->...gh", np.conj(weighted), matrix, weighted)
+        total = np.real(np.einsum("...k,...kl,...l->...", np.conj(c), matrix, c))
+        fractions = np.real(np.diagonal(groups, axis1=-2, axis2=-1)) / total[..., None]
+        interference = 2 * np.real(groups) / total[..., None, None]
+        diagonal = onp.eye(len(labels), dtype=bool)
+        interference = np.where(diagonal, fractions[..., None] * diagonal, interference)
+        return {
+            "labels": labels,
+            "fractions": fractions,
+            "interference": interference,
+            "total": total,
+        }
 
     @property
     def root_resonance(self):
@@ -50,32 +349,88 @@ class ChainCombiner:
         return chains
 
     @property
-    def combined_function(self):
+    def combined_tensor(self) -> Callable:
         """
-        Returns a function that combines the amplitudes of all chains
+        Returns a function f(arguments, precomputed=None), which evaluates the sum of the aligned helicity tensors of all chains.
+        All aligned chains are evaluated exactly once per call and share one lineshape cache. The result has the layout of `DecayChain.helicity_tensor` of the reference chain.
+        The precomputed tensors have to be given as a list as produced by `precompute`.
+        If `threads` is set and the call is not traced, the chains are evaluated concurrently. See `parallel_tensor`.
         """
-        def f(h0, lambdas:dict, arguments:dict):
+        tensors = [self.reference.helicity_tensor] + [chain.aligned_tensor for chain in self.aligned_chains]
+        def f(arguments:dict, precomputed:Optional[list]=None):
+            if self.threads is not None and not _contains_tracer((arguments, precomputed)):
+                return self.parallel_tensor(arguments, precomputed)
+            if precomputed is None:
+                precomputed = [None] * len(tensors)
+            cache = {}
+            return sum(
+                tensor(arguments, p, cache)
+                for tensor, p in zip(tensors, precomputed)
+            )
+        return f
 
-            amplitudes = [
-                chain.aligned_matrix(h0, arguments)[tuple(lambdas[k] for k in sorted(lambdas.keys()))]
-                for chain in self.aligned_chains
-            ]
-            return sum(amplitudes) + self.reference.chain_function(h0, lambdas, arguments)
+    def parallel_tensor(self, arguments:dict, precomputed:Optional[list]=None):
+        """
+        Evaluates the combined tensor eagerly in a thread pool of `threads` threads.
+        Every chain and every member of a MultiChain is a separate task. The tasks are submitted in order of decreasing `chain_cost`, which is evaluated once on construction, 
+        so that the heavy chains do not end up last. The results are summed in the order of the chains, so the result does not depend on the scheduling.
+        All tasks share one lineshape cache. Concurrent tasks may evaluate a shared lineshape twice, but never get different values.
+        """
+        if precomputed is None:
+            # resolve the cached properties here, so that they are not evaluated from several threads
+            precomputed = [chain.precomputed for chain in self.top_chains]
+        # one task per (top chain, inner chain)
+        tasks = {}
+        for i, (chain, p) in enumerate(zip(self.top_chains, precomputed)):
+            if isinstance(chain, MultiChain):
+                tasks.update({(i, j): (inner, p["chains"][j]) for j, inner in enumerate(chain.chains)})
+            else:
+                tasks[(i, 0)] = (chain, p)
+        cache = {}
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            futures = {
+                index: pool.submit(tasks[index][0].helicity_tensor, arguments, tasks[index][1], cache)
+                for index in self.__task_order
+            }
+            results = {index: future.result() for index, future in futures.items()}
+
+        total = 0
+        for i, (chain, p) in enumerate(zip(self.top_chains, precomputed)):
+            n_inner = len(chain.chains) if isinstance(chain, MultiChain) else 1
+            tensor = sum(results[(i, j)] for j in range(n_inner))
+            if i > 0:
+                tensor = align_helicity_tensor(tensor, p["alignment"], chain.final_state_keys)
+            total = total + tensor
+        return total
+
+    @property
+    def combined_function(self):
+        """
+        Returns a function f(h0, lambdas, arguments, precomputed=None) that combines the amplitudes of all chains.
+        The helicities may also be given as arrays of equal length. In this case the amplitudes for all requested helicity combinations are returned as a batch,
+        with the helicity axis in front of the event axes. The aligned tensors are only evaluated once for the whole batch.
+        """
+        tensor = self.combined_tensor
+        def f(h0, lambdas:dict, arguments:dict, precomputed:Optional[list]=None):
+            return tensor(arguments, precomputed)[self.reference.helicity_index(h0, lambdas)]
 
         return f
     
-    def polarized_amplitude(self, ls_couplings:dict[int, dict[str: dict[LSTuple, float]]]) -> tuple[Callable, list[str], list[str]]:
+    def polarized_amplitude(self, ls_couplings:dict[int, dict[str: dict[LSTuple, float]]], event_data:bool=False) -> tuple[Callable, list[str], list[str]]:
         """
-        Returns a function that combines the amplitudes of all chains
+        Returns a function that combines the amplitudes of all chains.
+        The helicity arguments may be arrays of equal length to evaluate a batch of helicity combinations at once. See `combined_function`.
+        If event_data is True, the function takes the output of `precompute` for any event sample as its first argument `data`.
         """
         sorted_final_state_nodes = sorted([n.node.value for n in self.reference.final_state_nodes])
         final_state_lambdas = sorted([f"h_{n}" for n in sorted_final_state_nodes]) 
+        combined_function = self.combined_function
         def fun(arguments:dict):
             # build lambda dict, as it is used internally from plain parameters
             h0 = arguments.pop("h0")
             lambdas = {n: arguments.pop(k) for k, n  in zip(final_state_lambdas, sorted_final_state_nodes)}
-            return self.combined_function(h0, lambdas, arguments)
-        polarized, argnames = _create_function(["h0", *final_state_lambdas] + self.resonance_params, ls_couplings, fun)
+            return combined_function(h0, lambdas, arguments, arguments["data"] if event_data else None)
+        polarized, argnames = _create_function(["h0", *final_state_lambdas] + self.resonance_params, ls_couplings, fun, event_data=event_data)
 
         return polarized, ["h0", *final_state_lambdas], argnames[len(final_state_lambdas)+1:]
 
@@ -86,30 +441,23 @@ class ChainCombiner:
         Returns a function that combines the matrices of all chains.
         The final matrix will be a sum of all matrices, where the alignment is already performed.
         """
-        def matrix(h0, arguments:dict) -> dict:
-            matrices = [
-                chain.aligned_matrix(h0, arguments)
-                for chain in self.aligned_chains
-            ]
-            matrices.append(self.reference.matrix(h0, arguments))
-
-            return {
-                key: sum(matrix[key] for matrix in matrices)
-                for key in matrices[0].keys()
-            }
+        tensor = self.combined_tensor
+        def matrix(h0, arguments:dict, precomputed:Optional[list]=None) -> dict:
+            return self.reference.tensor_to_matrix(tensor(arguments, precomputed), h0)
         return matrix
     
-    def matrix_function(self, ls_couplings:dict[int, dict[str: dict[LSTuple, float]]], complex_couplings: bool=True) -> tuple[Callable, list[str]]:
+    def matrix_function(self, ls_couplings:dict[int, dict[str: dict[LSTuple, float]]], complex_couplings: bool=True, event_data:bool=False) -> tuple[Callable, list[str]]:
         """
         Returns a function that combines the matrices of all chains.
         The final matrix will be a sum of all matrices, where the alignment is already performed.
+        If event_data is True, the function takes the output of `precompute` for any event sample as its first argument `data`.
         """
         if "h0" in self.resonance_params:
             raise ValueError("The parameter name 'h0' is reserved for the helicity quantum number of the mother particle. Please choose another name for the resonance parameter.")
         def fun(arguments:dict):
             h0 = arguments["h0"]
-            return self.combined_matrix(h0, arguments)
-        return _create_function(["h0"] + self.resonance_params, ls_couplings, fun, complex_couplings=complex_couplings)
+            return self.combined_matrix(h0, arguments, arguments["data"] if event_data else None)
+        return _create_function(["h0"] + self.resonance_params, ls_couplings, fun, complex_couplings=complex_couplings, event_data=event_data)
     
     def generate_couplings(self):
         """
@@ -130,20 +478,80 @@ class ChainCombiner:
             # raise ValueError(f"Parameter names are not unique: {', '.join([name for name, count in c.items() if count > 1])}")
         return list(set(resonance_parameter_names))
 
-    def unpolarized_amplitude(self, ls_couplings: dict, complex_couplings=True) -> tuple[Callable, list[str]]:
-
+    def unpolarized_amplitude(self, ls_couplings: dict, complex_couplings=True, event_data=False, flat=False) -> tuple[Callable, Union[list[str], ParameterLayout]]:
+        """
+        Returns a function that calculates the unpolarized amplitude of all chains combined.
+        If event_data is True, the function takes the output of `precompute` for any event sample as its first argument `data`,
+        so that one compiled function can be used for the data sample, the normalization sample and toys. The returned argument names do not contain `data`.
+        If flat is True, the function takes all parameters as one float array x (after `data`) and a `ParameterLayout` is returned instead of the argument names.
+        The layout has the argument names in the same order under `names`. This form can be passed to optimizers and `vmap` directly.
+        """
         if self.root_resonance is None:
             raise ValueError(f"The root resonance must be the same for all chains! Root = {self.reference.topology.root}.")
 
+        tensor = self.combined_tensor
+        helicity_axes = tuple(range(1 + len(self.reference.final_state_keys)))
         def f(arguments:dict):
-            return sum(
-                    abs(v)**2 
-                    for h0 in self.root_resonance.quantum_numbers.angular.projections()
-                    for v in self.combined_matrix(h0, arguments).values()
-                )
+            return np.sum(abs(tensor(arguments, arguments["data"] if event_data else None))**2, axis=helicity_axes)
+
+        return _create_function(self.resonance_params, ls_couplings, f, complex_couplings=complex_couplings, event_data=event_data, flat=flat)
 
-        return _create_function(self.resonance_params, ls_couplings, f, complex_couplings=complex_couplings)
-        
+    def streaming_function(self, ls_couplings: dict, complex_couplings=True, batch_size: Optional[int]=None, compiled_kinematics: bool=False) -> tuple[Callable, list[str]]:
+        """
+        Returns a function reduce(batches, *args, gradient=False), which evaluates the unpolarized amplitude batch by batch and only keeps reductions over the events.
+        Per event intermediates are only ever held for a single batch, so event samples larger than the memory can be processed.
+
+        All batches are padded to the same size with events of weight 0, so one compiled kernel is used for the whole sample.
+        The batches can be given as a single dict of four-momenta, which is split into batches of batch_size events,
+        or as an iterable of dicts of four-momenta or (momenta, weights) tuples.
+        With compiled_kinematics=True the kinematics of every batch are computed by one jitted program, which all batches share (see `precompute_kinematics`).
 
-        
+        The returned dict contains
+        "sum_log_intensity": sum_i w_i log(I_i)
+        "sum_intensity": sum_i w_i I_i
+        "sum_weights": sum_i w_i
+        and if gradient is True the gradients of the first two sums with respect to the arguments in the order of the argument names as
+        "grad_sum_log_intensity" and "grad_sum_intensity".
+        """
+        require_jax("streaming_function")
+        unpolarized, layout = self.unpolarized_amplitude(ls_couplings, complex_couplings=complex_couplings, event_data=True, flat=True)
+
+        def reductions(data, weights, parameters):
+            intensity = unpolarized(data, parameters)
+            # padded events have weight 0, their intensity must not produce nan in the log or its gradient
+            log_intensity = np.log(np.where(weights == 0, 1., intensity))
+            return np.stack([np.sum(weights * log_intensity), np.sum(weights * intensity)])
+
+        def reductions_with_aux(data, weights, parameters):
+            values = reductions(data, weights, parameters)
+            return values, values
+
+        kernel = jit(reductions)
+        # the values come out of the same pass as the gradients
+        gradient_kernel = jit(jacrev(reductions_with_aux, argnums=2, has_aux=True))
+
+        def reduce(batches, *args, gradient=False) -> dict:
+            parameters = np.array(args, dtype=np.float64)
+            totals = np.zeros(2)
+            gradients = np.zeros((2, len(args)))
+            sum_weights = 0.
+            for momenta, weights in iterate_batches(batches, batch_size):
+                data = self.precompute(momenta, compiled_kinematics=compiled_kinematics)
+                if gradient:
+                    batch_gradients, batch_totals = gradient_kernel(data, weights, parameters)
+                    gradients = gradients + batch_gradients
+                else:
+                    batch_totals = kernel(data, weights, parameters)
+                totals = totals + batch_totals
+                sum_weights += float(weights.sum())
+            result = {
+                "sum_log_intensity": totals[0],
+                "sum_intensity": totals[1],
+                "sum_weights": sum_weights,
+            }
+            if gradient:
+                result["grad_sum_log_intensity"] = gradients[0]
+                result["grad_sum_intensity"] = gradients[1]
+            return result
 
+        return reduce, layout.names
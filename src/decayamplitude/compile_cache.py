@@ -0,0 +1,257 @@
+"""
+Reuse of compiled likelihood functions within a process and across processes.
+
+The entries in `config.cache_dir`/compiled are XLA executables, which are read back with `pickle.load`.
+Loading a pickle can execute arbitrary code, so the cache directory must only be writable by trusted users.
+Entries, which can not be read or loaded (e.g. written by another jaxlib version or for other devices), are reported with a warning and deleted.
+"""
+import os
+import sys
+import types
+import pickle
+import hashlib
+import functools
+import warnings
+from typing import Callable, Optional
+
+import jax
+from jax import jit
+from jax.experimental.serialize_executable import serialize, deserialize_and_load
+import numpy as onp
+
+from decayamplitude.config import config
+
+# bump this, if the layout of the cached files or the meaning of the hashed structure changes
+COMPILE_CACHE_VERSION = 2
+
+# compiled functions of this process, keyed by their structural hash
+_compiled: dict[str, Callable] = {}
+
+
+class Unhashable(Exception):
+    """
+    Raised, if a part of a model can not be fingerprinted in a way, which is stable across processes.
+    """
+
+
+# top level packages, whose versions are part of every hash, so that their functions are described by their name only
+# decayamplitude itself is described by the digest of its source files (see `package_digest`)
+VERSIONED_PACKAGES = ("jax", "jaxlib", "numpy", "sympy", "decayangle")
+
+
+def _versioned(module: Optional[str]) -> bool:
+    top = (module or "").split(".")[0]
+    return top in VERSIONED_PACKAGES or top == "decayamplitude" or top in sys.stdlib_module_names
+
+
+@functools.lru_cache(maxsize=None)
+def _file_digest(path: str, mtime: float, size: int) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def source_digest(module: Optional[str]) -> Optional[str]:
+    """
+    A hash of the source file of a module. None for modules without a file, e.g. __main__ of an interactive session.
+    """
+    path = getattr(sys.modules.get(module), "__file__", None)
+    if path is None or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return _file_digest(path, stat.st_mtime, stat.st_size)
+
+
+def package_digest() -> str:
+    """
+    A hash of all source files of decayamplitude, so that changes of an editable install change every key.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for directory, _, files in sorted(os.walk(root)):
+        for name in sorted(files):
+            if name.endswith(".py"):
+                path = os.path.join(directory, name)
+                digest.update(os.path.relpath(path, root).encode())
+                stat = os.stat(path)
+                digest.update(_file_digest(path, stat.st_mtime, stat.st_size).encode())
+    return digest.hexdigest()
+
+
+def fingerprint(value, seen: Optional[set] = None):
+    """
+    A nested tuple of strings, which describes a value and is the same in every process, in which the value is constructed in the same way.
+
+    Functions are described by their code, their constants, defaults, closures and the values of the globals they use, which are described recursively.
+    Only functions of the packages in `VERSIONED_PACKAGES`, of the standard library and of decayamplitude itself are described by their name,
+    since the versions of these packages and the source of decayamplitude are part of every hash (see `structural_hash`).
+    Classes and modules of other packages are described by their name and a hash of the source file of their module.
+    Arrays are described by their shape, dtype and a hash of their content.
+
+    Raises:
+    Unhashable
+        If a value has no stable description
+    """
+    seen = set() if seen is None else seen
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        return (type(value).__name__, repr(value))
+    if isinstance(value, (tuple, list)):
+        return (type(value).__name__,) + tuple(fingerprint(v, seen) for v in value)
+    if isinstance(value, dict):
+        return ("dict",) + tuple(sorted((repr(k), fingerprint(v, seen)) for k, v in value.items()))
+    if isinstance(value, (onp.ndarray, onp.generic, jax.Array)):
+        array = onp.asarray(value)
+        return ("array", str(array.shape), str(array.dtype), hashlib.sha256(array.tobytes()).hexdigest())
+    if isinstance(value, jax.ShapeDtypeStruct):
+        return ("abstract", str(value.shape), str(value.dtype))
+    if isinstance(value, types.ModuleType):
+        if _versioned(value.__name__):
+            return ("module", value.__name__)
+        return ("module", value.__name__, source_digest(value.__name__))
+    if isinstance(value, types.CodeType):
+        return (
+            "code",
+            value.co_code.hex(),
+            value.co_names,
+            value.co_varnames,
+            tuple(fingerprint(c, seen) for c in value.co_consts),
+        )
+    if isinstance(value, functools.partial):
+        return ("partial", fingerprint(value.func, seen), fingerprint(value.args, seen), fingerprint(value.keywords, seen))
+    if isinstance(value, types.MethodType):
+        return ("method", fingerprint(value.__func__, seen), fingerprint(value.__self__, seen))
+    if isinstance(value, types.FunctionType):
+        name = ("function", value.__module__, value.__qualname__)
+        if _versioned(value.__module__):
+            return name
+        if id(value) in seen:
+            # recursive functions
+            return name
+        seen = seen | {id(value)}
+        used_globals = {
+            key: value.__globals__[key]
+            for key in value.__code__.co_names
+            if key in value.__globals__
+        }
+        return name + (
+            fingerprint(value.__code__, seen),
+            fingerprint(value.__defaults__, seen),
+            fingerprint(value.__kwdefaults__, seen),
+            fingerprint([cell.cell_contents for cell in value.__closure__ or ()], seen),
+            fingerprint(used_globals, seen),
+        )
+    if isinstance(value, type) or callable(value) and hasattr(value, "__qualname__"):
+        # classes, builtins and compiled functions
+        module = getattr(value, "__module__", None)
+        if _versioned(module):
+            return ("object", module, value.__qualname__)
+        return ("object", module, value.__qualname__, source_digest(module))
+    raise Unhashable(f"Can not fingerprint {value!r} of type {type(value)}")
+
+
+def structural_hash(*parts) -> Optional[str]:
+    """
+    A hex digest of the fingerprints of all parts together with the versions of the packages in `VERSIONED_PACKAGES`,
+    the source of decayamplitude and the platform.
+    Returns None, if one of the parts can not be fingerprinted.
+    """
+    from importlib.metadata import version, PackageNotFoundError
+    versions = []
+    for package in VERSIONED_PACKAGES:
+        try:
+            versions.append((package, version(package)))
+        except PackageNotFoundError:
+            versions.append((package, None))
+    environment = (COMPILE_CACHE_VERSION, tuple(versions), package_digest(), jax.default_backend(), jax.config.jax_enable_x64)
+    try:
+        description = fingerprint((environment,) + parts)
+    except Unhashable:
+        return None
+    return hashlib.sha256(repr(description).encode()).hexdigest()
+
+
+def abstract_arguments(args):
+    """
+    Replaces every array of a pytree by a jax.ShapeDtypeStruct.
+    """
+    return jax.tree_util.tree_map(lambda x: jax.ShapeDtypeStruct(onp.shape(x), jax.numpy.result_type(x)), args)
+
+
+def _cache_path(key: str) -> Optional[str]:
+    if config.cache_dir is None:
+        return None
+    return os.path.join(config.cache_dir, "compiled", f"{key}.xla")
+
+
+def _compile(f: Callable, *args) -> jax.stages.Compiled:
+    return jit(f).lower(*args).compile()
+
+
+def load_compiled(key: str) -> Optional[jax.stages.Compiled]:
+    """
+    Loads a compiled function from the cache directory. Returns None, if it does not exist.
+    An entry, which can not be loaded, e.g. because it was compiled with another jaxlib version or for other devices, is deleted with a warning.
+    """
+    path = _cache_path(key)
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            return deserialize_and_load(*pickle.load(f))
+    # unpickling fails with EOFError, AttributeError or ImportError besides UnpicklingError, loading an incompatible executable with a JaxRuntimeError
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, TypeError, ValueError, jax.errors.JaxRuntimeError) as e:
+        warnings.warn(f"Could not load the compiled function {path}, it is compiled again: {e!r}")
+        _remove(path)
+        return None
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def save_compiled(key: str, compiled: jax.stages.Compiled) -> None:
+    """
+    Writes a compiled function to the cache directory. If it can not be serialized or written, a warning is emitted and the function is only kept in memory.
+    """
+    path = _cache_path(key)
+    if path is None:
+        return
+    # write to a temporary file first, so that parallel jobs never read half written files
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        serialized = pickle.dumps(serialize(compiled))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temporary, "wb") as f:
+            f.write(serialized)
+        os.replace(temporary, path)
+    except (OSError, pickle.PicklingError, TypeError, ValueError, jax.errors.JaxRuntimeError) as e:
+        warnings.warn(f"Could not write the compiled function to {path}: {e!r}")
+        _remove(temporary)
+
+
+def cached_jit(f: Callable, key: Optional[str], *args) -> Callable:
+    """
+    Like `jit(f)`, but the compiled function is shared by all calls with the same key.
+    In this process the compiled function is kept in memory. If `config.cache_dir` is set, the XLA executable is also stored there,
+    so a new process with the same key neither traces nor compiles f. The global configuration of jax is not changed.
+
+    Parameters:
+    f: Callable
+        The function to compile. It must not depend on anything, which is not described by the key
+    key: str
+        The structural hash of everything f depends on, including the shapes of the arguments. If None, f is simply jitted
+    args:
+        Example arguments with the structure, shapes and dtypes of all later calls
+    """
+    if key is None:
+        return jit(f)
+    if key in _compiled:
+        return _compiled[key]
+    compiled = load_compiled(key)
+    if compiled is None:
+        compiled = _compile(f, *args)
+        save_compiled(key, compiled)
+    _compiled[key] = compiled
+    return compiled
@@ -0,0 +1,153 @@
+from typing import Optional
+
+from jax import jit
+from jax.tree_util import tree_map
+import numpy as onp
+
+from decayangle.decay_topology import Topology, Node, HelicityAngles
+from decayangle.lorentz import WignerAngles
+
+from decayamplitude.backend import numpy as np, require_jax
+from decayamplitude.kinematics_helpers import (
+    rotate_z,
+    rotate_y,
+    helicity_angles_of,
+    rapidity,
+    sl2_boost_z,
+    sl2_inverse,
+    helicity_rotation,
+    decode_rotation,
+)
+from decayamplitude.kinematics import (
+    KinematicsStore,
+    particles,
+    topology_key,
+    helicity_angles_key,
+    mass_key,
+    relative_wigner_angles_key,
+)
+
+
+# four-vectors are tuples (x, y, z, E) of arrays with the event axis, see the helpers in decayamplitude.kinematics_helpers
+
+def _boost_z(v: tuple, xi) -> tuple:
+    x, y, z, e = v
+    return (x, y, np.cosh(xi) * z + np.sinh(xi) * e, np.sinh(xi) * z + np.cosh(xi) * e)
+
+
+def _sum(vectors: list[tuple]) -> tuple:
+    return tuple(sum(v[i] for v in vectors) for i in range(4))
+
+
+def _internal_nodes(topology: Topology) -> list[Node]:
+    return [node for node in topology.root.preorder() if not node.final_state]
+
+
+class CompiledKinematics:
+    """
+    Computes all kinematic quantities a model needs (helicity angles, invariant masses and relative Wigner angles) in one compiled XLA program.
+    It follows the same steps as `KinematicsStore.frame`, but with jax operations only, so it can be traced.
+    The results are added to the `KinematicsStore` of the sample, where the chains find them.
+    Use it through `ChainCombiner.precompute(momenta, compiled_kinematics=True)`, `ChainCombiner.streaming_function` or `Likelihood`.
+    """
+
+    def __init__(self, topologies: list[tuple[Topology, str]], alignments: Optional[list[tuple[Topology, Topology, str]]] = None) -> None:
+        """
+        Parameters:
+        topologies: list[tuple[Topology, str]]
+            The topologies and conventions, for which the helicity angles are needed
+        alignments: list[tuple[Topology, Topology, str]]
+            The (reference, topology, convention) triples, for which the relative Wigner angles are needed
+        """
+        require_jax("CompiledKinematics")
+        self.topologies = list({(topology_key(t), c): (t, c) for t, c in topologies}.values())
+        # the reference is not rotated with respect to itself, so these pairs are left to the store
+        self.alignments = list({
+            (topology_key(r), topology_key(t), c): (r, t, c)
+            for r, t, c in alignments or []
+            if topology_key(r) != topology_key(t)
+        }.values())
+        all_topologies = [t for t, _ in self.topologies] + [t for triple in self.alignments for t in triple[:2]]
+        self.final_state_keys = sorted({key for t in all_topologies for key in particles(t.root)})
+        self.nodes = list({particles(node): node for t in all_topologies for node in t.nodes.values()}.values())
+        self.__compiled = jit(self.evaluate)
+
+    def __frame(self, frames: dict, topology: Topology, node: Node, convention: str) -> tuple:
+        # the SL(2, C) matrix of the boost into the rest frame of the node and the four-vectors of the final state particles in that frame
+        path, node_dict = topology.path_to(node)
+        key, matrix, momenta = (), None, frames[()]
+        for parent, target in zip(path[:-1], path[1:]):
+            parent, target = node_dict[parent], node_dict[target]
+            key = key + ((particles(parent), particles(parent.daughters[0]), particles(target)),)
+            if (convention, key) not in frames:
+                phi, theta = helicity_angles_of(_sum([momenta[k] for k in particles(parent.daughters[0])]), np)
+                first = target == parent.daughters[0]
+                rotation = helicity_rotation(phi, theta, first, convention, np)
+                if convention == "minus_phi":
+                    rotated = {k: rotate_z(rotate_y(rotate_z(v, -phi, np), -theta, np), phi, np) for k, v in momenta.items()}
+                else:
+                    rotated = {k: rotate_y(rotate_z(v, -phi, np), -theta, np) for k, v in momenta.items()}
+                if not first:
+                    rotated = {k: rotate_y(v, -np.pi, np) for k, v in rotated.items()}
+                x, y, z, e = _sum([rotated[k] for k in particles(target)])
+                xi = -rapidity(np.sqrt(x**2 + y**2 + z**2), e, np)
+                step = sl2_boost_z(xi, np) @ rotation
+                frames[(convention, key)] = (
+                    step if matrix is None else step @ matrix,
+                    {k: _boost_z(v, xi) for k, v in rotated.items()},
+                )
+            matrix, momenta = frames[(convention, key)]
+        return matrix, momenta
+
+    def evaluate(self, stacked) -> tuple[list, list, list]:
+        """
+        The kinematics for the four-momenta stacked along the second axis in the order of `final_state_keys`, i.e. with shape (n, n_final_state, 4).
+        Returns the helicity angles in the order of `topologies`, the masses in the order of `nodes` and the Wigner angles in the order of `alignments`.
+        The angles of a topology are lists in the order of its internal nodes or final state particles, since jax can not sort the mixed dict keys.
+        """
+        frames = {(): {key: tuple(stacked[:, i, j] for j in range(4)) for i, key in enumerate(self.final_state_keys)}}
+        helicity_angles = []
+        for topology, convention in self.topologies:
+            helicity_angles.append([
+                helicity_angles_of(_sum([self.__frame(frames, topology, node, convention)[1][k] for k in particles(node.daughters[0])]), np)
+                for node in _internal_nodes(topology)
+            ])
+        masses = []
+        for node in self.nodes:
+            x, y, z, e = _sum([frames[()][k] for k in particles(node)])
+            masses.append(np.sqrt(e**2 - x**2 - y**2 - z**2))
+        wigner_angles = []
+        for reference, topology, convention in self.alignments:
+            wigner_angles.append([
+                decode_rotation(
+                    self.__frame(frames, topology, target, convention)[0] @ sl2_inverse(self.__frame(frames, reference, target, convention)[0], np),
+                    np,
+                )
+                for target in reference.final_state_nodes
+            ])
+        return helicity_angles, masses, wigner_angles
+
+    def __call__(self, momenta: dict) -> KinematicsStore:
+        """
+        Evaluates the compiled program for a sample and adds the results to the `KinematicsStore` of the sample.
+        The program is compiled once per sample size, so streaming padded batches of one size (see `ChainCombiner.streaming_function`)
+        reuses it, while every batch keeps only its own results.
+        Samples, which are not given as four-momenta (e.g. `DalitzVariables`), are evaluated from their four-momenta `momenta.momenta()`.
+        """
+        four_momenta = momenta.momenta() if hasattr(momenta, "kinematics_store") else momenta
+        stacked = onp.stack([onp.asarray(four_momenta[key]) for key in self.final_state_keys], axis=1)
+        # the results live on the host like the ones computed by the store itself
+        helicity_angles, masses, wigner_angles = tree_map(onp.asarray, self.__compiled(stacked))
+        store = KinematicsStore.of(momenta)
+        store.provide({
+            **{
+                helicity_angles_key(t, c): {(node.daughters[0].value, node.daughters[1].value): HelicityAngles(*a) for node, a in zip(_internal_nodes(t), angles)}
+                for (t, c), angles in zip(self.topologies, helicity_angles)
+            },
+            **{mass_key(node): m for node, m in zip(self.nodes, masses)},
+            **{
+                relative_wigner_angles_key(r, t, c): {target.value: WignerAngles(*a) for target, a in zip(r.final_state_nodes, angles)}
+                for (r, t, c), angles in zip(self.alignments, wigner_angles)
+            },
+        })
+        return store
@@ -0,0 +1,85 @@
+import os
+from types import ModuleType
+from typing import Callable, Optional
+import numpy
+import jax.numpy
+
+
+class _cfg:
+    __state = {
+        "backend": "jax",
+        "cache_dir": os.environ.get(
+            "DECAYAMPLITUDE_CACHE_DIR",
+            os.path.join(os.path.expanduser("~"), ".cache", "decayamplitude"),
+        ),
+    }
+
+    backend_map = {
+        "jax": jax.numpy,
+        "numpy": numpy,
+    }
+
+    # called without arguments after the backend was changed, see `on_backend_change`
+    __backend_listeners = []
+
+    @property
+    def backend(self) -> ModuleType:
+        """
+        The array module used for all calculations. jax is needed for jit and gradients,
+        plain numpy avoids the dispatch and compile overhead of jax when only a few events are evaluated eagerly.
+
+        Returns:
+            module: The array module
+        """
+        return self.backend_map[self.__state["backend"]]
+
+    @backend.setter
+    def backend(self, value: str):
+        """
+        Set the array module used for all calculations.
+
+        Args:
+            value (str): Either "jax" or "numpy"
+        """
+        if value not in self.backend_map:
+            raise ValueError(f"Backend {value} not found, choose one of {list(self.backend_map)}")
+        changed = value != self.__state["backend"]
+        self.__state["backend"] = value
+        if changed:
+            for listener in self.__backend_listeners:
+                listener()
+
+    def on_backend_change(self, listener: Callable[[], None]) -> None:
+        """
+        Registers a function, which is called without arguments every time the backend is changed.
+        Used to drop everything, which was resolved or computed for the previous backend.
+
+        Args:
+            listener (Callable): The function to call
+        """
+        self.__backend_listeners.append(listener)
+
+    @property
+    def cache_dir(self) -> Optional[str]:
+        """
+        The directory in which persistent caches are stored.
+        Defaults to the environment variable DECAYAMPLITUDE_CACHE_DIR or ~/.cache/decayamplitude.
+        If set to None, nothing is written to disk.
+
+        Returns:
+            str: The cache directory
+        """
+        return self.__state["cache_dir"]
+
+    @cache_dir.setter
+    def cache_dir(self, value: Optional[str]):
+        """
+        Set the directory in which persistent caches are stored.
+
+        Args:
+            value (str): The cache directory or None to disable persistent caches
+        """
+        self.__state["cache_dir"] = value
+
+
+config = _cfg()
@@ -0,0 +1,261 @@
+from typing import Optional, Union
+
+from decayangle.decay_topology import Topology, Node, HelicityAngles
+from decayangle.lorentz import LorentzTrafo, WignerAngles
+from decayangle.config import config as decayangle_config
+
+from decayamplitude.kinematics import KinematicsStore, particles, topology_key, helicity_angles_key, mass_key, relative_wigner_angles_key
+from decayamplitude.kinematics_helpers import (
+    rotate_z,
+    rotate_y,
+    helicity_angles_of,
+    rapidity,
+    sl2_boost_z,
+    sl2_inverse,
+    helicity_rotation,
+    decode_rotation,
+)
+
+
+class DalitzKinematics(KinematicsStore):
+    """
+    The kinematics of a three body decay computed in closed form from the invariants and the orientation of a `DalitzVariables` sample.
+    Helicity angles, invariant masses and boosts are the ones decayangle computes from the four-momenta of `DalitzVariables.momenta()`,
+    but no four-vector is boosted: the angles follow from rotations of the three-momenta in the rest frame of the decaying particle,
+    the rapidities from the invariant masses. Relative Wigner angles are products of the 2x2 matrices of these steps, decoded in SU(2).
+    """
+
+    def __init__(self, variables: "DalitzVariables") -> None:
+        super().__init__(variables)
+        self.variables = variables
+
+    def __vectors(self) -> dict:
+        # energies and three-momenta of the final state particles in the rest frame of the decaying particle
+        return self.cached(("vectors",), self.variables.vectors)
+
+    def __momentum(self, node: Node) -> tuple:
+        vectors = self.__vectors()
+        keys = particles(node)
+        energy = sum(vectors[key][0] for key in keys)
+        p = tuple(sum(vectors[key][1][i] for key in keys) for i in range(3))
+        return energy, p
+
+    def __check(self, topology: Topology) -> None:
+        if topology.root.value != self.variables.root or set(particles(topology.root)) != set(self.variables.final_state_keys):
+            raise ValueError(f"The topology {topology.tuple} does not describe the decay {self.variables.root} -> {self.variables.final_state_keys}")
+
+    def mass(self, node: Union[Node, tuple, int]):
+        """
+        The invariant mass of a node from the masses and invariants of the sample.
+        """
+        keys = particles(node)
+        def compute():
+            cb = decayangle_config.backend
+            one = cb.ones_like(self.variables.sigma(*self.variables.final_state_keys[:2]))
+            if len(keys) == 1:
+                return self.variables.masses[keys[0]] * one
+            if len(keys) == 2:
+                return cb.sqrt(self.variables.sigma(*keys))
+            return self.variables.masses[self.variables.root] * one
+        return self.cached(mass_key(node), compute)
+
+    def __steps(self, topology: Topology, convention: str) -> dict:
+        # the rotation and the rapidity of every step along the decay tree, keyed by the node, which is boosted to
+        # together with the helicity angles of every internal node
+        def compute():
+            self.__check(topology)
+            root = topology.root
+            isobar = next(d for d in root.daughters if not d.final_state)
+            cb = decayangle_config.backend
+            root_angles = HelicityAngles(*helicity_angles_of(self.__momentum(root.daughters[0])[1], cb))
+            phi, theta = root_angles
+            steps = {}
+            for daughter in root.daughters:
+                energy, _ = self.__momentum(daughter)
+                steps[daughter.value] = (root, (phi, theta), daughter == root.daughters[0], rapidity(self.breakup_momentum(root), energy, cb))
+
+            # the first daughter of the isobar in the helicity frame of the isobar
+            _, p = self.__momentum(isobar.daughters[0])
+            if convention == "minus_phi":
+                p = rotate_z(rotate_y(rotate_z(p, -phi, cb), -theta, cb), phi, cb)
+            elif convention == "helicity":
+                p = rotate_y(rotate_z(p, -phi, cb), -theta, cb)
+            else:
+                raise ValueError(f"Convention {convention} not supported. Use 'helicity' or 'minus_phi'.")
+            if isobar != root.daughters[0]:
+                p = rotate_y(p, -cb.pi, cb)
+            isobar_energy, _ = self.__momentum(isobar)
+            energy, _ = self.__momentum(isobar.daughters[0])
+            x, y, z = p
+            # the boost along z into the rest frame of the isobar
+            mass = self.mass(isobar)
+            z = (isobar_energy * z - self.breakup_momentum(root) * energy) / mass
+            isobar_angles = HelicityAngles(*helicity_angles_of((x, y, z), cb))
+            for daughter in isobar.daughters:
+                daughter_energy = (mass**2 + self.mass(daughter)**2 - self.mass(next(d for d in isobar.daughters if d != daughter))**2) / (2 * mass)
+                steps[daughter.value] = (isobar, isobar_angles, daughter == isobar.daughters[0], rapidity(self.breakup_momentum(isobar), daughter_energy, cb))
+            angles = {
+                (root.daughters[0].value, root.daughters[1].value): root_angles,
+                (isobar.daughters[0].value, isobar.daughters[1].value): isobar_angles,
+            }
+            return steps, angles
+        return self.cached(("steps", topology_key(topology), convention), compute)
+
+    def helicity_angles(self, topology: Topology, convention: str = "helicity") -> dict:
+        """
+        The helicity angles of all internal nodes of a three body topology as produced by `Topology.helicity_angles`.
+        """
+        return self.cached(helicity_angles_key(topology, convention), lambda: self.__steps(topology, convention)[1])
+
+    def boost(self, topology: Topology, target: Union[Node, int], convention: str = "helicity", inverse: bool = False) -> LorentzTrafo:
+        """
+        The boost from the rest frame of the root to the rest frame of target as produced by `Topology.boost`.
+        """
+        def compute():
+            steps, _ = self.__steps(topology, convention)
+            path, node_dict = topology.path_to(Node.get_node(target))
+            trafos = []
+            # the path starts with the root itself
+            for node in path[1:]:
+                _, (phi, theta), first, eta = steps[node_dict[node].value]
+                zero = 0 * eta
+                if convention == "minus_phi":
+                    rotation = LorentzTrafo(zero, zero, zero, phi, -theta, -phi)
+                else:
+                    rotation = LorentzTrafo(zero, zero, zero, zero, -theta, -phi)
+                if not first:
+                    rotation = LorentzTrafo(0, 0, 0, 0, -decayangle_config.backend.pi, 0) @ rotation
+                trafos.append(LorentzTrafo(zero, zero, -eta, zero, zero, zero) @ rotation)
+            if inverse:
+                trafo = trafos[0].inverse()
+                for step in trafos[1:]:
+                    trafo = trafo @ step.inverse()
+                return trafo
+            trafo = trafos[0]
+            for step in trafos[1:]:
+                trafo = step @ trafo
+            return trafo
+        return self.cached(("boost", topology_key(topology), Node.get_node(target).value, convention, inverse), compute)
+
+    def __sl2(self, topology: Topology, target: Node, convention: str):
+        # the SL(2, C) matrix of the boost to target, multiplied from the 2x2 matrices of the single steps
+        def compute():
+            cb = decayangle_config.backend
+            steps, _ = self.__steps(topology, convention)
+            path, node_dict = topology.path_to(target)
+            matrix = None
+            for node in path[1:]:
+                _, (phi, theta), first, eta = steps[node_dict[node].value]
+                step = sl2_boost_z(-eta, cb) @ helicity_rotation(phi, theta, first, convention, cb)
+                matrix = step if matrix is None else step @ matrix
+            return matrix
+        return self.cached(("sl2", topology_key(topology), target.value, convention), compute)
+
+    def relative_wigner_angles_batch(self, reference: Topology, topologies: list[Topology], convention: str = "helicity") -> list[dict[int, WignerAngles]]:
+        """
+        The relative Wigner angles of several topologies with respect to one reference, see `KinematicsStore.relative_wigner_angles`.
+        The rotations are products of the 2x2 matrices of the closed form steps and are decoded directly in SU(2), no `LorentzTrafo` is built.
+        """
+        cb = decayangle_config.backend
+        for topology in topologies:
+            if topology_key(topology) == topology_key(reference):
+                continue
+            def compute(topology=topology):
+                return {
+                    target.value: WignerAngles(*decode_rotation(
+                        self.__sl2(topology, target, convention) @ sl2_inverse(self.__sl2(reference, target, convention), cb), cb
+                    ))
+                    for target in reference.final_state_nodes
+                }
+            self.cached(relative_wigner_angles_key(reference, topology, convention), compute)
+        return super().relative_wigner_angles_batch(reference, topologies, convention)
+
+
+class DalitzVariables(dict):
+    """
+    An event sample of a three body decay given by invariant masses instead of four-momenta.
+    It can be passed to chains, combiners and likelihoods everywhere momenta are expected. The kinematics are then computed
+    in closed form by `DalitzKinematics`, so per event only two invariants and up to three orientation angles are needed.
+
+    The keys (i, j) of two (or all three) pairs of final state particles hold the squared invariant masses of the pairs,
+    the optional keys "alpha", "beta" and "gamma" the Euler angles of the orientation of the decay.
+    Without orientation, the first final state particle moves along the z axis and the second one has a positive x component.
+    The orientation rotates this configuration by R_z(alpha) R_y(beta) R_z(gamma).
+    """
+
+    kinematics_store = DalitzKinematics
+    orientation_keys = ("alpha", "beta", "gamma")
+
+    def __init__(self, values: dict, masses: dict, root: int = 0) -> None:
+        """
+        Parameters:
+        values: dict
+            The squared invariant masses keyed by pairs of final state particles and the orientation angles
+        masses: dict
+            The masses of the decaying particle (under root) and of the three final state particles
+        root: int
+            The index of the decaying particle
+        """
+        super().__init__(values)
+        self.masses = dict(masses)
+        self.root = root
+        self.final_state_keys = tuple(sorted(key for key in self.masses if key != root))
+        if len(self.final_state_keys) != 3 or root not in self.masses:
+            raise ValueError(f"DalitzVariables need the masses of the decaying particle {root} and of three final state particles. Got {list(self.masses)}")
+        pairs = [key for key in self if key not in self.orientation_keys]
+        if len(pairs) < 2 or any(not isinstance(key, tuple) or len(key) != 2 or not set(key) <= set(self.final_state_keys) for key in pairs):
+            raise ValueError(f"DalitzVariables need the squared invariant masses of two pairs of {self.final_state_keys}. Got {pairs}")
+
+    def like(self, values: dict) -> "DalitzVariables":
+        """
+        A sample with other values, but the same masses.
+        """
+        return type(self)(values, self.masses, self.root)
+
+    def sigma(self, i: int, j: int):
+        """
+        The squared invariant mass of the final state particles i and j. A missing pair follows from the sum of all pairs.
+        """
+        for key in ((i, j), (j, i)):
+            if key in self:
+                return self[key]
+        k, = set(self.final_state_keys) - {i, j}
+        total = sum(m**2 for m in self.masses.values())
+        return total - self.sigma(i, k) - self.sigma(j, k)
+
+    def vectors(self) -> dict:
+        """
+        The energies and three-momenta of the final state particles in the rest frame of the decaying particle as dict key -> (E, (px, py, pz)).
+        Events outside of the kinematically allowed region get nan momenta.
+        """
+        cb = decayangle_config.backend
+        a, b, c = self.final_state_keys
+        m0 = self.masses[self.root]
+        energies = {
+            i: (m0**2 + self.masses[i]**2 - self.sigma(j, k)) / (2 * m0)
+            for i, j, k in ((a, b, c), (b, c, a), (c, a, b))
+        }
+        # points outside of the Dalitz plot give nan instead of valid looking momenta
+        p = {i: cb.sqrt(energies[i]**2 - self.masses[i]**2) for i in energies}
+        cos_ab = (2 * energies[a] * energies[b] - self.sigma(a, b) + self.masses[a]**2 + self.masses[b]**2) / (2 * p[a] * p[b])
+        # only rounding errors on the boundary are clipped
+        cos_ab = cb.where(cb.abs(cos_ab) <= 1 + 1e-9, cb.clip(cos_ab, -1, 1), cb.nan)
+        zero = 0 * cos_ab
+        vectors = {
+            a: (zero, zero, p[a] + zero),
+            b: (p[b] * cb.sqrt(1 - cos_ab**2), zero, p[b] * cos_ab),
+        }
+        vectors[c] = tuple(-vectors[a][i] - vectors[b][i] for i in range(3))
+        alpha, beta, gamma = (self.get(key, 0) for key in self.orientation_keys)
+        return {
+            key: (energies[key], rotate_z(rotate_y(rotate_z(v, gamma, cb), beta, cb), alpha, cb))
+            for key, v in vectors.items()
+        }
+
+    def momenta(self, vectors: Optional[dict] = None) -> dict:
+        """
+        The four-momenta (px, py, pz, E) of the final state particles in the rest frame of the decaying particle, e.g. for decayangle.
+        """
+        cb = decayangle_config.backend
+        vectors = self.vectors() if vectors is None else vectors
+        return {key: cb.stack([*p, energy], axis=-1) for key, (energy, p) in vectors.items()}
@@ -0,0 +1,102 @@
+from typing import Optional
+from jax import jit, vmap
+
+from decayamplitude.backend import numpy as np, require_jax
+from decayamplitude.batching import split_batches, n_events
+
+
+class InterferenceIntegral:
+    """
+    The normalization integral of a model over a phase space sample as a Hermitian form in the couplings.
+    The amplitude is split into components A_k, which are each linear in one product of couplings C_k (see `ChainCombiner.components`).
+    Then the weighted mean of the unpolarized amplitude over the sample is
+        sum_kl conj(C_k) M_kl C_l   with   M_kl = sum_i w_i sum_helicities conj(A_k(x_i)) A_l(x_i) / sum_i w_i.
+    M only depends on the resonance parameters. It is recomputed only if one of them changes, evaluating the integral for new couplings costs O(K^2).
+    The cache needs concrete parameter values, so `matrix` and `__call__` are evaluated eagerly and can not be traced by jit or grad.
+    `Likelihood` uses M for models without resonance parameters, where it is computed once.
+    """
+
+    def __init__(self, combiner, ls_couplings: dict, mc: dict, mc_weights=None, batch_size: Optional[int]=None) -> None:
+        """
+        Parameters:
+        combiner: ChainCombiner
+            The amplitude model
+        ls_couplings: dict
+            The couplings of the model. Only the keys are used
+        mc: dict
+            The four-momenta of the phase space sample
+        mc_weights: array
+            Optional per event weights of the phase space sample
+        batch_size: int
+            If given, M is accumulated over batches of this size. Only the momenta of the batches are kept and the event data of one batch
+            is precomputed at a time, whenever M is recomputed, so the memory does not grow with the size of the sample.
+            Without batch_size the event data of the whole sample is precomputed once and kept.
+        """
+        require_jax("InterferenceIntegral")
+        self.combiner = combiner
+        self.components = combiner.components(ls_couplings)
+        self.parameter_names = sorted(combiner.resonance_params)
+        self.batch_size = batch_size
+        batches = split_batches(mc, batch_size or n_events(mc), mc_weights)
+        if batch_size is None:
+            self.batches = [(combiner.precompute(momenta), weights) for momenta, weights in batches]
+        else:
+            self.batches = list(batches)
+        self.sum_weights = sum(float(weights.sum()) for _, weights in self.batches)
+        self.__kernel = jit(self.__matrix)
+        # the same kernel for a batch of resonance parameters with a leading axis
+        self.__batched_kernel = jit(vmap(self.__matrix, in_axes=(None, None, 0)))
+        self.__cache_key = None
+        self.__cache = None
+
+    def __matrix(self, data, weights, parameters: dict):
+        tensors = self.combiner.component_tensors(self.components, parameters, data)
+        tensors = np.reshape(tensors, (len(self.components), -1, np.shape(weights)[0]))
+        return np.einsum("khe,lhe,e->kl", np.conj(tensors), tensors, weights)
+
+    def matrix(self, arguments: dict):
+        """
+        The interference matrix M for the resonance parameters in the arguments.
+        The last matrix is cached and only recomputed, if a resonance parameter changes. The parameters have to be concrete values, i.e. outside of jit and grad.
+        """
+        key = tuple(float(arguments[name]) for name in self.parameter_names)
+        if key != self.__cache_key:
+            parameters = {name: arguments[name] for name in self.parameter_names}
+            self.__cache = sum(
+                self.__kernel(self.__event_data(batch), weights, parameters)
+                for batch, weights in self.batches
+            ) / self.sum_weights
+            self.__cache_key = key
+        return self.__cache
+
+    def matrices(self, parameters: dict):
+        """
+        The interference matrices for many values of the resonance parameters, given as arrays with one leading batch axis.
+        All matrices are computed in a single pass over the sample by the kernel vectorized over the batch. They are not cached.
+
+        Returns:
+        array
+            Array of shape (P, K, K) for P parameter vectors
+        """
+        parameters = {name: np.asarray(parameters[name]) for name in self.parameter_names}
+        return sum(
+            self.__batched_kernel(self.__event_data(batch), weights, parameters)
+            for batch, weights in self.batches
+        ) / self.sum_weights
+
+    def __event_data(self, batch):
+        # with batch_size only the momenta are kept and the event data is precomputed for every pass
+        return self.combiner.precompute(batch) if self.batch_size is not None else batch
+
+    def couplings(self, arguments: dict):
+        """
+        The coupling products C_k for the couplings in the arguments.
+        """
+        return self.combiner.component_couplings(self.components, arguments)
+
+    def __call__(self, arguments: dict):
+        """
+        The weighted mean of the unpolarized amplitude over the sample. The couplings may carry leading batch axes.
+        """
+        c = self.couplings(arguments)
+        return np.real(np.einsum("...k,kl,...l->...", np.conj(c), self.matrix(arguments), c))
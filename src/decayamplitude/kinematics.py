@@ -0,0 +1,257 @@
+from collections import OrderedDict
+from typing import Callable, Hashable, Union
+
+from decayangle.decay_topology import Topology, Node
+from decayangle.lorentz import LorentzTrafo, WignerAngles
+from decayangle.kinematics import mass
+from decayangle.config import config as decayangle_config
+
+from decayamplitude.backend import numpy as np
+from decayamplitude.config import config
+from decayamplitude.kinematics_helpers import flatten
+
+
+def _node(node: Union[Node, tuple, int]) -> Node:
+    return node if isinstance(node, Node) else Node.get_node(node)
+
+
+def particles(node: Union[Node, tuple, int]) -> tuple:
+    """
+    The sorted final state particles of a node. Nodes with the same particles have the same invariant mass in every topology.
+    """
+    return tuple(sorted(flatten(_node(node).tuple)))
+
+
+def topology_key(topology: Topology) -> tuple:
+    """
+    Identifies a topology by its root and decay tree, so that equal topologies built independently share their kinematics.
+    """
+    return (topology.root.value, topology.tuple)
+
+
+def helicity_angles_key(topology: Topology, convention: str) -> tuple:
+    """
+    The key of the helicity angles of a topology in a `KinematicsStore`.
+    """
+    return ("helicity_angles", topology_key(topology), convention)
+
+
+def mass_key(node: Union[Node, tuple, int]) -> tuple:
+    """
+    The key of the invariant mass of a node in a `KinematicsStore`.
+    """
+    return ("mass", particles(node))
+
+
+def relative_wigner_angles_key(reference: Topology, topology: Topology, convention: str) -> tuple:
+    """
+    The key of the relative Wigner angles of a pair of topologies in a `KinematicsStore`.
+    """
+    return ("relative_wigner_angles", topology_key(reference), topology_key(topology), convention)
+
+
+class KinematicsStore:
+    """
+    The kinematic quantities of one event sample: helicity angles per topology, invariant masses and breakup momenta per node,
+    boosts to the final state particles and relative Wigner angles per pair of topologies.
+    The momenta are boosted into every rest frame only once, even if several topologies pass through it (see `frame`).
+    Every quantity is computed at most once and shared by all chains, which are built on the same sample.
+    Use `KinematicsStore.of(momenta)` to get the store of a sample. Chains with the same momenta dict get the same store.
+    A store computes with the arrays of the backend, which was selected when it was created, so a new one is created after the backend was changed.
+    """
+
+    # the stores of the most recently used samples, keyed by the id of the momenta dict
+    # the store keeps its momenta alive, so the id can not be reused while the store is registered
+    max_stores = 8
+    __stores: "OrderedDict[int, KinematicsStore]" = OrderedDict()
+
+    @classmethod
+    def of(cls, momenta: dict) -> "KinematicsStore":
+        """
+        The shared store of an event sample. A new store is created, if the sample was not seen recently.
+        """
+        key = id(momenta)
+        store = cls.__stores.get(key)
+        if store is None or not store.describes(momenta):
+            # samples, which are not given as four-momenta, bring their own store type (see `DalitzVariables`)
+            store = getattr(momenta, "kinematics_store", cls)(momenta)
+            cls.__stores[key] = store
+            while len(cls.__stores) > cls.max_stores:
+                cls.__stores.popitem(last=False)
+        cls.__stores.move_to_end(key)
+        return store
+
+    def __init__(self, momenta: dict) -> None:
+        """
+        Parameters:
+        momenta: dict
+            The four-momenta of the final state particles in the rest frame of the decaying particle, keyed by particle index
+        """
+        self.momenta = momenta
+        # the arrays the quantities are computed from, to detect momenta dicts, which were changed in place
+        self.__arrays = tuple(momenta.items())
+        self.backend = config.backend
+        # the momenta as arrays of the backend, so that decayangle computes with them and returns them
+        self.backend_momenta = {key: np.asarray(value) for key, value in momenta.items()}
+        self.__cache = {}
+
+    def describes(self, momenta: dict) -> bool:
+        """
+        Whether the store holds the kinematics of this momenta dict with its current arrays for the current backend.
+        """
+        return momenta is self.momenta and self.backend is config.backend and len(momenta) == len(self.__arrays) and all(
+            key in momenta and momenta[key] is array for key, array in self.__arrays
+        )
+
+    def cached(self, key: Hashable, compute: Callable):
+        """
+        Returns the value stored under key. If there is none, it is computed once with compute() and stored.
+        """
+        if key not in self.__cache:
+            self.__cache[key] = compute()
+        return self.__cache[key]
+
+    def frame(self, topology: Topology, node: Union[Node, tuple, int], convention: str = "helicity", exact: bool = False) -> tuple[list[LorentzTrafo], dict]:
+        """
+        The rest frame of a node, which is reached by boosting along the decay tree of the topology as in `Topology.boost`.
+        Returns the boosts of the single steps from the root and the momenta in the frame.
+        A frame only depends on the steps, which lead to it, so topologies with common steps share their frames and each boost is computed once.
+        Steps are common, if they start from and lead to nodes with the same particles. The momenta of these nodes may be summed in another order
+        than in the topology, which changes the last bits of the boosts. With exact=True steps are only shared, if the decay trees
+        of the daughter defining the helicity frame and of the target agree as well, so the boosts are the ones of `Topology.boost` to the last bit.
+        """
+        path, node_dict = topology.path_to(_node(node))
+        key, steps, momenta = (), [], self.backend_momenta
+        # the path starts with the root itself
+        for parent, target in zip(path[:-1], path[1:]):
+            parent, target = node_dict[parent], node_dict[target]
+            # a step is fixed by the particles of the node, of the daughter defining the helicity frame and of the target
+            if exact:
+                key = key + ((particles(parent), parent.daughters[0].tuple, target.tuple),)
+            else:
+                key = key + ((particles(parent), particles(parent.daughters[0]), particles(target)),)
+            def step(parent=parent, target=target, steps=steps, momenta=momenta):
+                boost = parent.boost(target, momenta, convention=convention)
+                return steps + [boost], parent.transform(boost, momenta)
+            steps, momenta = self.cached(("frame", convention, exact, key), step)
+        return steps, momenta
+
+    def provide(self, values: dict) -> None:
+        """
+        Adds quantities, which were computed outside of the store (e.g. by `CompiledKinematics`), under the keys of
+        `helicity_angles_key`, `mass_key` and `relative_wigner_angles_key`. Values, which are already present, are kept.
+        """
+        for key, value in values.items():
+            self.__cache.setdefault(key, value)
+
+    def helicity_angles(self, topology: Topology, convention: str = "helicity") -> dict:
+        """
+        The helicity angles of all internal nodes of a topology as produced by `Topology.helicity_angles`.
+        They are evaluated in the shared frames of `frame`.
+        """
+        def compute():
+            return {
+                (node.daughters[0].value, node.daughters[1].value): node.helicity_angles(self.frame(topology, node, convention)[1])
+                for node in topology.root.preorder()
+                if not node.final_state
+            }
+        return self.cached(helicity_angles_key(topology, convention), compute)
+
+    def mass(self, node: Union[Node, tuple, int]):
+        """
+        The invariant mass of a node. It only depends on the final state particles of the node.
+        """
+        return self.cached(mass_key(node), lambda: mass(sum(self.backend_momenta[i] for i in particles(node))))
+
+    def breakup_momentum(self, node: Union[Node, tuple, int]):
+        """
+        The momentum of the daughters of a node in its rest frame, computed from the invariant masses of the node and its daughters.
+        """
+        node = _node(node)
+        # nodes built from a tuple have no daughter nodes, but their value lists the daughters
+        d1, d2 = node.daughters or node.value
+        def compute():
+            m0, m1, m2 = self.mass(node), self.mass(d1), self.mass(d2)
+            kallen = (m0**2 - (m1 + m2)**2) * (m0**2 - (m1 - m2)**2)
+            return np.sqrt(np.where(kallen > 0, kallen, 0.)) / (2 * m0)
+        return self.cached(("breakup_momentum", particles(node), particles(d1), particles(d2)), compute)
+
+    def boost(self, topology: Topology, target: Union[Node, int], convention: str = "helicity", inverse: bool = False) -> LorentzTrafo:
+        """
+        The boost from the rest frame of the root to the rest frame of target along the decay tree of the topology. See `Topology.boost`.
+        """
+        def compute():
+            # the Wigner angles are differences of nearly equal rotations for strongly boosted events, so the boosts follow decayangle exactly
+            steps, _ = self.frame(topology, target, convention, exact=True)
+            if inverse:
+                # inverting the single steps is more precise than inverting the product
+                trafo = steps[0].inverse()
+                for step in steps[1:]:
+                    trafo = trafo @ step.inverse()
+                return trafo
+            trafo = steps[0]
+            for step in steps[1:]:
+                trafo = step @ trafo
+            return trafo
+        return self.cached(("boost", topology_key(topology), _node(target).value, convention, inverse), compute)
+
+    def relative_wigner_angles(self, reference: Topology, topology: Topology, convention: str = "helicity") -> dict[int, WignerAngles]:
+        """
+        The Wigner angles, which rotate the final state helicity frames of the reference topology into the ones of topology,
+        keyed by final state particle. See `Topology.relative_wigner_angles`.
+        """
+        return self.relative_wigner_angles_batch(reference, [topology], convention)[0]
+
+    def relative_wigner_angles_batch(self, reference: Topology, topologies: list[Topology], convention: str = "helicity") -> list[dict[int, WignerAngles]]:
+        """
+        The relative Wigner angles of several topologies with respect to one reference, see `relative_wigner_angles`.
+        The boosts of the reference are computed once and shared by all pairs. For each final state particle
+        the rotations of all topologies, which were not requested before, are decoded together in one pass over the stacked events.
+        """
+        def key(topology):
+            return relative_wigner_angles_key(reference, topology, convention)
+
+        missing = {}
+        for topology in topologies:
+            if key(topology) not in self.__cache and topology_key(topology) != topology_key(reference):
+                missing.setdefault(topology_key(topology), topology)
+        missing = list(missing.values())
+        if missing:
+            angles = [{} for _ in missing]
+            for target in reference.final_state_nodes:
+                inverse = self.boost(reference, target, convention, inverse=True)
+                rotations = [self.boost(topology, target, convention) @ inverse for topology in missing]
+                for angle, decoded in zip(angles, _wigner_angles(rotations)):
+                    angle[target.value] = decoded
+            for topology, angle in zip(missing, angles):
+                self.__cache[key(topology)] = angle
+
+        identity = None
+        result = []
+        for topology in topologies:
+            if topology_key(topology) == topology_key(reference):
+                # the reference is not rotated with respect to itself
+                if identity is None:
+                    angles = LorentzTrafo(0, 0, 0, 0, 0, 0).wigner_angles()
+                    identity = {target.value: angles for target in reference.final_state_nodes}
+                result.append(identity)
+            else:
+                result.append(self.__cache[key(topology)])
+        return result
+
+
+def _wigner_angles(rotations: list[LorentzTrafo]) -> list[WignerAngles]:
+    # all rotations belong to the same events, so they are stacked along the event axis and decoded at once
+    cb = decayangle_config.backend
+    if len(rotations) == 1:
+        return [rotations[0].wigner_angles()]
+    shape = cb.shape(rotations[0].matrix_4x4)[:-2]
+    stacked = LorentzTrafo(
+        matrix_2x2=cb.concatenate([cb.reshape(r.matrix_2x2, (-1, 2, 2)) for r in rotations]),
+        matrix_4x4=cb.concatenate([cb.reshape(r.matrix_4x4, (-1, 4, 4)) for r in rotations]),
+    )
+    decoded = [cb.split(angle, len(rotations)) for angle in stacked.wigner_angles()]
+    return [
+        WignerAngles(*(cb.reshape(angle[i], shape) for angle in decoded))
+        for i in range(len(rotations))
+    ]
@@ -26,3 +26,100 @@ def mass_from_node(node: Node, momenta):
             momenta[i] for i in flatten(node.tuple)
         )
     )
+
+
+# The helpers below act on vectors given as tuples of arrays (x, y, z, ...), further components (e.g. the energy) are passed through.
+# Rotations and boosts are also given as SL(2, C) matrices with shape (..., 2, 2) in the conventions of decayangle.
+# xp is the array module, e.g. the backend of decayangle or jax.numpy inside of jit.
+
+def rotate_z(v: tuple, angle, xp) -> tuple:
+    """
+    Rotates a vector by angle around the z axis.
+    """
+    x, y, *rest = v
+    return (xp.cos(angle) * x - xp.sin(angle) * y, xp.sin(angle) * x + xp.cos(angle) * y, *rest)
+
+
+def rotate_y(v: tuple, angle, xp) -> tuple:
+    """
+    Rotates a vector by angle around the y axis.
+    """
+    x, y, z, *rest = v
+    return (xp.cos(angle) * x + xp.sin(angle) * z, y, xp.cos(angle) * z - xp.sin(angle) * x, *rest)
+
+
+def helicity_angles_of(v: tuple, xp) -> tuple:
+    """
+    The azimuthal and polar angle of a vector, the same angles as decayangle.kinematics.rotate_to_z_axis.
+    """
+    x, y, z, *_ = v
+    return xp.arctan2(y, x), xp.arccos(z / xp.sqrt(x**2 + y**2 + z**2))
+
+
+def rapidity(p, energy, xp):
+    """
+    The rapidity of a particle with momentum p along the boost axis and the given energy.
+    """
+    beta = p / energy
+    return 0.5 * xp.log((1 + beta) / (1 - beta))
+
+
+def _matrix(a, b, c, d, xp):
+    return xp.stack([xp.stack([a, b], axis=-1), xp.stack([c, d], axis=-1)], axis=-2)
+
+
+def su2_z(angle, xp):
+    """
+    The SU(2) matrix of a rotation by angle around the z axis.
+    """
+    zero = xp.zeros_like(angle)
+    return _matrix(xp.exp(-0.5j * angle), zero, zero, xp.exp(0.5j * angle), xp)
+
+
+def su2_y(angle, xp):
+    """
+    The SU(2) matrix of a rotation by angle around the y axis.
+    """
+    c, s = xp.cos(angle / 2) + 0j, xp.sin(angle / 2) + 0j
+    return _matrix(c, -s, s, c, xp)
+
+
+def sl2_boost_z(xi, xp):
+    """
+    The SL(2, C) matrix of a boost with rapidity xi along the z axis.
+    """
+    zero = xp.zeros_like(xi)
+    return _matrix(xp.exp(xi / 2) + 0j, zero, zero, xp.exp(-xi / 2) + 0j, xp)
+
+
+def sl2_inverse(m, xp):
+    """
+    The inverse of SL(2, C) matrices, which have determinant 1.
+    """
+    return _matrix(m[..., 1, 1], -m[..., 0, 1], -m[..., 1, 0], m[..., 0, 0], xp)
+
+
+def helicity_rotation(phi, theta, first: bool, convention: str, xp):
+    """
+    The SU(2) matrix, which rotates the daughter with the angles (phi, theta) onto the z axis as in `Node.boost` of decayangle.
+    For the second daughter (first=False) the frame is rotated by -pi around the y axis in addition (particle 2 convention).
+    """
+    if convention == "minus_phi":
+        rotation = su2_z(phi, xp) @ su2_y(-theta, xp) @ su2_z(-phi, xp)
+    elif convention == "helicity":
+        rotation = su2_y(-theta, xp) @ su2_z(-phi, xp)
+    else:
+        raise ValueError(f"Convention {convention} not supported. Use 'helicity' or 'minus_phi'.")
+    if not first:
+        rotation = su2_y(-xp.pi + 0 * theta, xp) @ rotation
+    return rotation
+
+
+def decode_rotation(m, xp):
+    """
+    The angles (phi, theta, psi) of an SU(2) matrix m = R_z(phi) R_y(theta) R_z(psi) with 0 <= theta <= pi.
+    phi and psi cover 4 pi together, so the sign of m is kept and Wigner D-matrices of half integer spins are reproduced exactly.
+    """
+    theta = 2 * xp.arctan2(xp.abs(m[..., 1, 0]), xp.abs(m[..., 1, 1]))
+    plus, minus = xp.angle(m[..., 1, 1]), xp.angle(m[..., 1, 0])
+    return plus + minus, theta, plus - minus
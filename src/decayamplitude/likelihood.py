@@ -0,0 +1,169 @@
+from typing import Optional
+from jax import value_and_grad
+
+from decayamplitude.combiner import ChainCombiner
+from decayamplitude.backend import numpy as np, require_jax
+from decayamplitude.batching import n_events, pad_batch
+from decayamplitude.sharding import event_mesh, padded_size, shard_events
+from decayamplitude.compile_cache import cached_jit, structural_hash, abstract_arguments
+
+
+class Likelihood:
+    """
+    Unbinned negative log likelihood of a data sample, normalized with a phase space (MC) sample.
+    The event data of both samples is precomputed once. Data and normalization terms are evaluated in a single compiled function,
+    so a minimizer step only needs one call of `value_and_grad`.
+
+    With extended=True the extended negative log likelihood
+        - sum_i w_i log I(x_i) + nu,    nu = V * mean_MC(I)
+    is used, where the mean over the MC sample is weighted by the MC weights and V is the phase space volume, which the MC sample covers.
+    nu is the integral of the intensity, i.e. the expected number of events (see `expected_events`). The overall scale of the couplings
+    then fixes the yield: at the minimum nu equals the sum of the data weights. With the default V = 1 the MC mean itself is the yield.
+    Otherwise the normalized negative log likelihood
+        - sum_i w_i log I(x_i) + W * log mean_MC(I)
+    is used, which does not depend on the overall scale.
+
+    If the model has no resonance parameters, only couplings are fitted and mean_MC(I) is the Hermitian form c^dagger M c of `InterferenceIntegral`.
+    M is then computed once at construction and the MC sample is not kept, so a minimizer step costs O(K^2) for the normalization instead of a pass over the sample.
+    Lineshapes with fixed parameters can close over their values to use this. With resonance parameters every step evaluates the MC sample.
+
+    With sharded=True both samples are split along the event axis across several devices. Every device evaluates the amplitude for its part of the events
+    and the sums are reduced across the devices. The samples are padded with events of weight 0 to a multiple of the number of devices.
+    The interface does not change.
+
+    With compile_cache=True the compiled functions are shared between all likelihoods of the same model (see `ChainCombiner.structure`), couplings and sample sizes.
+    If `config.cache_dir` is set, they are also stored on disk, so that batch jobs with an unchanged model skip tracing and compilation.
+    The key contains the code of all functions the lineshapes reach outside of jax, numpy, sympy and decayangle (whose versions are part of the key)
+    and the source of decayamplitude itself. Lineshapes have to be pure functions of their arguments, of the values they close over
+    and of the globals they use for this to be safe. Models, which can not be fingerprinted, and sharded likelihoods are compiled as usual.
+    """
+
+    def __init__(self, combiner: ChainCombiner, data: dict, mc: dict, data_weights=None, mc_weights=None, ls_couplings: Optional[dict]=None, complex_couplings: bool=True, extended: bool=True, sharded: bool=False, devices: Optional[list]=None, compile_cache: bool=False, compiled_kinematics: bool=False, phase_space_volume: float=1., interference: bool=True) -> None:
+        """
+        Parameters:
+        combiner: ChainCombiner
+            The amplitude model
+        data: dict
+            The four-momenta of the final state particles in the data sample, in the rest frame of the decaying particle
+        mc: dict
+            The four-momenta of the phase space sample used for the normalization
+        data_weights: array
+            Optional per event weights of the data sample (e.g. sWeights)
+        mc_weights: array
+            Optional per event weights of the phase space sample (e.g. efficiency corrections)
+        ls_couplings: dict
+            The couplings to fit. Defaults to all couplings of the model
+        complex_couplings: bool
+            Whether the couplings are split into real and imaginary parts
+        extended: bool
+            Whether to use the extended likelihood
+        sharded: bool
+            Whether to split the samples across devices
+        devices: list
+            The devices to use with sharded=True. Defaults to all devices
+        compile_cache: bool
+            Whether to reuse compiled functions of identical models in this process and across processes. Off by default
+        compiled_kinematics: bool
+            Whether to compute the kinematics of both samples with one jitted program (see `ChainCombiner.precompute_kinematics`)
+        phase_space_volume: float
+            The phase space volume covered by the MC sample, which turns the MC mean of the intensity into the expected number of events with extended=True
+        interference: bool
+            Whether to normalize with the interference matrix, if the model has no resonance parameters
+        """
+        require_jax("Likelihood")
+        if ls_couplings is None:
+            ls_couplings = combiner.generate_couplings()
+        self.combiner = combiner
+        self.extended = extended
+        self.phase_space_volume = phase_space_volume
+        self.unpolarized, self.layout = combiner.unpolarized_amplitude(ls_couplings, complex_couplings=complex_couplings, event_data=True, flat=True)
+        self.argnames = self.layout.names
+        # the interference matrix of a model without resonance parameters does not change during a fit
+        self.components, self.interference = None, None
+        if interference and not combiner.resonance_params:
+            integral = combiner.interference_integral(ls_couplings, mc, mc_weights=mc_weights)
+            self.components, self.interference = integral.components, integral.matrix({})
+            mc, mc_weights = None, None
+        if sharded:
+            mesh = event_mesh(devices)
+            data, data_weights = pad_batch(data, data_weights, padded_size(n_events(data), mesh))
+            if mc is not None:
+                mc, mc_weights = pad_batch(mc, mc_weights, padded_size(n_events(mc), mesh))
+        self.data = combiner.precompute(data, compiled_kinematics=compiled_kinematics)
+        self.data_weights = np.ones(n_events(data)) if data_weights is None else np.asarray(data_weights)
+        self.mc, self.mc_weights = None, None
+        if mc is not None:
+            self.mc = combiner.precompute(mc, compiled_kinematics=compiled_kinematics)
+            self.mc_weights = np.ones(n_events(mc)) if mc_weights is None else np.asarray(mc_weights)
+        if sharded:
+            self.data, self.mc, self.data_weights, self.mc_weights = shard_events((self.data, self.mc, self.data_weights, self.mc_weights), mesh)
+
+        example = (np.zeros(len(self.argnames)), self.data, self.mc, self.data_weights, self.mc_weights, self.interference)
+        structure = None
+        if compile_cache and not sharded:
+            structure = (type(self).__name__, combiner.structure, self.argnames, complex_couplings, extended, phase_space_volume, abstract_arguments(example))
+        self.__value = cached_jit(
+            self.negative_log_likelihood,
+            None if structure is None else structural_hash("value", *structure),
+            *example
+        )
+        self.__value_and_grad = cached_jit(
+            value_and_grad(self.negative_log_likelihood),
+            None if structure is None else structural_hash("value_and_grad", *structure),
+            *example
+        )
+
+    def negative_log_likelihood(self, parameters, data=None, mc=None, data_weights=None, mc_weights=None, interference=None):
+        """
+        The negative log likelihood for a flat parameter vector in the order of `argnames`.
+        Other event samples than the ones given at construction can be passed as the output of `ChainCombiner.precompute`.
+        If an MC sample is passed, the normalization is evaluated on it, otherwise the interference matrix of the construction is used, if there is one.
+        """
+        data = self.data if data is None else data
+        data_weights = self.data_weights if data_weights is None else data_weights
+        if mc is None and interference is None:
+            interference = self.interference
+
+        intensity = self.unpolarized(data, parameters)
+        # events with weight 0 (e.g. padding) must not produce nan in the log or its gradient
+        data_term = np.sum(data_weights * np.log(np.where(data_weights == 0, 1., intensity)))
+        normalization = self.__normalization(parameters, mc, mc_weights, interference)
+        if self.extended:
+            return -data_term + self.phase_space_volume * normalization
+        return -data_term + np.sum(data_weights) * np.log(normalization)
+
+    def __normalization(self, parameters, mc=None, mc_weights=None, interference=None):
+        # the weighted mean of the intensity over the MC sample, as c^dagger M c, if the interference matrix is given
+        if interference is not None:
+            c = self.combiner.component_couplings(self.components, self.layout.arguments(parameters))
+            return np.real(np.conj(c) @ interference @ c)
+        mc = self.mc if mc is None else mc
+        mc_weights = self.mc_weights if mc_weights is None else mc_weights
+        return np.sum(mc_weights * self.unpolarized(mc, parameters)) / np.sum(mc_weights)
+
+    def expected_events(self, parameters):
+        """
+        The expected number of events nu = V * mean_MC(I) of the extended likelihood for a flat parameter vector in the order of `argnames`.
+        """
+        return self.phase_space_volume * self.__normalization(np.asarray(parameters, dtype=np.float64), interference=self.interference)
+
+    def value(self, parameters):
+        """
+        The negative log likelihood for a flat parameter vector in the order of `argnames`.
+        """
+        return self.__value(np.asarray(parameters, dtype=np.float64), self.data, self.mc, self.data_weights, self.mc_weights, self.interference)
+
+    def grad(self, parameters):
+        """
+        The gradient of the negative log likelihood with respect to the flat parameter vector.
+        """
+        return self.value_and_grad(parameters)[1]
+
+    def value_and_grad(self, parameters):
+        """
+        The negative log likelihood and its gradient from a single pass over both samples.
+        """
+        return self.__value_and_grad(np.asarray(parameters, dtype=np.float64), self.data, self.mc, self.data_weights, self.mc_weights, self.interference)
+
+    def __call__(self, parameters):
+        return self.value(parameters)
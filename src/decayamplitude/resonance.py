@@ -2,19 +2,53 @@ from __future__ import annotations
 
 from decayangle.decay_topology import Node, HelicityAngles, Topology
 from decayamplitude.rotation import QN, Angular, clebsch_gordan, wigner_capital_d, convert_angular
-from typing import Sequence, Union, Callable, Literal, Generator
+from decayamplitude.cg_table import save_table
+from typing import Sequence, Union, Callable, Literal, Generator, Optional
 from collections import namedtuple
-from functools import cached_property
-from decayamplitude.utils import sanitize
+from functools import cached_property, lru_cache as cache
+from decayamplitude.utils import sanitize, expand_to_events
 
 import warnings
 import inspect
 from decayamplitude.backend import numpy as np
+import numpy as onp
 
 
 LSTuple = namedtuple("LSTuple", ["l", "s"])
 HelicityTuple = namedtuple("HelicityTuple", ["h1", "h2"])
 
+@cache
+def ls_table(j0:int, j1:int, j2:int, l:int, s:int) -> onp.ndarray:
+    """
+    Static part of the transformation from the LS basis into the helicity basis.
+    All arguments are given in units of 1/2.
+
+    returns:
+    onp.ndarray
+        Array of shape (j1 + 1, j2 + 1) indexed by the helicities h1 and h2 of the daughters, ordered as in Angular.projections
+    """
+    table = onp.zeros((j1 + 1, j2 + 1))
+    for i1, h1 in enumerate(Angular(j1).projections(return_int=True)):
+        for i2, h2 in enumerate(Angular(j2).projections(return_int=True)):
+            table[i1, i2] = (
+                (l + 1) ** 0.5 /
+                (j0 + 1) ** 0.5 *
+                clebsch_gordan(j1, h1, j2, -h2, s, h1 - h2) *
+                clebsch_gordan(l, 0, s, h1 - h2, j0, h1 - h2)
+            )
+    # the Clebsch-Gordan blocks, which were computed for this table, are written to the cache file at once
+    save_table()
+    return table
+
+@cache
+def helicity_table(j1:int, j2:int, h1:int, h2:int) -> onp.ndarray:
+    """
+    Static one-hot table, which places a direct helicity coupling (h1, h2) into a dense array of shape (j1 + 1, j2 + 1).
+    """
+    table = onp.zeros((j1 + 1, j2 + 1))
+    table[(h1 + j1) // 2, (h2 + j2) // 2] = 1.
+    return table
+
 class Resonance:
     __instances = {}
     __named_instances = {}
@@ -36,6 +70,8 @@ class Resonance:
         self.__daughters = None
         self.__lineshape = None
         self.__lineshape_supports_masses = False
+        self.__lineshape_returns_all = False
+        self.__lineshape_supports_mass = False
         if name is not None:
             self.__name = name
         else: 
@@ -175,10 +211,11 @@ class Resonance:
         """
         q1, q2 = self.daughter_qn
         j1, j2 = q1.angular.value2, q2.angular.value2
+        lineshapes = self.lineshape_values(list(couplings), arguments, d1_mass, d2_mass)
 
         return sum(
             coupling *
-            self.lineshape(l, s, *self.argument_list(arguments), **self._mass_kwargs(d1_mass, d2_mass)) *
+            lineshapes[(l, s)] *
             (l + 1) ** 0.5 /
             (self.quantum_numbers.angular.value2 + 1) ** 0.5 *
             clebsch_gordan(j1, h1, j2, -h2, s, h1- h2) *
@@ -231,10 +268,17 @@ class Resonance:
             }
     
     def direct_helicity_coupling(self, arguments, h1, h2, d1_mass, d2_mass):
-        return arguments[self.id]["couplings"][(h1, h2)] * self.lineshape(h1, h2, *self.argument_list(arguments), **self._mass_kwargs(d1_mass, d2_mass))
+        """
+        The coupling of a single helicity combination in the helicity scheme. See `amplitude`.
+        """
+        return arguments[self.id]["couplings"][(h1, h2)] * self.lineshape_values([(h1, h2)], arguments, d1_mass, d2_mass)[(h1, h2)]
     
     @convert_angular
     def amplitude(self, h0:Union[Angular, int], h1:Union[Angular, int], h2:Union[Angular, int], arguments:dict, d1_mass, d2_mass):
+        """
+        The coupling of the resonance to a single helicity combination of its daughters including the Jacob-Wick phase.
+        This is the reference used by `DecayChainNode.amplitude`. Chains are evaluated with the dense `helicity_couplings`, tests compare both.
+        """
         d1_mass = np.nan_to_num(d1_mass, nan=0.0, posinf=0.0, neginf=0.0)
         d2_mass = np.nan_to_num(d2_mass, nan=0.0, posinf=0.0, neginf=0.0)
         if self.scheme == "ls":
@@ -248,10 +292,101 @@ class Resonance:
         j2 = self.daughter_qn[1].angular.value2
         return coupling * (-1) ** ((j2 - h2) / 2)
     
-    def _mass_kwargs(self, d1_mass, d2_mass) -> dict:
+    def lineshape_values(self, keys:list[tuple], arguments:dict, d1_mass, d2_mass, cache:Optional[dict]=None, decay:Optional[tuple]=None, mass=None) -> dict[tuple, float]:
+        """
+        Evaluates the lineshape for all given coupling keys ((l, s) or (h1, h2) depending on the scheme).
+        If the first parameter of the lineshape function is called `ls`, the lineshape is called only once with the list of all keys
+        and has to return the values for all keys stacked along the first axis.
+
+        arguments:
+        keys: list[tuple]
+            The coupling keys for which the lineshape is needed
+        arguments: dict
+            The arguments for the lineshape function
+        d1_mass: float
+            Invariant mass of the first daughter
+        d2_mass: float
+            Invariant mass of the second daughter
+        cache: dict
+            Optional cache shared by all resonances in one evaluation. Resonances with the same name share their lineshape parameters,
+            so a value is only computed once for each (name, decay, parameters, key), no matter how many chains contain the resonance.
+        decay: tuple
+            The values of the daughter nodes. These fix the daughter masses in the cache key. If not given, the mass arrays themselves are used.
+        mass: float
+            Invariant mass of the resonance. Only passed to lineshapes with a parameter called `mass`.
+
+        returns:
+        dict
+            The lineshape values keyed by the coupling keys
+        """
+        if cache is None:
+            cache = {}
+        if decay is None:
+            decay = (id(d1_mass), id(d2_mass))
+        base = (self.name, decay, self.lineshape, tuple(self.parameter_names))
+        missing = [tuple(key) for key in keys if base + (tuple(key),) not in cache]
+        if missing:
+            argument_list = self.argument_list(arguments)
+            mass_kwargs = self._mass_kwargs(d1_mass, d2_mass, mass)
+            if self.__lineshape_returns_all:
+                key_type = LSTuple if self.scheme == "ls" else HelicityTuple
+                values = self.lineshape([key_type(*key) for key in missing], *argument_list, **mass_kwargs)
+                for i, key in enumerate(missing):
+                    cache[base + (key,)] = values[i]
+            else:
+                for key in missing:
+                    cache[base + (key,)] = self.lineshape(*key, *argument_list, **mass_kwargs)
+        return {key: cache[base + (tuple(key),)] for key in keys}
+
+    def helicity_couplings(self, arguments:dict, j1:int, j2:int, d1_mass, d2_mass, cache:Optional[dict]=None, decay:Optional[tuple]=None, mass=None):
+        """
+        Dense version of the coupling part of `amplitude` for all daughter helicities at once.
+        Only the parameter dependent parts (couplings and lineshapes) are evaluated here. The Clebsch-Gordan factors come from static tables
+        and the Jacob-Wick phase is left to the caller, since it does not depend on any parameter.
+
+        arguments:
+        arguments: dict
+            The couplings and the arguments for the lineshape function.
+        j1: int
+            Spin of the first daughter (in units of 1/2)
+        j2: int
+            Spin of the second daughter (in units of 1/2)
+        d1_mass: float
+            Invariant mass of the first daughter
+        d2_mass: float
+            Invariant mass of the second daughter
+        cache: dict
+            Optional cache for the lineshape values. See `lineshape_values`.
+        decay: tuple
+            The values of the daughter nodes. See `lineshape_values`.
+        mass: float
+            Invariant mass of the resonance. See `lineshape_values`.
+
+        returns:
+        array
+            Array of shape (j1 + 1, j2 + 1, *event_shape) indexed by the helicities h1 and h2 of the daughters
+        """
+        j0 = self.quantum_numbers.angular.value2
+        if self.scheme == "ls":
+            tables = {key: ls_table(j0, j1, j2, *key) for key in self.__construct_couplings(arguments)}
+        elif self.scheme == "helicity":
+            tables = {key: helicity_table(j1, j2, *key) for key in arguments[self.id]["couplings"]}
+        else:
+            raise ValueError(f"Scheme must be either 'ls' or 'helicity' but is {self.scheme}")
+        couplings = arguments[self.id]["couplings"]
+        lineshapes = self.lineshape_values(list(tables), arguments, d1_mass, d2_mass, cache=cache, decay=decay, mass=mass)
+        return sum(
+            expand_to_events(table, couplings[key] * lineshapes[key])
+            for key, table in tables.items()
+        )
+
+    def _mass_kwargs(self, d1_mass, d2_mass, mass=None) -> dict:
+        kwargs = {}
         if self.__lineshape_supports_masses:
-            return {"d1_mass": d1_mass, "d2_mass": d2_mass}
-        return {}
+            kwargs.update({"d1_mass": d1_mass, "d2_mass": d2_mass})
+        if self.__lineshape_supports_mass and mass is not None:
+            kwargs["mass"] = mass
+        return kwargs
 
     def register_lineshape(self, lineshape_function:Callable, parameter_names: list[str]):
         if self.__lineshape is not None:
@@ -261,6 +396,11 @@ class Resonance:
             ("d1_mass" in sig.parameters and "d2_mass" in sig.parameters) or
             any(p.kind == inspect.Parameter.VAR_KEYWORD for p in sig.parameters.values())
         )
+        # the own invariant mass is only passed to lineshapes, which ask for it explicitly
+        # this allows lineshapes to get all event dependent inputs from the event data instead of closing over the momenta
+        self.__lineshape_supports_mass = "mass" in sig.parameters
+        # lineshapes with a first parameter called ls get all coupling keys at once
+        self.__lineshape_returns_all = next(iter(sig.parameters), None) == "ls"
         self.__lineshape = lineshape_function
         self.__parameter_names = {}
         for parameter_name in parameter_names:
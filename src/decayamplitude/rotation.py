@@ -1,11 +1,11 @@
 from typing import Union, Generator
-from sympy import Rational, Symbol, lambdify
-from sympy.physics.quantum.cg import CG
-from sympy.physics.quantum.spin import Rotation
 from decayamplitude.backend import numpy as np
+from decayamplitude.cg_table import get_table
 from functools import lru_cache as cache
-from sympy.abc import x as placeholder
 from itertools import product
+from math import factorial, sqrt
+from fractions import Fraction
+import numpy as onp
 
 def convert_angular(f):
     """
@@ -159,40 +159,69 @@ class QN:
 def clebsch_gordan(j1, m1, j2, m2, J, M):
     """
     Return clebsch-Gordan coefficient. Note that all arguments should be multiplied by 2
-    (e.g. 1 for spin 1/2, 2 for spin 1 etc.). Needs sympy.
+    (e.g. 1 for spin 1/2, 2 for spin 1 etc.). 
+    The coefficients are taken from the numeric tables in `decayamplitude.cg_table`, which are persisted on disk.
     """
-
-    cg = (
-        CG(
-            Rational(j1, 2),
-            Rational(m1, 2),
-            Rational(j2, 2),
-            Rational(m2, 2),
-            Rational(J, 2),
-            Rational(M, 2),
-        )
-        .doit()
-        .evalf()
-    )
-    cg = float(cg)
-    if str(cg) == "nan":
-        raise ValueError(f"CG({j1/2},{m1/2},{j2/2},{m2/2},{J/2},{M/2}) is not a number")
-    return cg
+    return get_table()(int(j1), int(m1), int(j2), int(m2), int(J), int(M))
 
 
 @cache
 def get_wigner_function(j: int, m1: int, m2: int):
     """
-    Return Wigner small-d function. Note that all arguments should be multiplied by 2
+    Return Wigner small-d function as a lambdified sympy expression. Note that all arguments should be multiplied by 2
     (e.g. 1 for spin 1/2, 2 for spin 1 etc.). Needs sympy.
+    This is only kept as a symbolic reference, the amplitudes use the numeric `wigner_small_d_matrix`.
+    sympy is imported on the first call only, so that the evaluation path of the package does not need it.
     """
+    from sympy import Rational, lambdify
+    from sympy.physics.quantum.spin import Rotation
+    from sympy.abc import x as placeholder
     j, m1, m2 = int(j), int(m1), int(m2)
     d = Rotation.d(Rational(j, 2), Rational(m1, 2), Rational(m2, 2), placeholder).doit().evalf()
     d = lambdify(placeholder, d, "numpy")
     return d
 
+@cache
+def wigner_small_d_coefficients(j: int) -> onp.ndarray:
+    """
+    Return the polynomial coefficients of all Wigner small-d functions for spin j (in units of 1/2).
+    Every d^j_{m1 m2}(theta) is a homogeneous polynomial of degree 2j in cos(theta/2) and sin(theta/2):
+
+        d^j_{m1 m2}(theta) = sum_p C[m1, m2, p] * cos(theta/2)^(2j - p) * sin(theta/2)^p
+
+    The coefficients are obtained from Wigner's formula using exact integer arithmetic.
+    The result has the shape (j + 1, j + 1, j + 1), where the first two axes run over m1 and m2 ordered as in Angular.projections.
+    """
+    j = int(j)
+    projections = Angular(j).projections(return_int=True)
+    coefficients = onp.zeros((j + 1, j + 1, j + 1))
+    for i1, m1 in enumerate(projections):
+        for i2, m2 in enumerate(projections):
+            # all quantities here are in units of 1, not 1/2
+            j_plus_m1, j_minus_m1 = (j + m1) // 2, (j - m1) // 2
+            j_plus_m2, j_minus_m2 = (j + m2) // 2, (j - m2) // 2
+            delta = (m2 - m1) // 2
+            numerator = factorial(j_plus_m1) * factorial(j_minus_m1) * factorial(j_plus_m2) * factorial(j_minus_m2)
+            for k in range(max(0, delta), min(j_plus_m2, j_minus_m1) + 1):
+                denominator = factorial(j_plus_m2 - k) * factorial(k) * factorial(j_minus_m1 - k) * factorial(k - delta)
+                # the power of sin(theta/2) is unique for every k, so no cancellations happen inside the table
+                coefficients[i1, i2, 2 * k - delta] = (-1) ** (k - delta) * sqrt(Fraction(numerator, denominator**2))
+    return coefficients
+
+def wigner_small_d_matrix(theta, j: int):
+    """
+    Return the Wigner small-d matrix for spin j (in units of 1/2) for all projections at once.
+    The result has the shape (j + 1, j + 1, *theta.shape), where the first axis runs over m1 and the second over m2.
+    Both projections are ordered as in Angular.projections, i.e. from -j to j in steps of 2.
+    Only integer powers of cos(theta/2) and sin(theta/2) appear, so the evaluation is exact at theta = 0 and theta = pi.
+    """
+    j = int(j)
+    c, s = np.cos(theta / 2), np.sin(theta / 2)
+    powers = np.stack([c ** (j - p) * s ** p for p in range(j + 1)])
+    return np.einsum("abp,p...->ab...", wigner_small_d_coefficients(j), powers)
+
 def wigner_small_d(theta, j, m1, m2):
-    """Calculate Wigner small-d function. Needs sympy.
+    """Calculate Wigner small-d function.
       theta : angle
       j : spin (in units of 1/2, e.g. 1 for spin=1/2)
       m1 and m2 : spin projections (in units of 1/2)
@@ -203,13 +232,16 @@ def wigner_small_d(theta, j, m1, m2):
     :param m2: after rotation
 
     """
-    d_func = get_wigner_function(j, m1, m2)
-    d = d_func(theta)
-    d = np.array(d, dtype=np.float64)
-    # d[np.isnan(d)] = 0
-    d = np.nan_to_num(d, copy=True, nan=0.0)
-    d = d.astype(np.complex128)
-    return d
+    j, m1, m2 = int(j), int(m1), int(m2)
+    if abs(m1) > j or abs(m2) > j:
+        return np.zeros_like(theta, dtype=np.float64)
+    c, s = np.cos(theta / 2), np.sin(theta / 2)
+    coefficients = wigner_small_d_coefficients(j)[(m1 + j) // 2, (m2 + j) // 2]
+    return sum(
+        coefficient * c ** (j - p) * s ** p
+        for p, coefficient in enumerate(coefficients)
+        if coefficient != 0
+    )
 
 @convert_angular
 def wigner_capital_d(phi, theta, psi, j, m1, m2):
@@ -217,4 +249,16 @@ def wigner_capital_d(phi, theta, psi, j, m1, m2):
         np.exp(-1j * phi * m1 / 2)
         * wigner_small_d(theta, j, m1, m2)
         * np.exp(-1j * psi * m2 / 2)
-    )
\ No newline at end of file
+    )
+
+
+def wigner_capital_d_matrix(phi, theta, psi, j: int):
+    """
+    Return the full Wigner capital-D matrix for spin j (in units of 1/2).
+    The result has the shape (j + 1, j + 1, *event_shape), where the first axis runs over m1 and the second over m2.
+    Both projections are ordered as in Angular.projections, i.e. from -j to j in steps of 2.
+    """
+    projections = onp.array(Angular(j).projections(return_int=True))
+    phase_phi = np.exp(-1j * np.multiply.outer(projections / 2, phi))
+    phase_psi = np.exp(-1j * np.multiply.outer(projections / 2, psi))
+    return np.einsum("a...,ab...,b...->ab...", phase_phi, wigner_small_d_matrix(theta, j), phase_psi)
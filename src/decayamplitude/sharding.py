@@ -0,0 +1,34 @@
+from typing import Optional
+import jax
+from jax.sharding import Mesh, NamedSharding, PartitionSpec
+import numpy as onp
+
+
+def event_mesh(devices: Optional[list] = None) -> Mesh:
+    """
+    A one dimensional mesh over the given devices, whose only axis "events" is used to split event samples.
+    On CPU several host devices can be created with XLA_FLAGS=--xla_force_host_platform_device_count=N before jax is imported.
+    """
+    if devices is None:
+        devices = jax.devices()
+    return Mesh(onp.array(devices), ("events",))
+
+
+def padded_size(n: int, mesh: Mesh) -> int:
+    """
+    The smallest number of events >= n, which can be split evenly across the devices of the mesh.
+    """
+    n_devices = mesh.devices.size
+    return -(-n // n_devices) * n_devices
+
+
+def shard_events(tree, mesh: Mesh):
+    """
+    Places every array of a pytree onto the mesh, split along its last axis, which is the event axis for all precomputed event data.
+    Arrays without axes are replicated.
+    """
+    def place(leaf):
+        ndim = onp.ndim(leaf)
+        spec = PartitionSpec() if ndim == 0 else PartitionSpec(*([None] * (ndim - 1)), "events")
+        return jax.device_put(leaf, NamedSharding(mesh, spec))
+    return jax.tree_util.tree_map(place, tree)
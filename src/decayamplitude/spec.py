@@ -0,0 +1,241 @@
+import json
+import importlib
+from typing import Callable, Optional, Union
+
+from decayangle.decay_topology import Topology, Node
+
+from decayamplitude.chain import DecayChain, MultiChain
+from decayamplitude.combiner import ChainCombiner
+from decayamplitude.particle import Particle
+from decayamplitude.resonance import Resonance, LSTuple, HelicityTuple
+from decayamplitude.rotation import QN
+
+# bump this, if the layout of the spec changes
+SPEC_VERSION = 1
+
+# lineshapes, which can be referenced by a short name in a spec
+lineshapes: dict[str, Callable] = {}
+
+
+def named_lineshape(name: str) -> Callable:
+    """
+    Decorator, which registers a lineshape function under a name. Specs refer to registered lineshapes by this name.
+    Unregistered lineshapes are referred to as "module:qualname" and have to be importable.
+    """
+    def register(f: Callable) -> Callable:
+        if name in lineshapes and lineshapes[name] is not f:
+            raise ValueError(f"A different lineshape is already registered as {name}")
+        lineshapes[name] = f
+        return f
+    return register
+
+
+def lineshape_reference(f: Optional[Callable]) -> Optional[str]:
+    """
+    The name, under which a lineshape is stored in a spec.
+    """
+    if f is None:
+        return None
+    for name, registered in lineshapes.items():
+        if registered is f:
+            return name
+    if "<" in f.__qualname__:
+        raise ValueError(f"The lineshape {f.__qualname__} is not importable. Register it with `named_lineshape` or define it at module level.")
+    return f"{f.__module__}:{f.__qualname__}"
+
+
+def resolve_lineshape(reference: Optional[str]) -> Optional[Callable]:
+    """
+    The lineshape function for a name from a spec. Registered names are looked up first, "module:qualname" references are imported.
+    """
+    if reference is None:
+        return None
+    if reference in lineshapes:
+        return lineshapes[reference]
+    if ":" not in reference:
+        raise KeyError(f"No lineshape is registered as {reference}")
+    module, qualname = reference.split(":")
+    f = importlib.import_module(module)
+    for attribute in qualname.split("."):
+        f = getattr(f, attribute)
+    return f
+
+
+def _to_plain(value):
+    # json and yaml only know lists
+    if isinstance(value, (tuple, list)):
+        return [_to_plain(v) for v in value]
+    return value
+
+
+def _to_tuple(value):
+    if isinstance(value, (tuple, list)):
+        return tuple(_to_tuple(v) for v in value)
+    return value
+
+
+def _topology_spec(chain: DecayChain) -> dict:
+    return {
+        "root": chain.topology.root.value,
+        "topology": _to_plain(chain.topology.tuple),
+        "convention": chain.convention,
+    }
+
+
+def _resonances_spec(chain: DecayChain, ls_couplings: Optional[dict]) -> list[dict]:
+    resonances = []
+    for node in chain.nodes:
+        if node.final_state:
+            continue
+        resonance = node.resonance
+        entry = {
+            "node": _to_plain(node.node.value),
+            "name": resonance.name,
+            "spin": resonance.quantum_numbers.angular.angular_momentum,
+            "parity": resonance.quantum_numbers.parity,
+            "lineshape": lineshape_reference(resonance.lineshape),
+            "parameters": list(resonance.parameter_names) if resonance.lineshape is not None else [],
+            "scheme": resonance.scheme,
+            "preserve_parity": resonance.preserve_partity,
+        }
+        if ls_couplings is not None and resonance.id in ls_couplings:
+            entry["couplings"] = [_to_plain(tuple(key)) for key in ls_couplings[resonance.id]["couplings"]]
+        resonances.append(entry)
+    return resonances
+
+
+def _chain_spec(chain: Union[DecayChain, MultiChain], ls_couplings: Optional[dict]) -> dict:
+    if isinstance(chain, MultiChain):
+        return {
+            **_topology_spec(chain),
+            "chains": [{"resonances": _resonances_spec(inner, ls_couplings)} for inner in chain.chains],
+        }
+    return {**_topology_spec(chain), "resonances": _resonances_spec(chain, ls_couplings)}
+
+
+def to_spec(combiner: ChainCombiner, ls_couplings: Optional[dict] = None) -> dict:
+    """
+    Describes a model as a dict of plain python types, which can be written as JSON or YAML.
+
+    Parameters:
+    combiner: ChainCombiner
+        The model
+    ls_couplings: dict
+        The couplings of the model. If given, the coupling keys of every resonance are stored, otherwise `from_spec` uses all allowed couplings
+
+    Returns:
+    dict
+        The spec with the final state quantum numbers and one entry per chain with its topology and resonances.
+        A MultiChain is stored with one list of resonances per member under "chains".
+        Spins are given in units of 1/2.
+    """
+    final_state = {}
+    for key, qn in combiner.reference.final_state_qn.items():
+        entry = {"spin": qn.angular.angular_momentum, "parity": qn.parity}
+        if isinstance(qn, Particle):
+            entry["name"] = qn.name
+            entry["type_id"] = qn.type_id
+        final_state[str(key)] = entry
+    return {
+        "version": SPEC_VERSION,
+        "final_state": final_state,
+        "chains": [_chain_spec(chain, ls_couplings) for chain in combiner.chains],
+    }
+
+
+def from_spec(spec: dict, momenta: dict, **kwargs) -> tuple[ChainCombiner, dict]:
+    """
+    Builds a model from a spec as written by `to_spec`.
+
+    Parameters:
+    spec: dict
+        The spec
+    momenta: dict
+        The four-momenta of the final state particles, which are used by the chains
+    kwargs:
+        Passed on to ChainCombiner
+
+    Returns:
+    tuple[ChainCombiner, dict]
+        The model and its couplings
+    """
+    if spec.get("version") != SPEC_VERSION:
+        raise ValueError(f"Spec version {spec.get('version')} is not supported, expected {SPEC_VERSION}")
+    final_state_qn = {}
+    for key, entry in spec["final_state"].items():
+        if "name" in entry or "type_id" in entry:
+            final_state_qn[int(key)] = Particle(entry["spin"], entry["parity"], name=entry.get("name"), type_id=entry.get("type_id"))
+        else:
+            final_state_qn[int(key)] = QN(entry["spin"], entry["parity"])
+
+    ls_couplings = {}
+    def build_chain(chain_spec: dict, topology: Topology, convention: str) -> DecayChain:
+        resonances = {}
+        couplings = {}
+        for entry in chain_spec["resonances"]:
+            node = _to_tuple(entry["node"])
+            lineshape = resolve_lineshape(entry.get("lineshape"))
+            resonance = Resonance(
+                Node(node),
+                entry["spin"],
+                entry["parity"],
+                lineshape=lineshape,
+                argnames=entry.get("parameters", []) if lineshape is not None else None,
+                name=entry.get("name"),
+                preserve_partity=entry.get("preserve_parity", True),
+                scheme=entry.get("scheme", "ls"),
+            )
+            resonances[node] = resonance
+            if "couplings" in entry:
+                key_type = LSTuple if resonance.scheme == "ls" else HelicityTuple
+                couplings[resonance.id] = {"couplings": {key_type(*key): 1 for key in entry["couplings"]}}
+        chain = DecayChain(topology, resonances, momenta, final_state_qn, convention)
+        # resonances without explicit couplings get all allowed ones
+        ls_couplings.update({**chain.generate_couplings(), **couplings})
+        return chain
+
+    chains = []
+    for chain_spec in spec["chains"]:
+        # the members of a MultiChain have to share one topology object
+        topology = Topology(chain_spec.get("root", 0), decay_topology=_to_tuple(chain_spec["topology"]))
+        convention = chain_spec.get("convention", "helicity")
+        if "chains" in chain_spec:
+            chains.append(MultiChain.from_chains([build_chain(inner, topology, convention) for inner in chain_spec["chains"]]))
+        else:
+            chains.append(build_chain(chain_spec, topology, convention))
+    return ChainCombiner(chains, **kwargs), ls_couplings
+
+
+def _is_yaml(path: str) -> bool:
+    return path.endswith(".yaml") or path.endswith(".yml")
+
+
+def _yaml():
+    try:
+        import yaml
+    except ImportError as e:
+        raise ImportError("Reading and writing YAML specs needs pyyaml. Install it (pip install decayamplitude[yaml]) or use JSON.") from e
+    return yaml
+
+
+def dump(combiner: ChainCombiner, path: str, ls_couplings: Optional[dict] = None) -> None:
+    """
+    Writes the spec of a model to a file. Files ending in .yaml or .yml are written as YAML, all others as JSON.
+    """
+    spec = to_spec(combiner, ls_couplings)
+    with open(path, "w") as f:
+        if _is_yaml(path):
+            _yaml().safe_dump(spec, f, sort_keys=False)
+        else:
+            json.dump(spec, f, indent=1)
+
+
+def load(path_or_spec: Union[str, dict], momenta: dict, **kwargs) -> tuple[ChainCombiner, dict]:
+    """
+    Builds a model from a spec file or an already loaded spec. See `from_spec`.
+    """
+    if isinstance(path_or_spec, dict):
+        return from_spec(path_or_spec, momenta, **kwargs)
+    with open(path_or_spec) as f:
+        spec = _yaml().safe_load(f) if _is_yaml(path_or_spec) else json.load(f)
+    return from_spec(spec, momenta, **kwargs)
@@ -1,11 +1,11 @@
 from typing import Callable
+from decayamplitude.backend import numpy as np
 
-def _create_function(names:list[str], ls_couplings:dict[int, dict[str: dict[tuple, float]]], f, complex_couplings=False) -> tuple[Callable, list[str]]:
-    from decayamplitude.resonance import LSTuple, Resonance
-    import inspect
-    import types
-    # Create a function signature dynamically
-    
+def _coupling_structure(ls_couplings:dict[int, dict[str: dict[tuple, float]]], complex_couplings=False) -> tuple[list[str], dict]:
+    """
+    The parameter names of all couplings and the name of the coupling for every resonance id and coupling key.
+    """
+    from decayamplitude.resonance import Resonance
     coupling_names = []
     coupling_structure = {}
     for resonance_id, coupling_dict in ls_couplings.items():
@@ -21,22 +21,112 @@ def _create_function(names:list[str], ls_couplings:dict[int, dict[str: dict[tupl
             else:
                 coupling_names.append(name) # we need only define a name 
             coupling_structure[resonance_id][key] = name
+    return coupling_names, coupling_structure
+
+
+class ParameterLayout:
+    """
+    The static layout of a flat parameter vector: the position of every lineshape parameter and coupling.
+    The order is the same as the argument names of the functions returned by `_create_function`.
+    Complex couplings take two consecutive entries for the real and the imaginary part.
+    """
+
+    def __init__(self, names:list[str], coupling_structure:dict, complex_couplings:bool) -> None:
+        self.names = names
+        self.offsets = {name: i for i, name in enumerate(names)}
+        self.coupling_structure = coupling_structure
+        self.complex_couplings = complex_couplings
+        # every coupling name only gets one value, so that couplings shared by several resonances are the same object
+        self.coupling_names = list(dict.fromkeys(
+            name for couplings in coupling_structure.values() for name in couplings.values()
+        ))
+        if complex_couplings:
+            self.real_offsets = [self.offsets[f"{name}_real"] for name in self.coupling_names]
+            self.imaginary_offsets = [self.offsets[f"{name}_imaginary"] for name in self.coupling_names]
+            coupling_parameters = {f"{name}_{part}" for name in self.coupling_names for part in ("real", "imaginary")}
+        else:
+            self.real_offsets = [self.offsets[name] for name in self.coupling_names]
+            self.imaginary_offsets = None
+            coupling_parameters = set(self.coupling_names)
+        self.parameter_names = [name for name in names if name not in coupling_parameters]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def pack(self, values:dict):
+        """
+        The flat parameter vector for a dict of parameter values.
+        """
+        return np.array([values[name] for name in self.names], dtype=np.float64)
+
+    def unpack(self, x) -> dict:
+        """
+        The parameter values by name for a flat parameter vector. The vector may carry leading batch axes.
+        """
+        return {name: x[..., i] for i, name in enumerate(self.names)}
+
+    def arguments(self, x) -> dict:
+        """
+        The arguments dict as used by the chains for a flat parameter vector, with the couplings read by one gather per part.
+        """
+        x = np.asarray(x)
+        values = x[..., np.array(self.real_offsets, dtype=int)]
+        if self.complex_couplings:
+            values = values + 1j * x[..., np.array(self.imaginary_offsets, dtype=int)]
+        coupling_values = {name: values[..., i] for i, name in enumerate(self.coupling_names)}
+        arguments = {name: x[..., self.offsets[name]] for name in self.parameter_names}
+        arguments.update({
+            resonance_id: {"couplings": {key: coupling_values[name] for key, name in couplings.items()}}
+            for resonance_id, couplings in self.coupling_structure.items()
+        })
+        return arguments
+
+
+def _create_function(names:list[str], ls_couplings:dict[int, dict[str: dict[tuple, float]]], f, complex_couplings=False, event_data=False, flat=False) -> tuple[Callable, list[str]]:
+    import inspect
+    # Create a function signature dynamically
+    if event_data:
+        # the event data is passed as the first argument under the reserved name data
+        if "data" in names:
+            raise ValueError("The parameter name 'data' is reserved for the event data. Please choose another name for the resonance parameter.")
+        if flat:
+            _, layout = _create_function(names, ls_couplings, f, complex_couplings=complex_couplings, flat=True)
+            def flat_func(data, x):
+                return f({**layout.arguments(x), "data": data})
+            return flat_func, layout
+        func, full_names = _create_function(["data"] + names, ls_couplings, f, complex_couplings=complex_couplings)
+        return func, full_names[1:]
+    
+    coupling_names, coupling_structure = _coupling_structure(ls_couplings, complex_couplings)
     full_names = names + coupling_names
     names_with_duplicates = full_names.copy()
     full_names = list(set(full_names)) # remove duplicates, since the same decay process can exist in multiple chains
     # Sort the names to ensure consistent ordering as given from the outside
     full_names.sort(key=lambda x: names_with_duplicates.index(x))
+
+    if flat:
+        # a single array argument with a static layout instead of one argument per name
+        layout = ParameterLayout(full_names, coupling_structure, complex_couplings)
+        def flat_func(x):
+            return f(layout.arguments(x))
+        return flat_func, layout
+
     # Define a generic function that accepts *args
     def func(*args, **kwargs):
         named_map = {name: arg for name, arg in zip(full_names, args)}
         named_map.update(kwargs)
         couplings = {}
+        # the same coupling can belong to several copies of a resonance
+        # we hand out the same object for all of them, so that shared sub decays can be recognized by identity
+        coupling_values = {}
 
         def compute_coupling(name):
-            if complex_couplings:
-                return named_map[f"{name}_real"] + 1j * named_map[f"{name}_imaginary"]
-            else:
-                return named_map[name]
+            if name not in coupling_values:
+                if complex_couplings:
+                    coupling_values[name] = named_map[f"{name}_real"] + 1j * named_map[f"{name}_imaginary"]
+                else:
+                    coupling_values[name] = named_map[name]
+            return coupling_values[name]
 
         for resonance_id, coupling_dict in coupling_structure.items():
 
@@ -75,5 +165,10 @@ def sanitize(name: str) -> str:
     name = name.replace("-", "minus")
     
     return name
-    
-    
\ No newline at end of file
+
+def expand_to_events(table, values):
+    """
+    Multiply a static table with per event values.
+    The table axes are kept in front, the event axes of the values are appended at the end.
+    """
+    return np.reshape(table, np.shape(table) + (1,) * np.ndim(values)) * values
@@ -0,0 +1,19 @@
+import os
+import pytest
+
+from decayamplitude.config import config
+
+
+@pytest.fixture(autouse=True, scope="session")
+def cache_dir(tmp_path_factory):
+    """Persistent caches of the test session (and of the processes it starts) are written to a temporary directory instead of the home directory."""
+    directory = str(tmp_path_factory.mktemp("cache"))
+    previous, previous_environment = config.cache_dir, os.environ.get("DECAYAMPLITUDE_CACHE_DIR")
+    config.cache_dir = directory
+    os.environ["DECAYAMPLITUDE_CACHE_DIR"] = directory
+    yield directory
+    config.cache_dir = previous
+    if previous_environment is None:
+        os.environ.pop("DECAYAMPLITUDE_CACHE_DIR")
+    else:
+        os.environ["DECAYAMPLITUDE_CACHE_DIR"] = previous_environment
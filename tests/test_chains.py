@@ -1,6 +1,7 @@
 from __future__ import annotations
+import importlib.util
 from decayamplitude.rotation import QN
-from decayamplitude.chain import DecayChain, MultiChain, AlignedMultiChain
+from decayamplitude.chain import DecayChain, MultiChain, AlignedChain, AlignedMultiChain
 from decayamplitude.combiner import ChainCombiner
 from decayamplitude.resonance import Resonance
 from decayangle.decay_topology import Topology, Node
@@ -221,7 +222,439 @@ def test_single_chains_are_decay_chains():
         assert not isinstance(chain, AlignedMultiChain), f"single_chains should not contain AlignedMultiChain instances, got {type(chain)}"
 
 
+def test_tensor_matches_direct_evaluation():
+    """The bottom-up tensor evaluation from precomputed angular tensors has to reproduce the direct evaluation of the decay tree."""
+    momenta = {
+        1: np.array([1, 0.1, 0.4, 3]),
+        2: np.array([0.5, -0.1, -0.4, 3]),
+        3: np.array([1.1, 0.2, 0.5, 3]),
+        4: np.array([0.6, -0.2, -0.5, 3]),
+    }
+    final_state_qn = {
+            1: QN(0, 1), 
+            2: QN(0, 1), 
+            3: QN(1, 1), 
+            4: QN(1, -1) 
+        }
+    resonances_hadronic = {
+        (1,2): [
+            Resonance(Node((1, 2)), quantum_numbers=QN(4, 1), lineshape=constant_lineshape, argnames=[], preserve_partity=True, name="Resonance2"),
+        ],
+        (1,2,3): 
+        [Resonance(Node((1, 2, 3)), quantum_numbers=QN(3, -1), lineshape=constant_lineshape, argnames=[], preserve_partity=False, name="Resonance4")],
+        0: [Resonance(Node(0), quantum_numbers=QN(0, 1), lineshape=constant_lineshape, argnames=[], preserve_partity=False, name="B0")],
+    }
+    topology = Topology(
+        0,
+        decay_topology=(((1,2), 3) ,4 )
+    )
+    momenta = topology.to_rest_frame(momenta)
+
+    # DecayChainNode.amplitude is the reference implementation, which evaluates the decay tree helicity by helicity
+    for convention in ("helicity", "minus_phi"):
+        chain, = MultiChain(
+            topology = topology,
+            resonances = resonances_hadronic,
+            momenta = momenta,
+            final_state_qn = final_state_qn,
+            convention = convention
+        ).chains
+        arguments = chain.generate_couplings()
+        for i, key in enumerate(arguments):
+            arguments[key]["couplings"] = {ls: 0.3 * i + 0.1j * n for n, ls in enumerate(arguments[key]["couplings"])}
+
+        root = chain.root
+        tensor = chain.helicity_tensor(arguments, chain.precompute(momenta))
+        prefactor = 1 / (root.quantum_numbers.angular.value2 + 1)**0.5
+        for h0 in root.quantum_numbers.projections(return_int=True):
+            for lambdas in chain.helicities:
+                direct = prefactor * sum(root.amplitude(h0, lambdas, chain.helicity_angles, arguments, momenta))
+                assert np.allclose(direct, chain.chain_function(h0, lambdas, arguments))
+                assert np.allclose(direct, tensor[chain.helicity_index(h0, lambdas)])
+
+
+def test_resonance_amplitude_matches_helicity_couplings():
+    """The per helicity couplings of Resonance.amplitude (the reference for DecayChainNode.amplitude) agree with the dense helicity_couplings."""
+    momenta = {
+        1: np.array([1, 0.1, 0.4, 3]),
+        2: np.array([0.5, -0.1, -0.4, 3]),
+        3: np.array([1.1, 0.2, 0.5, 3]),
+    }
+    final_state_qn = {
+            1: QN(1, 1),
+            2: QN(2, 1),
+            3: QN(0, 1)
+        }
+    topology = Topology(0, decay_topology=((1, 2), 3))
+    momenta = topology.to_rest_frame(momenta)
+
+    def key_dependent(a, b, scale):
+        return scale * (1 + a) + 0.5j * b
+
+    for scheme in ("ls", "helicity"):
+        resonances = {
+            (1, 2): Resonance(Node((1, 2)), quantum_numbers=QN(3, 1), lineshape=key_dependent, argnames=["scale"], preserve_partity=False, scheme=scheme),
+            0: Resonance(Node(0), quantum_numbers=QN(1, 1), lineshape=key_dependent, argnames=["scale0"], preserve_partity=False, scheme=scheme),
+        }
+        chain = DecayChain(topology=topology, resonances=resonances, momenta=momenta, final_state_qn=final_state_qn)
+        arguments = chain.generate_couplings()
+        for i, key in enumerate(arguments):
+            arguments[key]["couplings"] = {coupling: 0.3 * i + 0.1j * n for n, coupling in enumerate(arguments[key]["couplings"])}
+        arguments.update({"scale": 1.3, "scale0": 0.7})
+        for node in chain.nodes:
+            if node.final_state:
+                continue
+            resonance = node.resonance
+            d1, d2 = node.daughters
+            j1, j2 = d1.quantum_numbers.angular.value2, d2.quantum_numbers.angular.value2
+            d1_mass, d2_mass = chain.kinematics.mass(d1.node), chain.kinematics.mass(d2.node)
+            dense = resonance.helicity_couplings(arguments, j1, j2, d1_mass, d2_mass)
+            for h0 in node.quantum_numbers.projections(return_int=True):
+                for i1, h1 in enumerate(d1.quantum_numbers.projections(return_int=True)):
+                    for i2, h2 in enumerate(d2.quantum_numbers.projections(return_int=True)):
+                        # amplitude includes the Jacob-Wick phase of the second daughter, the dense couplings leave it to the caller
+                        expected = dense[i1, i2] * (-1) ** ((j2 - h2) / 2)
+                        assert np.allclose(resonance.amplitude(h0, h1, h2, arguments, d1_mass, d2_mass), expected)
+
+
+def test_aligned_tensor_matches_helicity_sum():
+    """Aligning particle by particle has to reproduce the explicit sum over all helicity combinations."""
+    momenta = {
+        1: np.array([1, 0.1, 0.4, 3]),
+        2: np.array([0.5, -0.1, -0.4, 3]),
+        3: np.array([1.1, 0.2, 0.5, 3]),
+        4: np.array([0.6, -0.2, -0.5, 3]),
+    }
+    final_state_qn = {
+            1: QN(0, 1), 
+            2: QN(0, 1), 
+            3: QN(1, 1), 
+            4: QN(1, -1) 
+        }
+    resonances = {
+        (1,2): Resonance(Node((1, 2)), quantum_numbers=QN(4, 1), lineshape=constant_lineshape, argnames=[], preserve_partity=True, name="Resonance2"),
+        (1,2,3): Resonance(Node((1, 2, 3)), quantum_numbers=QN(3, -1), lineshape=constant_lineshape, argnames=[], preserve_partity=False, name="Resonance4"),
+        0: Resonance(Node(0), quantum_numbers=QN(0, 1), lineshape=constant_lineshape, argnames=[], preserve_partity=False, name="B0"),
+    }
+    topology = Topology(
+        0,
+        decay_topology=(((1,2), 3) ,4 )
+    )
+    reference = Topology(
+        0,
+        decay_topology=((1, (2, 4)), 3)
+    )
+    momenta = topology.to_rest_frame(momenta)
+    chain = AlignedChain(topology, resonances, momenta, final_state_qn, reference)
+    # spin 0 particles are not rotated
+    assert set(chain.precomputed["alignment"]) == {3, 4}
+
+    arguments = chain.generate_couplings()
+    for i, key in enumerate(arguments):
+        arguments[key]["couplings"] = {ls: 0.3 * i + 0.1j * n for n, ls in enumerate(arguments[key]["couplings"])}
+
+    for h0 in chain.root.quantum_numbers.projections(return_int=True):
+        matrix = chain.matrix(h0, arguments)
+        aligned = chain.aligned_matrix(h0, arguments)
+        for lambdas in chain.helicities:
+            expected = sum(
+                matrix[chain.to_tuple(lambdas_)] * np.prod([
+                    chain.wigner_dict[key][(lambdas[key], lambdas_[key])] for key in chain.final_state_keys
+                ], axis=0)
+                for lambdas_ in chain.helicities
+            )
+            assert np.allclose(aligned[chain.to_tuple(lambdas)], expected)
+
+
+def test_lineshapes_are_shared_between_chains():
+    """Resonances with the same name are evaluated only once per call, also if they appear in several chains."""
+    momenta = {
+        1: np.array([1, 0.1, 0.4, 3]),
+        2: np.array([0.5, -0.1, -0.4, 3]),
+        3: np.array([1.1, 0.2, 0.5, 3]),
+        4: np.array([0.6, -0.2, -0.5, 3]),
+    }
+    final_state_qn = {
+            1: QN(0, 1), 
+            2: QN(0, 1), 
+            3: QN(1, 1), 
+            4: QN(1, -1) 
+        }
+    calls = []
+    def counting_lineshape(l, s, width, d1_mass=None, d2_mass=None):
+        calls.append((l, s))
+        return (l + 1) * width / (d1_mass + d2_mass)
+
+    def all_ls_lineshape(ls, width, d1_mass=None, d2_mass=None):
+        return np.array([(l + 1) * width / (d1_mass + d2_mass) for l, s in ls])
+
+    def make_resonances(lineshape):
+        return {
+            (1,2): [
+                Resonance(Node((1, 2)), quantum_numbers=QN(4, 1), lineshape=lineshape, argnames=["width"], preserve_partity=True, name="Resonance2"),
+            ],
+            (1,2,3): [
+                Resonance(Node((1, 2, 3)), quantum_numbers=QN(3, -1), lineshape=constant_lineshape, argnames=[], preserve_partity=False, name="Resonance4"),
+                Resonance(Node((1, 2, 3)), quantum_numbers=QN(1, -1), lineshape=constant_lineshape, argnames=[], preserve_partity=False, name="Resonance5"),
+            ],
+            0: [Resonance(Node(0), quantum_numbers=QN(0, 1), lineshape=constant_lineshape, argnames=[], preserve_partity=False, name="B0")],
+        }
+    topology = Topology(
+        0,
+        decay_topology=(((1,2), 3) ,4 )
+    )
+    momenta = topology.to_rest_frame(momenta)
+    multi_chain = MultiChain(topology=topology, resonances=make_resonances(counting_lineshape), momenta=momenta, final_state_qn=final_state_qn)
+    assert len(multi_chain.chains) == 2
+
+    arguments = multi_chain.generate_couplings()
+    arguments["width"] = 0.7
+    ls_keys = {
+        key
+        for chain in multi_chain.chains
+        for resonance in chain.resonance_list if resonance.name == "Resonance2"
+        for key in arguments[resonance.id]["couplings"]
+    }
+    tensor = multi_chain.helicity_tensor(arguments)
+    assert sorted(calls) == sorted(ls_keys)
+
+    # a lineshape returning all LS values at once gives the same result
+    vectorized = MultiChain(topology=topology, resonances=make_resonances(all_ls_lineshape), momenta=momenta, final_state_qn=final_state_qn)
+    vectorized_arguments = vectorized.generate_couplings()
+    vectorized_arguments["width"] = 0.7
+    assert np.allclose(vectorized.helicity_tensor(vectorized_arguments), tensor)
+
+    # lineshapes can ask for the invariant mass of the resonance itself
+    masses = []
+    def mass_lineshape(l, s, width, mass):
+        masses.append(mass)
+        return width / mass
+    with_mass = MultiChain(topology=topology, resonances=make_resonances(mass_lineshape), momenta=momenta, final_state_qn=final_state_qn)
+    with_mass_arguments = with_mass.generate_couplings()
+    with_mass_arguments["width"] = 0.7
+    with_mass.helicity_tensor(with_mass_arguments)
+    assert len(masses) > 0
+    assert all(np.allclose(mass, mass_from_node(Node((1, 2)), momenta)) for mass in masses)
+
+
+def test_shared_subtrees_are_evaluated_once():
+    """Chains of a MultiChain, which contain the same sub decay with the same couplings, share its tensor."""
+    momenta = {
+        1: np.array([1, 0.1, 0.4, 3]),
+        2: np.array([0.5, -0.1, -0.4, 3]),
+        3: np.array([1.1, 0.2, 0.5, 3]),
+        4: np.array([0.6, -0.2, -0.5, 3]),
+    }
+    final_state_qn = {
+            1: QN(0, 1), 
+            2: QN(0, 1), 
+            3: QN(1, 1), 
+            4: QN(1, -1) 
+        }
+    resonances = {
+        (1,2): [
+            Resonance(Node((1, 2)), quantum_numbers=QN(4, 1), lineshape=constant_lineshape, argnames=[], preserve_partity=True, name="Resonance2"),
+        ],
+        (1,2,3): [
+            Resonance(Node((1, 2, 3)), quantum_numbers=QN(3, -1), lineshape=constant_lineshape, argnames=[], preserve_partity=False, name="Resonance4"),
+            Resonance(Node((1, 2, 3)), quantum_numbers=QN(1, -1), lineshape=constant_lineshape, argnames=[], preserve_partity=False, name="Resonance5"),
+        ],
+        0: [Resonance(Node(0), quantum_numbers=QN(0, 1), lineshape=constant_lineshape, argnames=[], preserve_partity=False, name="B0")],
+    }
+    topology = Topology(
+        0,
+        decay_topology=(((1,2), 3) ,4 )
+    )
+    momenta = topology.to_rest_frame(momenta)
+    multi_chain = MultiChain(topology=topology, resonances=resonances, momenta=momenta, final_state_qn=final_state_qn)
+    assert len(multi_chain.chains) == 2
+
+    # the copies of Resonance2 get the same coupling objects, as _create_function does for couplings with the same name
+    shared_couplings = {}
+    arguments = multi_chain.generate_couplings()
+    for chain in multi_chain.chains:
+        for resonance in chain.resonance_list:
+            couplings = arguments[resonance.id]["couplings"]
+            for n, key in enumerate(couplings):
+                couplings[key] = shared_couplings.setdefault((resonance.name, key), 0.5 + 0.2j * n + 0.1 * len(shared_couplings))
+    cache = {}
+    tensor = multi_chain.helicity_tensor(arguments, cache=cache)
+    # one shared (1, 2) decay, two (1, 2, 3) decays and two roots
+    assert len([key for key in cache if key[0] == "subtree"]) == 5
+
+    # equal, but not identical couplings are not shared and give the same result
+    copied_arguments = {
+        key: {"couplings": {k: complex(v.real, v.imag) for k, v in value["couplings"].items()}}
+        for key, value in arguments.items()
+    }
+    cache = {}
+    assert np.allclose(multi_chain.helicity_tensor(copied_arguments, cache=cache), tensor)
+    assert len([key for key in cache if key[0] == "subtree"]) == 6
+
+
+def test_kinematics_are_shared_between_chains():
+    """Chains on the same momenta share one KinematicsStore, so helicity angles and masses are computed once per sample."""
+    from decayamplitude.kinematics import KinematicsStore
+    momenta = {
+        1: np.array([1, 0.1, 0.4, 3]),
+        2: np.array([0.5, -0.1, -0.4, 3]),
+        3: np.array([1.1, 0.2, 0.5, 3]),
+    }
+    final_state_qn = {1: QN(1, 1), 2: QN(0, 1), 3: QN(0, 1)}
+    topology = Topology(0, decay_topology=((1, 2), 3))
+    momenta = topology.to_rest_frame(momenta)
+    def resonances():
+        return {
+            (1, 2): Resonance(Node((1, 2)), quantum_numbers=QN(2, -1), lineshape=constant_lineshape, argnames=[], preserve_partity=False),
+            0: Resonance(Node(0), quantum_numbers=QN(1, 1), lineshape=constant_lineshape, argnames=[], preserve_partity=False),
+        }
+    chain1 = DecayChain(topology=topology, resonances=resonances(), momenta=momenta, final_state_qn=final_state_qn)
+    # an equal topology built independently
+    chain2 = DecayChain(topology=Topology(0, decay_topology=((1, 2), 3)), resonances=resonances(), momenta=momenta, final_state_qn=final_state_qn)
+
+    store = KinematicsStore.of(momenta)
+    assert chain1.kinematics is store and chain2.kinematics is store
+    assert chain1.helicity_angles is chain2.helicity_angles
+    assert chain1.precompute(momenta)["nodes"][str((1, 2))]["mass"] is store.mass((2, 1))
+    assert np.allclose(store.mass(((1, 2), 3)), mass_from_node(Node(((1, 2), 3)), momenta))
+
+    m0, m1, m2 = store.mass((1, 2)), store.mass(1), store.mass(2)
+    q = np.sqrt((m0**2 - (m1 + m2)**2) * (m0**2 - (m1 - m2)**2)) / (2 * m0)
+    assert np.allclose(store.breakup_momentum((1, 2)), q)
+
+    # changing the momenta in place gives a new store
+    momenta[3] = momenta[3] * 1
+    assert KinematicsStore.of(momenta) is not store
+
+
+def test_relative_wigner_angles_are_batched():
+    """The Wigner angles of all topologies are decoded together and shared by all aligned chains of a topology."""
+    from decayamplitude.kinematics import KinematicsStore
+    from decayangle.decay_topology import TopologyCollection
+    from decayangle.lorentz import build_2_2
+    rng = np.random.default_rng(3)
+    momenta = {
+        i: np.stack([rng.uniform(-0.5, 0.5, 10), rng.uniform(-0.5, 0.5, 10), rng.uniform(-0.5, 0.5, 10), np.full(10, 1.5 + i)], axis=-1)
+        for i in (1, 2, 3, 4)
+    }
+    reference, *topologies = TopologyCollection(0, [1, 2, 3, 4]).topologies
+    momenta = reference.to_rest_frame(momenta)
+    store = KinematicsStore.of(momenta)
+    batched = store.relative_wigner_angles_batch(reference, topologies)
+    for topology, angles in zip(topologies, batched):
+        expected = reference.relative_wigner_angles(topology, momenta)
+        assert angles.keys() == expected.keys()
+        for key in expected:
+            # compare the rotations, since the angles are ambiguous close to theta = 0 or pi
+            assert np.allclose(build_2_2(0, 0, 0, *angles[key]), build_2_2(0, 0, 0, *expected[key]))
+            # the boosts are composed exactly as in decayangle
+            assert np.array_equal(store.boost(topology, key).matrix_2x2, topology.boost(key, momenta).matrix_2x2)
+        # a second request is served from the cache
+        assert store.relative_wigner_angles(reference, topology) is angles
+
+    identity = store.relative_wigner_angles(reference, reference)
+    assert all(np.allclose(np.asarray(angles), 0) for angles in identity.values())
+
+    final_state_qn = {1: QN(1, 1), 2: QN(0, 1), 3: QN(0, 1), 4: QN(0, 1)}
+    topology = topologies[0]
+    resonances = {
+        node.value: Resonance(node, quantum_numbers=QN(0, 1), lineshape=constant_lineshape, argnames=[], preserve_partity=False)
+        for node in topology.nodes.values() if not node.final_state and node.value != 0
+    }
+    resonances[0] = Resonance(Node(0), quantum_numbers=QN(1, 1), lineshape=constant_lineshape, argnames=[], preserve_partity=False)
+    chain1 = AlignedChain(topology, resonances, momenta, final_state_qn, reference)
+    chain2 = AlignedChain(topology, resonances, momenta, final_state_qn, reference)
+    assert chain1.wigner_rotation is chain2.wigner_rotation is batched[0]
+
+
+def test_frames_are_shared_between_topologies(monkeypatch):
+    """Every rest frame is boosted to once, no matter how many topologies pass through it."""
+    from decayamplitude.kinematics import KinematicsStore
+    from decayangle.decay_topology import TopologyCollection
+    rng = np.random.default_rng(5)
+    momenta = {
+        i: np.stack([rng.uniform(-0.5, 0.5, 10), rng.uniform(-0.5, 0.5, 10), rng.uniform(-0.5, 0.5, 10), np.full(10, 1.5 + i)], axis=-1)
+        for i in (1, 2, 3, 4)
+    }
+    topologies = TopologyCollection(0, [1, 2, 3, 4]).topologies
+    momenta = topologies[0].to_rest_frame(momenta)
+    expected = {topology.tuple: topology.helicity_angles(momenta) for topology in topologies}
+
+    boosts = []
+    original_boost = Node.boost
+    def boost(self, target, *args, **kwargs):
+        boosts.append((self.value, Node.get_node(target).value))
+        return original_boost(self, target, *args, **kwargs)
+    monkeypatch.setattr(Node, "boost", boost)
+    store = KinematicsStore(momenta)
+    for topology in topologies:
+        angles = store.helicity_angles(topology)
+        assert angles.keys() == expected[topology.tuple].keys()
+        for key, value in expected[topology.tuple].items():
+            assert np.allclose(np.asarray(angles[key]), np.asarray(value))
+    # e.g. the frame of (1, 2) in ((1, 2), (3, 4)) is not shared, but the one of (1, 2, 3) in (((1, 2), 3), 4) and ((1, (2, 3)), 4) is
+    internal_nodes = sum(len([node for node in topology.nodes.values() if not node.final_state]) - 1 for topology in topologies)
+    assert len(boosts) == len(set(boosts)) < internal_nodes
+
+
+def test_model_spec_round_trip(tmp_path):
+    """A model written as a spec and loaded again gives the same parameters and amplitudes."""
+    from decayamplitude.spec import to_spec, dump, load, named_lineshape
+
+    @named_lineshape("spec_test_mass_dependent")
+    def mass_dependent(L, S, M, Gamma, mass=None):
+        return 1 / (M**2 - mass**2 - 1j * M * Gamma)
+
+    momenta = {
+        1: np.array([1, 0.1, 0.4, 3]),
+        2: np.array([0.5, -0.1, -0.4, 3]),
+        3: np.array([1.1, 0.2, 0.5, 3]),
+        4: np.array([0.6, -0.2, -0.5, 3]),
+    }
+    final_state_qn = {
+            1: QN(0, 1),
+            2: QN(0, 1),
+            3: QN(1, 1),
+            4: QN(1, -1)
+        }
+    resonances = {
+        (1, 2): [
+            Resonance(Node((1, 2)), quantum_numbers=QN(0, 1), lineshape=mass_dependent, argnames=["D_M", "D_Gamma"], name="D"),
+            Resonance(Node((1, 2)), quantum_numbers=QN(4, 1), lineshape=constant_lineshape, argnames=[], name="D2"),
+        ],
+        (3, 4): [Resonance(Node((3, 4)), quantum_numbers=QN(2, -1), lineshape=constant_lineshape, argnames=[], preserve_partity=False, name="X")],
+        (1, 2, 3): [Resonance(Node((1, 2, 3)), quantum_numbers=QN(1, -1), lineshape=constant_lineshape, argnames=[], preserve_partity=False, name="Y")],
+        0: [Resonance(Node(0), quantum_numbers=QN(0, 1), lineshape=constant_lineshape, argnames=[], preserve_partity=False, name="B")],
+    }
+    topology1 = Topology(0, decay_topology=((1, 2), (3, 4)))
+    momenta = topology1.to_rest_frame(momenta)
+    topology2 = Topology(0, decay_topology=(((1, 2), 3), 4))
+    combined = ChainCombiner([
+        MultiChain(topology=topology1, resonances=resonances, momenta=momenta, final_state_qn=final_state_qn),
+        MultiChain(topology=topology2, resonances=resonances, momenta=momenta, final_state_qn=final_state_qn),
+    ])
+    # only keep one coupling of the first resonance
+    couplings = combined.generate_couplings()
+    first = combined.chains[0].chains[0].resonance_list[0]
+    couplings[first.id]["couplings"] = dict(list(couplings[first.id]["couplings"].items())[:1])
+    func, argnames = combined.unpolarized_amplitude(couplings)
+    params = {name: 0.5 + 0.1 * i for i, name in enumerate(argnames)}
+
+    paths = [tmp_path / "model.json"]
+    # YAML specs need the optional dependency pyyaml
+    if importlib.util.find_spec("yaml") is not None:
+        paths.append(tmp_path / "model.yaml")
+    for path in paths:
+        dump(combined, str(path), couplings)
+        loaded, loaded_couplings = load(str(path), momenta)
+        assert to_spec(loaded, loaded_couplings) == to_spec(combined, couplings)
+        loaded_func, loaded_argnames = loaded.unpolarized_amplitude(loaded_couplings)
+        assert sorted(loaded_argnames) == sorted(argnames)
+        assert np.allclose(loaded_func(**params), func(**params))
+
+
 if __name__ == "__main__":
     test_multi_chain()
     test_single_chain_unpolarized_amplitude()
-    test_single_chains_are_decay_chains()
\ No newline at end of file
+    test_single_chains_are_decay_chains()
+    test_tensor_matches_direct_evaluation()
\ No newline at end of file
@@ -0,0 +1,138 @@
+from decayamplitude.rotation import wigner_small_d, wigner_small_d_matrix, wigner_capital_d, wigner_capital_d_matrix, get_wigner_function, Angular, clebsch_gordan
+from decayamplitude.cg_table import ClebschGordanTable, CG_CACHE_VERSION, racah
+import numpy as np
+
+
+def test_wigner_small_d_matches_sympy():
+    theta = np.linspace(0, np.pi, 7)
+    for j in range(0, 5):
+        matrix = wigner_small_d_matrix(theta, j)
+        assert matrix.shape == (j + 1, j + 1, len(theta))
+        for i1, m1 in enumerate(Angular(j).projections(return_int=True)):
+            for i2, m2 in enumerate(Angular(j).projections(return_int=True)):
+                reference = np.nan_to_num(np.array(get_wigner_function(j, m1, m2)(theta), dtype=np.float64) * np.ones_like(theta))
+                assert np.allclose(matrix[i1, i2], reference)
+                assert np.allclose(wigner_small_d(theta, j, m1, m2), reference)
+
+
+def test_wigner_small_d_edges_and_high_spin():
+    for j in [9, 13, 20]:
+        # d(0) is the identity and d(pi) is the anti-diagonal (-1)^(j - m2)
+        assert np.allclose(wigner_small_d_matrix(0., j), np.eye(j + 1))
+        projections = np.array(Angular(j).projections(return_int=True))
+        expected = np.diag((-1.) ** ((j - projections) // 2))[::-1]
+        assert np.allclose(wigner_small_d_matrix(np.pi, j), expected)
+
+        # unitarity for generic angles
+        d = wigner_small_d_matrix(np.array([0.3, 1.7, 2.9]), j)
+        for i in range(3):
+            assert np.allclose(d[..., i] @ d[..., i].T, np.eye(j + 1))
+
+
+def test_wigner_capital_d_matrix():
+    phi, theta, psi = np.array([0.1, 2.]), np.array([0.4, 3.]), np.array([-0.3, 0.5])
+    j = 3
+    matrix = wigner_capital_d_matrix(phi, theta, psi, j)
+    for i1, m1 in enumerate(Angular(j).projections(return_int=True)):
+        for i2, m2 in enumerate(Angular(j).projections(return_int=True)):
+            assert np.allclose(matrix[i1, i2], wigner_capital_d(phi, theta, psi, j, m1, m2))
+
+
+def test_clebsch_gordan_matches_sympy():
+    from sympy import Rational
+    from sympy.physics.quantum.cg import CG
+    for j1 in range(0, 4):
+        for j2 in range(0, 4):
+            for J in range(abs(j1 - j2), j1 + j2 + 1, 2):
+                for m1 in range(-j1, j1 + 1, 2):
+                    for m2 in range(-j2, j2 + 1, 2):
+                        reference = float(CG(*[Rational(x, 2) for x in (j1, m1, j2, m2, J, m1 + m2)]).doit().evalf())
+                        assert np.isclose(clebsch_gordan(j1, m1, j2, m2, J, m1 + m2), reference)
+    # high spins are still orthonormal
+    j1, j2 = 9, 8
+    for J in range(1, 18, 2):
+        for J_ in range(1, 18, 2):
+            overlap = sum(
+                clebsch_gordan(j1, m1, j2, 1 - m1, J, 1) * clebsch_gordan(j1, m1, j2, 1 - m1, J_, 1)
+                for m1 in range(-j1, j1 + 1, 2)
+                if abs(1 - m1) <= j2
+            )
+            assert np.isclose(overlap, float(J == J_))
+
+
+def test_clebsch_gordan_cache_file(tmp_path):
+    path = str(tmp_path / "cg.npz")
+    table = ClebschGordanTable().fill(6)
+    table.save(path)
+    loaded = ClebschGordanTable.load(path)
+    assert loaded.jmax == 6
+    assert set(loaded.blocks) == set(table.blocks)
+    for key, block in table.blocks.items():
+        assert np.array_equal(loaded.blocks[key], block)
+
+    # blocks computed on demand are not written immediately, but merged with the blocks in the file on the next save
+    on_demand = ClebschGordanTable()
+    assert np.isclose(on_demand(8, 0, 8, 0, 8, 0), racah(8, 0, 8, 0, 8, 0))
+    assert on_demand.unsaved == {(8, 8, 8)}
+    assert (8, 8, 8) not in ClebschGordanTable.load(path).blocks
+    on_demand.save(path)
+    assert not on_demand.unsaved
+    merged = ClebschGordanTable.load(path)
+    assert merged.jmax == 6
+    assert set(merged.blocks) == set(table.blocks) | {(8, 8, 8)}
+
+    # files written with a different version are ignored
+    data = dict(np.load(path))
+    data["version"] = CG_CACHE_VERSION + 1
+    np.savez(path, **data)
+    assert ClebschGordanTable.load(path) is None
+
+
+def test_clebsch_gordan_blocks_on_demand(tmp_path, monkeypatch):
+    import os
+    from decayamplitude import cg_table
+    from decayamplitude.config import config
+    monkeypatch.setattr(config, "cache_dir", str(tmp_path))
+    monkeypatch.setattr(cg_table, "_table", None)
+    # nothing is computed or written in advance
+    table = cg_table.get_table()
+    assert not table.blocks
+    assert not os.path.exists(cg_table.cache_path())
+
+    assert np.isclose(table(2, 0, 2, 0, 4, 0), racah(2, 0, 2, 0, 4, 0))
+    assert set(table.blocks) == {(2, 2, 4)}
+    cg_table.save_table()
+    assert set(ClebschGordanTable.load(cg_table.cache_path()).blocks) == {(2, 2, 4)}
+
+    # the file is only written again, if new blocks were computed
+    written = os.stat(cg_table.cache_path()).st_mtime_ns
+    table(2, 2, 2, -2, 4, 0)
+    cg_table.save_table()
+    assert os.stat(cg_table.cache_path()).st_mtime_ns == written
+    monkeypatch.setattr(cg_table, "_table", None)
+    assert set(cg_table.get_table().blocks) == {(2, 2, 4)}
+
+
+IMPORT_TIME_SCRIPT = """
+import sys
+import time
+start = time.perf_counter()
+import decayamplitude.combiner
+import decayamplitude.likelihood
+print(time.perf_counter() - start)
+print(any(module == "sympy" or module.startswith("sympy.") for module in sys.modules))
+"""
+
+
+def test_import_without_sympy(record_property):
+    """The evaluation path imports without sympy. The import time is recorded as a benchmark number in the test report."""
+    import subprocess
+    import sys
+    result = subprocess.run([sys.executable, "-c", IMPORT_TIME_SCRIPT], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    import_time, sympy_loaded = result.stdout.split()
+    record_property("import_time_seconds", float(import_time))
+    assert sympy_loaded == "False"
+
+    # the symbolic reference still works and loads sympy on demand
+    assert np.isclose(float(get_wigner_function(2, 0, 0)(0.3)), np.cos(0.3))
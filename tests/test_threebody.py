@@ -13,6 +13,8 @@ from decayangle.lorentz import LorentzTrafo
 from decayamplitude.rotation import wigner_capital_d
 
 from collections import defaultdict
+from decayamplitude.kinematics_helpers import mass_from_node
+from decayamplitude.batching import iterate_batches
 
 def constant_lineshape(*args):
     return 1
@@ -102,6 +104,25 @@ def resonances():
     }
     return resonances1, resonances2, resonances3, resonances_dpd
 
+THREE_BODY_QN = {1: QN(1, 1), 2: QN(2, 1), 3: QN(0, 1)}
+
+def three_body_topologies():
+    """The topologies through the (2, 3) and the (1, 2) isobar"""
+    return Topology(0, decay_topology=((2, 3), 1)), Topology(0, decay_topology=((1, 2), 3))
+
+def three_body_chain(topology, resonance_dicts, momenta, convention="helicity"):
+    """A DecayChain for a single resonance dict, a MultiChain for several"""
+    chains = [
+        DecayChain(topology=topology, resonances=resonances, momenta=momenta, final_state_qn=THREE_BODY_QN, convention=convention)
+        for resonances in resonance_dicts
+    ]
+    return chains[0] if len(chains) == 1 else MultiChain.from_chains(chains)
+
+def three_body_combiner(momenta, first, second, threads=None):
+    """The combiner of the resonance dicts in first through the (2, 3) and in second through the (1, 2) isobar"""
+    topology1, topology2 = three_body_topologies()
+    return ChainCombiner([three_body_chain(topology1, first, momenta), three_body_chain(topology2, second, momenta)], threads=threads)
+
 def test_threebody_1():
     decayangle_config.sorting = "off" 
     topology1 = Topology(
@@ -334,6 +355,530 @@ def testShortThreeBodyAmplitude():
 
     assert np.allclose(unpolarized2(*([1] * len(argnames))) , unpolarized(*([1] * len(argnames))))
 
+    # all helicity combinations at once from a single evaluation of the aligned chains
+    polarized, lambdas, polarized_argnames = full.polarized_amplitude(full.generate_couplings())
+    parameters = {name: 1. for name in polarized_argnames}
+    combinations = [(h0, *helicities) for h0, matrix in [(-1, matrix1), (1, matrix2)] for helicities in matrix]
+    batch = polarized(**dict(zip(lambdas, np.array(combinations).T)), **parameters)
+    assert batch.shape == (len(combinations), 10)
+    for i, (h0, *helicities) in enumerate(combinations):
+        single = polarized(**dict(zip(lambdas, [h0, *helicities])), **parameters)
+        assert np.allclose(batch[i], single)
+        assert np.allclose(single, (matrix1 if h0 == -1 else matrix2)[tuple(helicities)])
+
+
+def test_event_data_argument():
+    """One jitted function can evaluate the amplitude for any event sample, if the event data is passed explicitly."""
+    from jax import jit
+    resonances1, resonances2, resonances3, resonances_dpd = resonances()
+
+    def combiner(momenta):
+        return three_body_combiner(momenta, [resonances1, resonances_dpd], [resonances3])
+
+    momenta = make_four_vectors(1, 2, np.linspace(0, np.pi, 10))
+    other_momenta = make_four_vectors(0.3, 1.1, np.linspace(0.1, 2, 10))
+    full = combiner(momenta)
+    unpolarized, argnames = full.unpolarized_amplitude(full.generate_couplings(), complex_couplings=False)
+    unpolarized_data, argnames_data = full.unpolarized_amplitude(full.generate_couplings(), complex_couplings=False, event_data=True)
+    assert argnames == argnames_data
+    parameters = [1.] * len(argnames)
+    unpolarized_data = jit(unpolarized_data)
+
+    assert np.allclose(unpolarized_data(full.precompute(), *parameters), unpolarized(*parameters))
+
+    # the same compiled function for a different sample
+    other = combiner(other_momenta)
+    other_unpolarized, _ = other.unpolarized_amplitude(other.generate_couplings(), complex_couplings=False)
+    assert np.allclose(unpolarized_data(full.precompute(other_momenta), *parameters), other_unpolarized(*parameters))
+
+    # the samples only differ by their orientation, which the polarized amplitudes are sensitive to
+    polarized_data, lambdas, polarized_argnames = full.polarized_amplitude(full.generate_couplings(), event_data=True)
+    other_polarized, _, _ = other.polarized_amplitude(other.generate_couplings())
+    polarized_parameters = {name: 1. for name in polarized_argnames}
+    helicities = dict(zip(lambdas, [1, 1, 2, 0]))
+    polarized_data = jit(polarized_data)
+    value = polarized_data(full.precompute(other_momenta), **helicities, **polarized_parameters)
+    assert np.allclose(value, other_polarized(**helicities, **polarized_parameters))
+    assert not np.allclose(value, polarized_data(full.precompute(), **helicities, **polarized_parameters))
+
+
+def test_flat_parameter_vector():
+    """The flat entry point agrees with the named arguments and can be vectorized over parameter vectors."""
+    from jax import jit, vmap
+    resonances1, _, resonances3, resonances_dpd = resonances()
+    momenta = make_four_vectors(1, 2, np.linspace(0, np.pi, 10))
+    full = three_body_combiner(momenta, [resonances1, resonances_dpd], [resonances3])
+    for complex_couplings in [True, False]:
+        unpolarized, argnames = full.unpolarized_amplitude(full.generate_couplings(), complex_couplings=complex_couplings)
+        flat, layout = full.unpolarized_amplitude(full.generate_couplings(), complex_couplings=complex_couplings, flat=True)
+        assert layout.names == argnames
+        assert len(layout) == len(argnames)
+        params = {name: 0.5 + 0.1 * i for i, name in enumerate(argnames)}
+        x = layout.pack(params)
+        assert all(np.isclose(layout.unpack(x)[name], value) for name, value in params.items())
+        assert np.allclose(jit(flat)(x), unpolarized(**params))
+
+        flat_data, data_layout = full.unpolarized_amplitude(full.generate_couplings(), complex_couplings=complex_couplings, event_data=True, flat=True)
+        assert data_layout.names == argnames
+        batch = np.stack([x, 2 * x, x + 0.3])
+        values = jit(vmap(flat_data, in_axes=(None, 0)))(full.precompute(), batch)
+        assert values.shape == (3, 10)
+        for row, value in zip(batch, values):
+            assert np.allclose(value, unpolarized(*row))
+
+
+def test_numpy_backend():
+    """The numpy backend gives the same amplitudes as jax and returns plain numpy arrays."""
+    import numpy as onp
+    import pytest
+    from decayamplitude.config import config
+    from decayamplitude.likelihood import Likelihood
+    resonances1, _, resonances3, resonances_dpd = resonances()
+    topology1, topology2 = three_body_topologies()
+    momenta = make_four_vectors(1, 2, np.linspace(0, np.pi, 4))
+    def combiner():
+        return three_body_combiner(momenta, [resonances1, resonances_dpd], [resonances3])
+    def evaluate(full):
+        unpolarized, argnames = full.unpolarized_amplitude(full.generate_couplings())
+        matrix, _ = full.matrix_function(full.generate_couplings())
+        params = {name: 0.5 + 0.1 * i for i, name in enumerate(argnames)}
+        return unpolarized(**params), matrix(1, **params)
+
+    def leaves(full):
+        from jax.tree_util import tree_leaves
+        from decayamplitude.kinematics import KinematicsStore
+        kinematics = KinematicsStore.of(momenta)
+        return tree_leaves([chain.precomputed for chain in full.top_chains]) + tree_leaves(
+            [list(kinematics.helicity_angles(topology1).values()), list(kinematics.relative_wigner_angles(topology1, topology2).values())]
+        )
+
+    # the same chains are used with both backends, the tensors cached for jax must not be reused
+    full = combiner()
+    expected, expected_matrix = evaluate(full)
+    try:
+        config.backend = "numpy"
+        result, result_matrix = evaluate(full)
+        assert type(result) is onp.ndarray
+        assert all(isinstance(leaf, (onp.ndarray, onp.generic, float, int, complex)) for leaf in leaves(full))
+        assert onp.allclose(evaluate(combiner())[0], expected)
+        with pytest.raises(ValueError):
+            Likelihood(combiner(), momenta, momenta)
+    finally:
+        config.backend = "jax"
+    assert not isinstance(evaluate(full)[0], onp.ndarray)
+    assert onp.allclose(result, expected)
+    for key, value in expected_matrix.items():
+        assert onp.allclose(result_matrix[key], value)
+    with pytest.raises(ValueError):
+        config.backend = "torch"
+
+
+def test_compiled_kinematics():
+    """The jitted kinematics stage gives the angles, masses and alignment of the eager store, also when it runs batch by batch."""
+    from decayamplitude.kinematics import KinematicsStore
+    from decayangle.lorentz import build_2_2
+    resonances1, resonances2, resonances3, resonances_dpd = resonances()
+    topology1, topology2 = three_body_topologies()
+    momenta = make_four_vectors(1, 2, np.linspace(0, np.pi, 25))
+    full = ChainCombiner([
+        three_body_chain(topology1, [resonances1], momenta),
+        three_body_chain(topology2, [resonances3], momenta, convention="minus_phi"),
+    ])
+    unpolarized_data, argnames = full.unpolarized_amplitude(full.generate_couplings(), event_data=True)
+    parameters = [0.5 + 0.1 * i for i in range(len(argnames))]
+    eager = KinematicsStore.of(momenta)
+    expected = unpolarized_data(full.precompute(momenta), *parameters)
+
+    # a new dict of the same arrays gets a new store
+    compiled_momenta = dict(momenta)
+    data = full.precompute(compiled_momenta, compiled_kinematics=True)
+    store = KinematicsStore.of(compiled_momenta)
+    assert store is not eager
+    for chain in full.chains:
+        angles = store.helicity_angles(chain.topology, chain.convention)
+        for key, value in eager.helicity_angles(chain.topology, chain.convention).items():
+            assert np.allclose(np.asarray(angles[key]), np.asarray(value))
+        for node in chain.topology.nodes.values():
+            assert np.allclose(store.mass(node), eager.mass(node))
+    wigner = store.relative_wigner_angles(topology1, topology2, "helicity")
+    for key, value in eager.relative_wigner_angles(topology1, topology2, "helicity").items():
+        # compare the rotations, since the angles are ambiguous close to theta = 0 or pi
+        assert np.allclose(build_2_2(0, 0, 0, *wigner[key]), build_2_2(0, 0, 0, *value))
+    assert np.allclose(unpolarized_data(data, *parameters), expected)
+
+    # every padded batch of the stream keeps its own kinematics and all batches share one compiled program
+    reduce, _ = full.streaming_function(full.generate_couplings(), batch_size=10, compiled_kinematics=True)
+    result = reduce(dict(momenta), *parameters)
+    assert np.isclose(result["sum_intensity"], np.sum(expected))
+
+
+def test_streaming_reductions():
+    """Reducing over padded batches gives the same sums and gradients as evaluating the whole sample at once."""
+    from jax import grad
+    resonances1, resonances2, resonances3, resonances_dpd = resonances()
+    momenta = make_four_vectors(1, 2, np.linspace(0, np.pi, 25))
+    full = three_body_combiner(momenta, [resonances1], [resonances3])
+    unpolarized, argnames = full.unpolarized_amplitude(full.generate_couplings())
+    reduce, stream_argnames = full.streaming_function(full.generate_couplings(), batch_size=10)
+    assert argnames == stream_argnames
+    parameters = [0.5 + 0.1 * i for i in range(len(argnames))]
+
+    result = reduce(momenta, *parameters, gradient=True)
+    assert np.isclose(result["sum_weights"], 25)
+    assert np.isclose(result["sum_log_intensity"], np.sum(np.log(unpolarized(*parameters))))
+    assert np.isclose(result["sum_intensity"], np.sum(unpolarized(*parameters)))
+    expected_gradient = grad(lambda *p: np.sum(np.log(unpolarized(*p))), argnums=tuple(range(len(parameters))))(*parameters)
+    assert np.allclose(result["grad_sum_log_intensity"], np.array(expected_gradient))
+
+    # weighted batches of different sizes from an iterator
+    weights = np.linspace(0.5, 1.5, 25)
+    batches = (
+        ({key: value[start:start + 10] for key, value in momenta.items()}, weights[start:start + 10])
+        for start in range(0, 25, 10)
+    )
+    result = reduce(batches, *parameters)
+    assert np.isclose(result["sum_weights"], np.sum(weights))
+    assert np.isclose(result["sum_intensity"], np.sum(weights * unpolarized(*parameters)))
+
+
+def test_likelihood():
+    """The likelihood combines the data and normalization terms and provides consistent gradients."""
+    from jax import grad
+    from decayamplitude.likelihood import Likelihood
+    resonances1, resonances2, resonances3, resonances_dpd = resonances()
+    data = make_four_vectors(1, 2, np.linspace(0, np.pi, 12))
+    mc = make_four_vectors(0.3, 1.1, np.linspace(0.1, 2, 20))
+    full = three_body_combiner(data, [resonances1], [resonances3])
+    data_weights = np.linspace(0.5, 1.5, 12)
+    volume = 2.5
+    likelihood = Likelihood(full, data, mc, data_weights=data_weights, phase_space_volume=volume)
+    unpolarized, argnames = full.unpolarized_amplitude(full.generate_couplings())
+    assert likelihood.argnames == argnames
+    parameters = np.array([0.5 + 0.1 * i for i in range(len(argnames))])
+
+    value, gradient = likelihood.value_and_grad(parameters)
+    assert np.isclose(likelihood.value(parameters), value)
+    assert np.allclose(likelihood.grad(parameters), gradient)
+    assert np.allclose(gradient, grad(likelihood.negative_log_likelihood)(parameters))
+    assert np.isclose(value + np.sum(data_weights * np.log(unpolarized(*parameters))), likelihood.expected_events(parameters))
+
+    # the model has no resonance parameters, so the normalization is the interference matrix and the MC sample is not kept
+    assert likelihood.mc is None and likelihood.interference is not None
+    sampled = Likelihood(full, data, mc, data_weights=data_weights, phase_space_volume=volume, interference=False)
+    sampled_value, sampled_gradient = sampled.value_and_grad(parameters)
+    assert np.isclose(sampled_value, value)
+    assert np.allclose(sampled_gradient, gradient)
+
+    # only couplings are free and both vertices carry one, so the intensity scales with the fourth power of their overall scale
+    # the extended likelihood is minimal along the scale, when the expected number of events is the sum of the data weights
+    assert np.isclose(likelihood.expected_events(2 * parameters), 16 * likelihood.expected_events(parameters))
+    fitted = parameters * (np.sum(data_weights) / likelihood.expected_events(parameters))**0.25
+    assert np.isclose(likelihood.expected_events(fitted), np.sum(data_weights))
+    assert np.isclose(np.dot(likelihood.grad(fitted), fitted), 0, atol=1e-8)
+    assert likelihood.value(fitted) < min(likelihood.value(0.9 * fitted), likelihood.value(1.1 * fitted))
+
+    # only couplings are free, so the normalized likelihood does not depend on their overall scale
+    normalized = Likelihood(full, data, mc, extended=False)
+    assert np.isclose(normalized.value(parameters), normalized.value(3 * parameters))
+
+    sharded = Likelihood(full, data, mc, data_weights=data_weights, sharded=True, phase_space_volume=volume)
+    sharded_value, sharded_gradient = sharded.value_and_grad(parameters)
+    assert np.isclose(sharded_value, value)
+    assert np.allclose(sharded_gradient, gradient)
+
+    # new samples, whose kinematics come from the jitted stage
+    compiled = Likelihood(full, dict(data), dict(mc), data_weights=data_weights, compiled_kinematics=True, phase_space_volume=volume)
+    assert np.isclose(compiled.value(parameters), value)
+
+
+def test_compile_cache(tmp_path, monkeypatch):
+    """Likelihoods of the same model share their compiled functions, also across processes through the cache directory."""
+    import pytest
+    from decayamplitude import compile_cache
+    from decayamplitude.config import config
+    from decayamplitude.likelihood import Likelihood
+    monkeypatch.setattr(config, "cache_dir", str(tmp_path))
+    monkeypatch.setattr(compile_cache, "_compiled", {})
+    resonances1, _, resonances3, _ = resonances()
+    _, topology2 = three_body_topologies()
+    data = make_four_vectors(1, 2, np.linspace(0, np.pi, 12))
+    mc = make_four_vectors(0.3, 1.1, np.linspace(0.1, 2, 20))
+    full = three_body_combiner(data, [resonances1], [resonances3])
+    likelihood = Likelihood(full, data, mc, compile_cache=True)
+    parameters = np.array([0.5 + 0.1 * i for i in range(len(likelihood.argnames))])
+    value, gradient = likelihood.value_and_grad(parameters)
+    uncached = Likelihood(full, data, mc, compile_cache=False)
+    assert np.isclose(value, uncached.value(parameters))
+    assert np.allclose(gradient, uncached.grad(parameters))
+    assert len(list((tmp_path / "compiled").iterdir())) == 2
+
+    # a new sample of the same size reuses the compiled functions of this process
+    other = Likelihood(full, make_four_vectors(0.5, 1, np.linspace(0, 1, 12)), mc, compile_cache=True)
+    assert other.value_and_grad(parameters)[0] != value
+    assert len(compile_cache._compiled) == 2
+
+    # a new process only finds the files on disk and does not trace the model again
+    monkeypatch.setattr(compile_cache, "_compiled", {})
+    compile = compile_cache._compile
+    def no_tracing(*args, **kwargs):
+        raise AssertionError("the model should not be traced or compiled again")
+    monkeypatch.setattr(compile_cache, "_compile", no_tracing)
+    restored = Likelihood(full, data, mc, compile_cache=True)
+    restored_value, restored_gradient = restored.value_and_grad(parameters)
+    assert np.isclose(restored_value, value)
+    assert np.allclose(restored_gradient, gradient)
+
+    # broken entries are reported, compiled again and replaced
+    monkeypatch.setattr(compile_cache, "_compiled", {})
+    monkeypatch.setattr(compile_cache, "_compile", compile)
+    for path in (tmp_path / "compiled").iterdir():
+        path.write_bytes(b"not a pickle")
+    with pytest.warns(UserWarning, match="Could not load"):
+        recompiled = Likelihood(full, data, mc, compile_cache=True)
+    assert np.isclose(recompiled.value(parameters), value)
+    assert all(path.read_bytes() != b"not a pickle" for path in (tmp_path / "compiled").iterdir())
+
+    # different sample sizes and lineshapes give different keys
+    def hash_of(combiner, n):
+        return compile_cache.structural_hash(combiner.structure, compile_cache.abstract_arguments(np.zeros(n)))
+    assert hash_of(full, 3) != hash_of(full, 4)
+    def model_hash(lineshape):
+        resonances = {
+            (1, 2): Resonance(Node((1, 2)), 1, -1, lineshape=lineshape, argnames=[]),
+            0: Resonance(Node(0), 1, 1, lineshape=constant_lineshape, argnames=[])
+        }
+        return compile_cache.structural_hash(three_body_chain(topology2, [resonances], data).structure)
+    assert model_hash(constant_lineshape) == model_hash(constant_lineshape)
+    assert model_hash(constant_lineshape) != model_hash(lambda *args: 2)
+    assert model_hash(lambda *args: 2) != model_hash(lambda *args: 3)
+
+    # changes of helpers in other modules, which the lineshapes call, give different keys
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / "lineshape_helpers.py").write_text("def scale():\n    return 2\n")
+    import lineshape_helpers
+    def helper_lineshape(*args):
+        return lineshape_helpers.scale()
+    before = model_hash(helper_lineshape)
+    (tmp_path / "lineshape_helpers.py").write_text("def scale():\n    return 3.0\n")
+    assert model_hash(helper_lineshape) != before
+
+SHARDED_LIKELIHOOD_SCRIPT = """
+import os
+os.environ["XLA_FLAGS"] = "--xla_force_host_platform_device_count=4"
+import sys
+sys.path.insert(0, sys.argv[1])
+import jax
+import numpy as onp
+from test_threebody import *
+from decayamplitude.likelihood import Likelihood
+assert len(jax.devices()) == 4
+resonances1, _, resonances3, _ = resonances()
+data = make_four_vectors(1, 2, np.linspace(0, np.pi, 11))
+mc = make_four_vectors(0.3, 1.1, np.linspace(0.1, 2, 18))
+full = three_body_combiner(data, [resonances1], [resonances3])
+data_weights = np.linspace(0.5, 1.5, 11)
+single = Likelihood(full, data, mc, data_weights=data_weights)
+sharded = Likelihood(full, data, mc, data_weights=data_weights, sharded=True)
+assert len(sharded.data_weights.sharding.device_set) == 4
+parameters = np.array([0.5 + 0.1 * i for i in range(len(single.argnames))])
+value, gradient = single.value_and_grad(parameters)
+sharded_value, sharded_gradient = sharded.value_and_grad(parameters)
+# the results live on different devices, so they are compared on the host
+assert onp.isclose(value, sharded_value)
+assert onp.allclose(gradient, sharded_gradient)
+"""
+
+
+def test_sharded_likelihood_on_host_devices():
+    """Splitting the (padded) samples across 4 host devices gives the same likelihood and gradient."""
+    import os
+    import subprocess
+    import sys
+    tests = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, "-c", SHARDED_LIKELIHOOD_SCRIPT, tests], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+def test_interference_integral():
+    """The normalization as a Hermitian form in the couplings, with the interference matrix cached on the resonance parameters."""
+    def width_lineshape(l, s, width, d1_mass=None, d2_mass=None):
+        return 1 / (d1_mass + d2_mass - 2.5 + 1j * width)
+    resonances1 = {
+        (2,3): Resonance(Node((2, 3)), 2, -1, lineshape=width_lineshape, argnames=["width"]),
+        0: Resonance(Node(0), 1, 1, lineshape=constant_lineshape, argnames=[])
+    }
+    _, _, resonances3, resonances_dpd = resonances()
+    mc = make_four_vectors(0.3, 1.1, np.linspace(0.1, 2, 20))
+    full = three_body_combiner(mc, [resonances1, resonances_dpd], [resonances3])
+    couplings = full.generate_couplings()
+    unpolarized, argnames = full.unpolarized_amplitude(couplings)
+    normalization, normalization_argnames = full.normalization_function(couplings, mc, batch_size=7)
+    assert argnames == normalization_argnames
+
+    integral = full.interference_integral(couplings, mc)
+    parameters = {name: 0.5 + 0.1 * i for i, name in enumerate(argnames)}
+    # with batches only the momenta are kept, the event data is precomputed batch by batch
+    batched = full.interference_integral(couplings, mc, batch_size=7)
+    assert len(batched.batches) == 3 and all(set(batch) == set(mc) for batch, _ in batched.batches)
+    parameters["width"] = 0.3
+    assert np.allclose(batched.matrix(full.generate_couplings() | {"width": 0.3}), integral.matrix(full.generate_couplings() | {"width": 0.3}))
+    for width in [0.3, 0.6]:
+        parameters["width"] = width
+        assert np.isclose(normalization(**parameters), np.mean(unpolarized(**parameters)))
+
+    # only the couplings change, so the matrix is reused
+    arguments = full.generate_couplings()
+    arguments["width"] = 0.3
+    matrix = integral.matrix(arguments)
+    for i, key in enumerate(arguments):
+        if key != "width":
+            arguments[key]["couplings"] = {k: 0.3 - 0.2j * i for k in arguments[key]["couplings"]}
+    assert integral.matrix(arguments) is matrix
+    assert np.allclose(matrix, np.conj(matrix.T))
+    arguments["width"] = 0.4
+    assert integral.matrix(arguments) is not matrix
+
+    # several widths at once, vectorized over the batch
+    matrices = integral.matrices({"width": np.array([0.3, 0.4])})
+    assert np.allclose(matrices[0], matrix)
+    assert np.allclose(matrices[1], integral.matrix(arguments))
+    assert np.allclose(batched.matrices({"width": np.array([0.3, 0.4])}), matrices)
+    batch = {name: np.array([value, value]) for name, value in parameters.items()}
+    batch["width"] = np.array([0.3, 0.4])
+    fractions = full.fit_fractions(batch, integral)
+    parameters["width"] = 0.4
+    assert np.allclose(fractions["fractions"][1], full.fit_fractions(parameters, integral)["fractions"])
+
+
+def test_fit_fractions():
+    """Fit fractions from the interference matrix agree with evaluating the chains on their own."""
+    resonances1, _, resonances3, resonances_dpd = resonances()
+    topology1, topology2 = three_body_topologies()
+    mc = make_four_vectors(0.3, 1.1, np.linspace(0.1, 2, 20))
+    chains = [
+        three_body_chain(topology1, [resonances1], mc),
+        three_body_chain(topology1, [resonances_dpd], mc),
+        three_body_chain(topology2, [resonances3], mc),
+    ]
+    full = ChainCombiner([MultiChain.from_chains(chains[:2]), chains[2]])
+    unpolarized, argnames = full.unpolarized_amplitude(full.generate_couplings())
+    params = {name: 0.5 + 0.1 * i for i, name in enumerate(argnames)}
+
+    result = full.fit_fractions(params, mc)
+    assert result["labels"] == [tuple(resonance.name for resonance in chain.resonance_list) for chain in chains]
+    assert np.isclose(result["total"], np.mean(unpolarized(**params)))
+    for i, chain in enumerate(chains):
+        single, single_argnames = chain.unpolarized_amplitude(chain.generate_couplings())
+        expected = np.mean(single(**{name: params[name] for name in single_argnames})) / result["total"]
+        assert np.isclose(result["fractions"][i], expected)
+        assert np.isclose(result["interference"][i, i], expected)
+    # fractions and interference terms add up to one
+    assert np.isclose(np.sum(np.triu(result["interference"])), 1)
+
+    # a batch of parameter vectors
+    batch = {name: np.array([value, 2 * value, value + 0.3]) for name, value in params.items()}
+    batched = full.fit_fractions(batch, mc, group_by="resonance")
+    assert batched["fractions"].shape == (3, len(batched["labels"]))
+    assert np.allclose(batched["fractions"][0], full.fit_fractions(params, mc, group_by="resonance")["fractions"])
+
+
+def test_threaded_evaluation(monkeypatch):
+    """Evaluating the chains in a thread pool gives the same amplitudes as the sequential sum."""
+    from jax import jit
+    resonances1, resonances2, resonances3, resonances_dpd = resonances()
+    momenta = make_four_vectors(0.3, 1.1, np.linspace(0.1, 2, 10))
+    def combiner(threads):
+        return three_body_combiner(momenta, [resonances1, resonances_dpd], [resonances3, resonances2], threads=threads)
+    sequential, threaded = combiner(None), combiner(4)
+    matrix, argnames = sequential.matrix_function(sequential.generate_couplings())
+    threaded_matrix, _ = threaded.matrix_function(threaded.generate_couplings())
+    params = {name: 0.5 + 0.1 * i for i, name in enumerate(argnames) if name != "h0"}
+    for h0 in [-1, 1]:
+        expected, result = matrix(h0, **params), threaded_matrix(h0, **params)
+        for key in expected:
+            assert np.allclose(result[key], expected[key])
+    # repeated calls sum in the same order and give identical results
+    first, second = threaded_matrix(1, **params), threaded_matrix(1, **params)
+    assert all(np.array_equal(first[key], second[key]) for key in first)
+    # the order of the tasks is fixed on construction, the costs of the chains are not evaluated per call
+    import decayamplitude.combiner
+    def no_cost(chain):
+        raise AssertionError("chain_cost should only be evaluated on construction")
+    monkeypatch.setattr(decayamplitude.combiner, "chain_cost", no_cost)
+    assert all(np.array_equal(threaded_matrix(1, **params)[key], first[key]) for key in first)
+
+    # inside of jit the chains are summed sequentially
+    unpolarized, argnames = threaded.unpolarized_amplitude(threaded.generate_couplings())
+    reference, _ = sequential.unpolarized_amplitude(sequential.generate_couplings())
+    params = {name: 0.5 + 0.1 * i for i, name in enumerate(argnames)}
+    assert np.allclose(jit(lambda p: unpolarized(**p))(params), reference(**params))
+
+
+def test_dalitz_variables():
+    """Chains on Dalitz variables give the kinematics and amplitudes of chains on the equivalent four-momenta."""
+    import numpy as onp
+    from decayamplitude.dalitz import DalitzVariables
+    from decayamplitude.kinematics import KinematicsStore
+    resonances1, resonances2, resonances3, resonances_dpd = resonances()
+    topology1, topology2 = three_body_topologies()
+    masses = {0: 6.32397, 1: 1, 2: 2, 3: 3}
+    rng = onp.random.default_rng(7)
+    # points inside the Dalitz plot around the point of make_four_vectors
+    m12sq = rng.uniform(9.4, 9.7, 20)
+    m23sq = rng.uniform(26.4, 26.7, 20)
+    variables = DalitzVariables(
+        {(1, 2): m12sq, (2, 3): m23sq, "alpha": rng.uniform(-3, 3, 20), "beta": rng.uniform(0.1, 3, 20), "gamma": rng.uniform(-3, 3, 20)},
+        masses,
+    )
+    momenta = variables.momenta()
+    assert onp.allclose(variables.sigma(1, 3), mass_from_node(Node((1, 3)), momenta)**2)
+
+    store = KinematicsStore.of(variables)
+    for topology in [topology1, topology2]:
+        for convention in ["helicity", "minus_phi"]:
+            expected = topology.helicity_angles(momenta, convention=convention)
+            angles = store.helicity_angles(topology, convention)
+            for key in expected:
+                for angle, expected_angle in zip(angles[key], expected[key]):
+                    assert onp.allclose(onp.exp(1j * angle), onp.exp(1j * expected_angle))
+
+    # the Wigner rotations are multiplied from the closed form steps, but agree with the ones of the boosted four-momenta
+    from decayangle.lorentz import build_2_2
+    for convention in ["helicity", "minus_phi"]:
+        expected = KinematicsStore.of(momenta).relative_wigner_angles(topology1, topology2, convention)
+        for key, angles in store.relative_wigner_angles(topology1, topology2, convention).items():
+            assert onp.allclose(build_2_2(0, 0, 0, *angles), build_2_2(0, 0, 0, *expected[key]))
+
+    def combiner(momenta):
+        return three_body_combiner(momenta, [resonances1, resonances_dpd], [resonances3])
+    full, dalitz = combiner(momenta), combiner(variables)
+    # the alignment of the spin 1/2 particle is sensitive to rotations by 2 pi
+    polarized, lambdas, argnames = full.polarized_amplitude(full.generate_couplings())
+    dalitz_polarized, _, _ = dalitz.polarized_amplitude(dalitz.generate_couplings())
+    params = {name: 0.5 + 0.1 * i for i, name in enumerate(argnames)}
+    for helicities in [[1, 1, 2, 0], [-1, 1, 0, 0], [1, -1, -2, 0]]:
+        helicities = dict(zip(lambdas, helicities))
+        assert onp.allclose(dalitz_polarized(**helicities, **params), polarized(**helicities, **params))
+
+    # the jitted kinematics stage evaluates Dalitz variables through their four-momenta
+    unpolarized_data, argnames = dalitz.unpolarized_amplitude(dalitz.generate_couplings(), event_data=True)
+    parameters = [0.5 + 0.1 * i for i in range(len(argnames))]
+    expected = unpolarized_data(dalitz.precompute(variables), *parameters)
+    compiled = unpolarized_data(dalitz.precompute(variables.like(dict(variables)), compiled_kinematics=True), *parameters)
+    assert onp.allclose(compiled, expected)
+
+    # points outside of the Dalitz plot are not mapped onto physical momenta
+    import warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        outside = variables.like({(1, 2): onp.array([9.5, 1.]), (2, 3): onp.array([40., 26.5])}).momenta()
+    assert all(onp.isnan(momentum[0]).any() and onp.isnan(momentum[1]).any() for momentum in outside.values())
+    assert onp.isfinite(onp.stack(list(variables.momenta().values()))).all()
+
+    # streaming keeps the masses of the sample
+    batches = list(iterate_batches(variables, 8))
+    assert all(isinstance(batch, DalitzVariables) and batch.masses == masses for batch, _ in batches)
+
 
 if __name__ == "__main__":
     testShortThreeBodyAmplitude()